@@ -0,0 +1,148 @@
+# archive.py
+# Cold storage for the JSON store. Orders that reached a terminal status
+# long enough ago leave the store (see archive_orders in database.py) and are
+# kept here, one segment file per month of created_ts:
+#   <ARCHIVE_DIR>/orders-YYYY-MM.json   {"orders": [...], "order_items": [...]}
+#   <ARCHIVE_DIR>/directory.json        {"YYYY-MM": [min id, max id, count]}
+# A lookup by id only opens the segments whose id range covers it, and the
+# last few segments read stay parsed in memory, and page() hands a segment
+# out a slice at a time. Everything here is blocking file I/O, meant to run
+# in an executor thread.
+import bisect
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+SEGMENT_CACHE_SIZE = int(os.getenv("ARCHIVE_CACHE_SEGMENTS", "4"))
+DIRECTORY_FILE = "directory.json"
+
+
+def _stamp(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _write_atomic(path: str, value: Any) -> None:
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(value, f, ensure_ascii=False, separators=(",", ":"))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class Archive:
+    def __init__(self, path: str, cache_size: int = SEGMENT_CACHE_SIZE) -> None:
+        self.path = path
+        self.cache_size = cache_size
+        # month -> (file stamp, {"orders": {id: row}, "items": {order id: [rows]},
+        #                        "ids": sorted order ids})
+        self._segments: "OrderedDict[str, Tuple[Any, Dict[str, Any]]]" = OrderedDict()
+        self._directory: Tuple[Any, Dict[str, List[int]]] = (None, {})
+        self._lock = threading.Lock()
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _segment_file(self, month: str) -> str:
+        return self._file(f"orders-{month}.json")
+
+    def _read_raw(self, month: str) -> Dict[str, List[Dict[str, Any]]]:
+        try:
+            with open(self._segment_file(month), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"orders": [], "order_items": []}
+
+    def directory(self) -> Dict[str, List[int]]:
+        path = self._file(DIRECTORY_FILE)
+        stamp = _stamp(path)
+        with self._lock:
+            if stamp == self._directory[0]:
+                return self._directory[1]
+        directory: Dict[str, List[int]] = {}
+        if stamp is not None:
+            with open(path, "r", encoding="utf-8") as f:
+                directory = json.load(f)
+        with self._lock:
+            self._directory = (stamp, directory)
+        return directory
+
+    def months(self) -> List[str]:
+        return sorted(self.directory())
+
+    def segment(self, month: str) -> Dict[str, Any]:
+        stamp = _stamp(self._segment_file(month))
+        with self._lock:
+            cached = self._segments.get(month)
+            if cached is not None and cached[0] == stamp:
+                self._segments.move_to_end(month)
+                return cached[1]
+        raw = self._read_raw(month)
+        items: Dict[int, List[Dict[str, Any]]] = {}
+        for item in raw["order_items"]:
+            items.setdefault(item["order_id"], []).append(item)
+        orders = {order["id"]: order for order in raw["orders"]}
+        segment = {"orders": orders, "items": items, "ids": sorted(orders)}
+        with self._lock:
+            self._segments[month] = (stamp, segment)
+            self._segments.move_to_end(month)
+            while len(self._segments) > self.cache_size:
+                self._segments.popitem(last=False)
+        return segment
+
+    def segments(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        for month in self.months():
+            yield month, self.segment(month)
+
+    def page(
+        self, month: str, after_id: Optional[int], limit: int
+    ) -> Tuple[List[Tuple[Dict[str, Any], List[Dict[str, Any]]]], Optional[int]]:
+        """Up to `limit` (order, its items) of a segment after order id
+        `after_id`, and the cursor for the next call (None at the end)."""
+        segment = self.segment(month)
+        ids = segment["ids"]
+        start = bisect.bisect_right(ids, after_id) if after_id is not None else 0
+        chunk = ids[start : start + limit]
+        cursor = chunk[-1] if start + limit < len(ids) else None
+        return [(segment["orders"][i], segment["items"].get(i, [])) for i in chunk], cursor
+
+    def find(self, order_id: int) -> Optional[Tuple[Dict[str, Any], List[Dict[str, Any]]]]:
+        """(order, its items) from the archive, or None."""
+        for month, (low, high, _) in self.directory().items():
+            if low <= order_id <= high:
+                segment = self.segment(month)
+                order = segment["orders"].get(order_id)
+                if order is not None:
+                    return order, segment["items"].get(order_id, [])
+        return None
+
+    def write(self, months: Dict[str, Dict[str, List[Dict[str, Any]]]]) -> None:
+        """Adds {month: {"orders": [...], "order_items": [...]}} to the
+        segments. An order archived again replaces its earlier copy, items
+        included, so repeating an interrupted run is harmless."""
+        os.makedirs(self.path, exist_ok=True)
+        directory = dict(self.directory())
+        for month, rows in months.items():
+            raw = self._read_raw(month)
+            replaced = {order["id"] for order in rows["orders"]}
+            orders = {order["id"]: order for order in raw["orders"]}
+            orders.update((order["id"], order) for order in rows["orders"])
+            items = [item for item in raw["order_items"] if item["order_id"] not in replaced]
+            items.extend(rows["order_items"])
+            _write_atomic(
+                self._segment_file(month),
+                {
+                    "orders": [orders[order_id] for order_id in sorted(orders)],
+                    "order_items": sorted(items, key=lambda item: item["id"]),
+                },
+            )
+            directory[month] = [min(orders), max(orders), len(orders)]
+        # Segments first, directory last: a crash in between leaves rows the
+        # directory does not point at yet, and they are still in the store.
+        _write_atomic(self._file(DIRECTORY_FILE), directory)
@@ -0,0 +1,90 @@
+# benchmarks/bench_codec.py
+# Compares the store snapshot formats in codec.py: encode (dump) and decode
+# (load) time and file size, on the synthetic stores of bench_database.py.
+#
+#   python benchmarks/bench_codec.py --sizes 10000,100000 --output codec.json
+#
+# Every format is timed --repeat times and the best run is reported, so
+# the numbers show the cost of the format rather than machine noise.
+# A store of size N has N products, N orders and N order items, plus the
+# sales statistics database.py keeps in it.
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+from bench_database import generate_store, git_revision  # noqa: E402
+from codec import FORMATS, decode, encode, msgpack  # noqa: E402
+from database import _build_index, _build_stats  # noqa: E402
+
+
+def best_of(repeat, func, *args):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="100000", help="e.g. 10000,100000,1000000")
+    # "binary" needs msgpack
+    available = [fmt for fmt in FORMATS if fmt != "binary" or msgpack is not None]
+    parser.add_argument("--formats", default=",".join(available))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    report = {
+        "meta": {
+            "git": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "args": vars(args),
+        },
+        "runs": [],
+    }
+    for size in (int(s) for s in args.sizes.split(",")):
+        with tempfile.TemporaryDirectory(prefix="bench_codec_") as workdir:
+            path = os.path.join(workdir, "shop.json")
+            generate_store(path, size, args.seed)
+            with open(path, "rb") as f:
+                data = decode(f.read())
+        # What the bot writes: the store plus its sales statistics.
+        _build_stats(data, _build_index(data))
+        print(f"\nsize={size}")
+        print(f"  {'format':<14} {'dump s':>8} {'load s':>8} {'MB':>8}")
+        for fmt in args.formats.split(","):
+            dump_s, payload = best_of(args.repeat, encode, data, fmt)
+            load_s, loaded = best_of(args.repeat, decode, payload)
+            if loaded != data:
+                raise SystemExit(f"{fmt} did not round-trip the store")
+            run = {
+                "format": fmt,
+                "size": size,
+                "dump_s": round(dump_s, 4),
+                "load_s": round(load_s, 4),
+                "bytes": len(payload),
+            }
+            report["runs"].append(run)
+            print(f"  {fmt:<14} {run['dump_s']:>8} {run['load_s']:>8} {len(payload) / 1e6:>8.1f}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nresults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,434 @@
+# benchmarks/bench_database.py
+# Benchmarks the public database.py coroutines against synthetic stores:
+# every catalog, order, settings and statistics query and mutation. init_db
+# and the first read of every store segment are reported as the load time,
+# so the per-operation numbers are steady state; the maintenance coroutines (compact_journal
+# and the archive ones) run in the background and are not timed.
+#
+#   python benchmarks/bench_database.py --sizes 1000,10000,100000 \
+#       --backends json,json-journal,sqlite --concurrency 16 --output bench.json
+#
+# For every (backend, size) pair a store with `size` products, orders and
+# order items is generated (seeded, so runs are reproducible) and a fresh
+# worker process measures it, so peak RSS is per configuration. Each
+# operation is timed sequentially (latency percentiles) and then with
+# --concurrency callers (throughput). Every operation stops after --ops
+# calls or --seconds, whichever comes first; writes against very large JSON
+# snapshots therefore finish, with fewer samples. --output writes all results
+# as JSON for comparison between storage changes.
+#
+# The worker also records the longest event loop stall during each
+# operation (a 5 ms ticker runs alongside). The run fails if any stall
+# exceeds --max-loop-lag-ms at a size of --lag-check-size or more (default
+# 100000): serializing or scanning a whole table on the loop shows up here.
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+BACKENDS = {
+    "json": {"DATABASE_BACKEND": "json", "DATABASE_JOURNAL": "0"},
+    "json-journal": {"DATABASE_BACKEND": "json", "DATABASE_JOURNAL": "1"},
+    "sqlite": {"DATABASE_BACKEND": "sqlite", "DATABASE_JOURNAL": "0"},
+}
+STATUSES = ["pending", "processing", "paid", "shipped", "delivered", "cancelled"]
+# Product names and search queries are drawn from these, so search_products
+# sees realistic posting-list sizes.
+NAME_WORDS = [
+    "ko‘ylak", "shim", "kurtka", "paypoq", "kepka", "sharf", "qo‘lqop", "mashina", "qo‘g‘irchoq",
+    "konstruktor", "to‘p", "ryukzak", "pijama", "sviter", "etik", "krossovka", "bodi", "shortik",
+]
+NAME_ADJECTIVES = ["qizil", "ko‘k", "yashil", "oq", "qora", "sariq", "paxta", "jun", "yozgi", "qishki"]
+
+
+# -- synthetic data ---------------------------------------------------------
+
+
+def generate_store(path, size, seed):
+    from database import DEFAULT_CATEGORIES, DEFAULT_MENU_ROWS
+
+    rng = random.Random(seed)
+    products = [
+        {
+            "id": pid,
+            "name": f"{rng.choice(NAME_ADJECTIVES).capitalize()} {rng.choice(NAME_WORDS)} {pid}",
+            "category": rng.choice(DEFAULT_CATEGORIES),
+            "price": rng.randrange(5000, 500000, 500),
+            "desc": f"Sintetik mahsulot tavsifi, {rng.choice(NAME_ADJECTIVES)} {rng.choice(NAME_WORDS)}",
+            "photo": "",
+        }
+        for pid in range(1, size + 1)
+    ]
+    orders = []
+    order_items = []
+    for oid in range(1, size + 1):
+        orders.append(
+            {
+                "id": oid,
+                "user_id": rng.randint(1, max(1, size // 10)),
+                "fullname": f"Mijoz {oid}",
+                "address": "Toshkent",
+                "phone": "+998901234567",
+                "total": 0,
+                "status": rng.choice(STATUSES),
+                "created_ts": f"2024-01-01T00:00:{oid % 60:02d}",
+            }
+        )
+    for item_id in range(1, size + 1):
+        oid = rng.randint(1, size)
+        qty = rng.randint(1, 3)
+        product = products[rng.randrange(size)]
+        order_items.append(
+            {
+                "id": item_id,
+                "order_id": oid,
+                "product_id": product["id"],
+                "qty": qty,
+                "price": product["price"],
+            }
+        )
+        orders[oid - 1]["total"] += qty * product["price"]
+    data = {
+        "meta": {
+            "next_product_id": size + 1,
+            "next_order_id": size + 1,
+            "next_order_item_id": size + 1,
+        },
+        "products": products,
+        "orders": orders,
+        "order_items": order_items,
+        "settings": {
+            "categories": list(DEFAULT_CATEGORIES),
+            "menu_rows": [list(row) for row in DEFAULT_MENU_ROWS],
+        },
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+# -- measurement (worker process) -----------------------------------------
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * pct / 100))]
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+class LoopLag:
+    # Longest delay of a 5 ms sleep since the last reset, i.e. the longest
+    # time the event loop could not run other tasks.
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.max_s = 0.0
+
+    async def run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.max_s = max(self.max_s, time.perf_counter() - started - self.interval)
+
+    def reset(self):
+        lag, self.max_s = self.max_s, 0.0
+        return lag
+
+
+def build_operations(db, size, rng):
+    categories = list(db.DEFAULT_CATEGORIES)
+    menu_rows = [list(row) for row in db.DEFAULT_MENU_ROWS]
+
+    async def create_order_with_item():
+        oid = await db.create_order(1, "Bench", "Toshkent", "+998901234567", 1000)
+        await db.add_order_item(oid, rng.randint(1, size), 1, 1000)
+
+    return [
+        ("get_settings", db.get_settings),
+        ("get_product", lambda: db.get_product(rng.randint(1, size))),
+        ("get_products", lambda: db.get_products([rng.randint(1, size) for _ in range(20)])),
+        (
+            "list_products_by_category",
+            lambda: db.list_products_by_category(
+                rng.choice(categories), after_id=rng.randint(0, size), limit=5
+            ),
+        ),
+        ("list_all_products", lambda: db.list_all_products(limit=20, after_id=rng.randint(0, size))),
+        (
+            "search_products",
+            lambda: db.search_products(
+                f"{rng.choice(NAME_ADJECTIVES)} {rng.choice(NAME_WORDS)[:4]}", limit=5, offset=0
+            ),
+        ),
+        ("list_orders", lambda: db.list_orders(limit=10, before_id=rng.randint(1, size + 1))),
+        ("get_order", lambda: db.get_order(rng.randint(1, size))),
+        ("get_order_total", lambda: db.get_order_total(rng.randint(1, size))),
+        ("get_order_items", lambda: db.get_order_items(rng.randint(1, size))),
+        ("export_orders_page", lambda: db.export_orders_page(after_id=rng.randint(0, size), limit=200)),
+        ("get_stats", lambda: db.get_stats(days=7, top=5)),
+        (
+            "add_product",
+            lambda: db.add_product(
+                f"{rng.choice(NAME_ADJECTIVES)} {rng.choice(NAME_WORDS)}",
+                rng.choice(categories),
+                rng.randint(10, 500) * 1000,
+                "Bench",
+                "",
+            ),
+        ),
+        (
+            "update_product",
+            lambda: db.update_product(rng.randint(1, size), price=rng.randint(10, 500) * 1000),
+        ),
+        ("set_categories", lambda: db.set_categories(categories)),
+        ("set_menu_rows", lambda: db.set_menu_rows(menu_rows)),
+        ("create_order+add_order_item", create_order_with_item),
+        (
+            "place_order",
+            lambda: db.place_order(
+                1,
+                "Bench",
+                "Toshkent",
+                "+998901234567",
+                [(rng.randint(1, size), 1, 1000), (rng.randint(1, size), 2, 500)],
+            ),
+        ),
+        (
+            "update_order_status",
+            lambda: db.update_order_status(rng.randint(1, size), rng.choice(STATUSES)),
+        ),
+        (
+            "update_orders_status",
+            lambda: db.update_orders_status([rng.randint(1, size) for _ in range(10)], "paid"),
+        ),
+        # last, so the other operations see the whole catalog
+        ("delete_product", lambda: db.delete_product(rng.randint(1, size))),
+    ]
+
+
+async def measure_sequential(make, max_ops, seconds):
+    samples = []
+    deadline = time.perf_counter() + seconds
+    while len(samples) < max_ops and (not samples or time.perf_counter() < deadline):
+        started = time.perf_counter()
+        await make()
+        samples.append(time.perf_counter() - started)
+        # cached reads never suspend; let the loop (and the lag ticker) run
+        await asyncio.sleep(0)
+    samples.sort()
+    ms = lambda value: round(value * 1000, 4)  # noqa: E731
+    return {
+        "ops": len(samples),
+        "mean_ms": ms(sum(samples) / len(samples)),
+        "p50_ms": ms(percentile(samples, 50)),
+        "p90_ms": ms(percentile(samples, 90)),
+        "p99_ms": ms(percentile(samples, 99)),
+        "max_ms": ms(samples[-1]),
+    }
+
+
+async def measure_concurrent(make, concurrency, max_ops, seconds):
+    done = 0
+    deadline = time.perf_counter() + seconds
+
+    async def caller():
+        nonlocal done
+        while done < max_ops and time.perf_counter() < deadline:
+            await make()
+            done += 1
+            await asyncio.sleep(0)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(caller() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {"concurrency": concurrency, "ops": done, "ops_per_s": round(done / elapsed, 1)}
+
+
+async def run_worker(args):
+    import database as db
+
+    rng = random.Random(args.seed)
+    started = time.perf_counter()
+    await db.init_db()
+    await db.get_product(1)
+    await db.get_settings()
+    await db.get_stats()
+    result = {
+        "load_s": round(time.perf_counter() - started, 3),
+        "peak_rss_after_load_mb": peak_rss_mb(),
+        "operations": {},
+    }
+    lag = LoopLag()
+    ticker = asyncio.create_task(lag.run())
+    for name, make in build_operations(db, args.size, rng):
+        if args.only and name not in args.only.split(","):
+            continue
+        lag.reset()
+        entry = await measure_sequential(make, args.ops, args.seconds)
+        entry["throughput"] = await measure_concurrent(make, args.concurrency, args.ops, args.seconds)
+        # the flush of the last staged writes belongs to this operation too
+        while db.pending_commits():
+            await asyncio.sleep(0.001)
+        entry["loop_lag_ms"] = round(lag.reset() * 1000, 1)
+        result["operations"][name] = entry
+    ticker.cancel()
+    await db.close_db()
+    result["store_bytes"] = sum(os.path.getsize(p) for p in db.store_files() if os.path.exists(p))
+    result["peak_rss_mb"] = peak_rss_mb()
+    print(json.dumps(result))
+
+
+# -- orchestration -----------------------------------------------------------
+
+
+def run_child(argv, env):
+    proc = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), *argv],
+        env={**os.environ, **env},
+        stdout=subprocess.PIPE,
+        check=True,
+        text=True,
+    )
+    return proc.stdout
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_run(run):
+    print(
+        f"\n{run['backend']} size={run['size']}: load {run['load_s']}s, "
+        f"store {run['store_bytes'] / 1e6:.1f}MB, peak RSS {run['peak_rss_mb']}MB"
+    )
+    print(
+        f"  {'operation':<28} {'ops':>6} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9} "
+        f"{'ops/s':>10} {'lag ms':>8}"
+    )
+    for name, entry in run["operations"].items():
+        print(
+            f"  {name:<28} {entry['ops']:>6} {entry['p50_ms']:>9} {entry['p90_ms']:>9} "
+            f"{entry['p99_ms']:>9} {entry['max_ms']:>9} {entry['throughput']['ops_per_s']:>10} "
+            f"{entry['loop_lag_ms']:>8}"
+        )
+
+
+def loop_lag_failures(run, max_lag_ms):
+    return [
+        f"{run['backend']} size={run['size']} {name}: event loop stalled {entry['loop_lag_ms']} ms"
+        for name, entry in run["operations"].items()
+        if entry["loop_lag_ms"] > max_lag_ms
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="1000,10000,100000", help="e.g. 1000,10000,100000,1000000")
+    parser.add_argument("--backends", default="json,json-journal,sqlite")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--ops", type=int, default=2000, help="max calls per operation and phase")
+    parser.add_argument("--seconds", type=float, default=2.0, help="time budget per operation and phase")
+    parser.add_argument("--only", help="comma-separated operation names")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--workdir", help="where to generate stores (default: a temp dir)")
+    parser.add_argument("--max-loop-lag-ms", type=float, default=200.0)
+    parser.add_argument("--lag-check-size", type=int, default=100000, help="smallest size the lag limit applies to")
+    # internal
+    parser.add_argument("--generate", help=argparse.SUPPRESS)
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--size", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.generate:
+        generate_store(args.generate, args.size, args.seed)
+        return
+    if args.worker:
+        asyncio.run(run_worker(args))
+        return
+
+    report = {
+        "meta": {
+            "git": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "args": {k: v for k, v in vars(args).items() if k not in ("generate", "worker", "size")},
+        },
+        "runs": [],
+    }
+    failures = []
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bench_database_")
+    os.makedirs(workdir, exist_ok=True)
+    try:
+        for size in (int(s) for s in args.sizes.split(",")):
+            source = os.path.join(workdir, f"source-{size}.json")
+            run_child(["--generate", source, "--size", str(size), "--seed", str(args.seed)], {})
+            for backend in args.backends.split(","):
+                store = os.path.join(workdir, f"{backend}-{size}")
+                # A fresh store every run, also in a reused --workdir.
+                shutil.rmtree(store, ignore_errors=True)
+                os.makedirs(store)
+                json_path = os.path.join(store, "shop.json")
+                shutil.copyfile(source, json_path)
+                env = dict(BACKENDS[backend], DATABASE=json_path)
+                env["SQLITE_DATABASE"] = os.path.join(store, "shop.db")
+                if backend == "sqlite":
+                    subprocess.run(
+                        [sys.executable, os.path.join(ROOT, "database_sqlite.py"), json_path, env["SQLITE_DATABASE"]],
+                        env={**os.environ, **env},
+                        stdout=subprocess.DEVNULL,
+                        check=True,
+                    )
+                argv = [
+                    "--worker",
+                    "--size", str(size),
+                    "--seed", str(args.seed),
+                    "--ops", str(args.ops),
+                    "--seconds", str(args.seconds),
+                    "--concurrency", str(args.concurrency),
+                ]
+                if args.only:
+                    argv += ["--only", args.only]
+                output = run_child(argv, env)
+                run = dict(json.loads(output.strip().splitlines()[-1]), backend=backend, size=size)
+                report["runs"].append(run)
+                print_run(run)
+                if size >= args.lag_check_size:
+                    failures += loop_lag_failures(run, args.max_loop_lag_ms)
+                shutil.rmtree(store, ignore_errors=True)
+            os.remove(source)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nresults written to {args.output}")
+    if failures:
+        print(f"\nevent loop stalls above {args.max_loop_lag_ms} ms:", *failures, sep="\n  ")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
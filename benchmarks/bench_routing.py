@@ -0,0 +1,101 @@
+# benchmarks/bench_routing.py
+# Per-update dispatch overhead: MessageRouter (hash + trie lookups) against
+# the old style of one filter per handler checked in registration order.
+#
+#   python benchmarks/bench_routing.py [--updates 20000] [--sizes 10,100,1000]
+#
+# Handlers are no-ops, so the numbers are pure routing cost per message.
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from routing import MessageRouter  # noqa: E402
+
+
+class FakeMessage:
+    __slots__ = ("text", "user_id")
+
+    def __init__(self, text, user_id=1):
+        self.text = text
+        self.user_id = user_id
+
+
+async def noop(msg):
+    return None
+
+
+async def never(msg):
+    return False
+
+
+def build(size):
+    buttons = [f"button {i}" for i in range(size)]
+    categories = [f"category {i}" for i in range(size)]
+    commands = [f"cmd{i}" for i in range(size)]
+
+    router = MessageRouter()
+    # Filter chain as registered with lambda filters: (sync check, handler).
+    chain = []
+    router.predicate(never)(noop)
+    chain.append((lambda m: False, noop))
+    for text in buttons:
+        router.text(text)(noop)
+        chain.append((lambda m, t=text: m.text == t, noop))
+    for name in commands:
+        router.command(name)(noop)
+        chain.append((lambda m, c="/" + name: m.text == c or m.text.startswith(c + " "), noop))
+    router.text_group("categories", categories)(noop)
+    chain.append((lambda m: m.text in categories, noop))
+    for prefix in ("/t", "/remove_", "/pay_payme_", "/pay_click_", "/pay_usdt_"):
+        router.prefix(prefix)(noop)
+        chain.append((lambda m, p=prefix: bool(m.text) and m.text.startswith(p), noop))
+    router.predicate(never)(noop)
+    chain.append((lambda m: bool(m.text) and "—" in m.text and "+" in m.text, noop))
+
+    texts = [
+        buttons[-1],
+        categories[-1],
+        f"/{commands[-1]} 42",
+        "/t17",
+        "/pay_usdt_99",
+        "some free text",
+    ]
+    return router, chain, [FakeMessage(t) for t in texts]
+
+
+async def dispatch_chain(chain, msg):
+    for check, handler in chain:
+        if check(msg):
+            await handler(msg)
+            return True
+    return False
+
+
+async def measure(dispatch, messages, updates):
+    started = time.perf_counter()
+    n = len(messages)
+    for i in range(updates):
+        await dispatch(messages[i % n])
+    return (time.perf_counter() - started) / updates * 1e6
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--updates", type=int, default=20000)
+    parser.add_argument("--sizes", default="10,100,1000")
+    args = parser.parse_args()
+
+    print(f"{'routes/kind':>11} {'router us':>10} {'chain us':>10}")
+    for size in (int(s) for s in args.sizes.split(",")):
+        router, chain, messages = build(size)
+        router_us = await measure(lambda m: router.dispatch(m, m.text), messages, args.updates)
+        chain_us = await measure(lambda m: dispatch_chain(chain, m), messages, args.updates)
+        print(f"{size:>11} {router_us:>10.2f} {chain_us:>10.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
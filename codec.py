@@ -0,0 +1,165 @@
+# codec.py
+# On-disk encodings of the JSON store snapshot (DB_PATH). DATABASE_FORMAT
+# picks the one snapshots are written in; reading detects the format from
+# the first bytes, so switching needs no migration step: the next snapshot
+# is simply written in the new format.
+#   json          indented JSON, for reading and editing by hand. The default.
+#   json-compact  JSON without whitespace.
+#   binary        MAGIC, then the snapshot in MessagePack (msgpack.org, needs
+#                 the optional msgpack package). Faster to write and read
+#                 than JSON and smaller (benchmarks/bench_codec.py); opt in
+#                 with DATABASE_FORMAT=binary.
+#
+# The converter takes a whole store: DB_PATH is a manifest naming its segment
+# files (see database.py), and every segment is rewritten in the target
+# format next to the target manifest. Run it while the bot is stopped.
+#
+#   python codec.py shop.json shop.json --format json      # in place
+#   python codec.py shop.json copy/shop.json --format binary
+import json
+import os
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List
+
+try:
+    import msgpack
+except ImportError:  # the JSON formats still work
+    msgpack = None
+
+FORMATS = ("json", "json-compact", "binary")
+MAGIC = b"SHOPDB\x00\x02"
+
+
+def detect(raw: bytes) -> str:
+    return "binary" if raw.startswith(MAGIC) else "json"
+
+
+def require_msgpack() -> None:
+    if msgpack is None:
+        raise RuntimeError("the binary store format needs the msgpack package (pip install msgpack)")
+
+
+def encode(data: Dict[str, Any], fmt: str) -> bytes:
+    if fmt == "binary":
+        require_msgpack()
+        return MAGIC + msgpack.packb(data, use_bin_type=True)
+    if fmt == "json-compact":
+        return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    if fmt == "json":
+        return json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8")
+    raise ValueError(f"unknown store format {fmt!r}, expected one of {', '.join(FORMATS)}")
+
+
+# Items (rows, stats entries) or JSON fragments per piece written by dump().
+_DUMP_BATCH = 2000
+
+
+_COMPACT = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+
+def dump(data: Dict[str, Any], fmt: str, f: BinaryIO) -> None:
+    """Writes the same bytes as encode(data, fmt) to `f`, a piece at a time:
+    the store writes snapshots from an executor thread, and encoding a whole
+    table in one call would hold the GIL, and so stall the event loop, until
+    it is done."""
+    if fmt == "json":
+        pieces = json.JSONEncoder(ensure_ascii=False, indent=2).iterencode(data)
+        for batch in _batches(pieces):
+            f.write("".join(batch).encode("utf-8"))
+        return
+    if fmt == "json-compact":
+        # Each batch of rows (or stats entries) is encoded as a list (dict)
+        # and written without its brackets.
+        f.write(b"{")
+        for pos, (name, value) in enumerate(data.items()):
+            f.write((("," if pos else "") + _COMPACT.encode(name) + ":").encode("utf-8"))
+            if not isinstance(value, (list, dict)):
+                f.write(_COMPACT.encode(value).encode("utf-8"))
+                continue
+            batches = _batches(value) if isinstance(value, list) else (dict(b) for b in _batches(value.items()))
+            f.write(b"[" if isinstance(value, list) else b"{")
+            for number, batch in enumerate(batches):
+                f.write((("," if number else "") + _COMPACT.encode(batch)[1:-1]).encode("utf-8"))
+            f.write(b"]" if isinstance(value, list) else b"}")
+        f.write(b"}")
+        return
+    if fmt != "binary":
+        raise ValueError(f"unknown store format {fmt!r}, expected one of {', '.join(FORMATS)}")
+    require_msgpack()
+    packer = msgpack.Packer(use_bin_type=True)
+    f.write(MAGIC + packer.pack_map_header(len(data)))
+    for name, value in data.items():
+        f.write(packer.pack(name))
+        if isinstance(value, list):
+            f.write(packer.pack_array_header(len(value)))
+            for batch in _batches(value):
+                f.write(b"".join(packer.pack(item) for item in batch))
+        elif isinstance(value, dict):
+            f.write(packer.pack_map_header(len(value)))
+            for batch in _batches(value.items()):
+                f.write(b"".join(packer.pack(key) + packer.pack(item) for key, item in batch))
+        else:
+            f.write(packer.pack(value))
+
+
+def _batches(items: Iterable[Any]) -> Iterator[List[Any]]:
+    batch: List[Any] = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= _DUMP_BATCH:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def decode(raw: bytes) -> Dict[str, Any]:
+    if detect(raw) == "json":
+        return json.loads(raw)
+    require_msgpack()
+    return msgpack.unpackb(memoryview(raw)[len(MAGIC) :], raw=False)
+
+
+def _write_file(path: str, payload: bytes) -> None:
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def convert(source: str, target: str, fmt: str) -> None:
+    with open(source, "rb") as f:
+        data = decode(f.read())
+    if "segments" not in data:
+        # a single-file store from before segments
+        _write_file(target, encode(data, fmt))
+        return
+    # New file names (next generation), so converting in place never
+    # overwrites a segment the current manifest still points at.
+    source_dir = os.path.dirname(source)
+    target_dir = os.path.dirname(target)
+    generation = data["generation"] + 1
+    segments = {}
+    for name, filename in data["segments"].items():
+        with open(os.path.join(source_dir, filename), "rb") as f:
+            value = decode(f.read())[name]
+        segments[name] = f"{os.path.basename(target)}.{name}.{generation}"
+        _write_file(os.path.join(target_dir, segments[name]), encode({name: value}, fmt))
+    manifest = dict(data, generation=generation, segments=segments)
+    _write_file(target, encode(manifest, fmt))
+    if os.path.realpath(source) == os.path.realpath(target):
+        for filename in data["segments"].values():
+            os.remove(os.path.join(source_dir, filename))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Convert a store (manifest and segments) between formats.")
+    parser.add_argument("source")
+    parser.add_argument("target", help="may be the same file as source")
+    parser.add_argument("--format", choices=FORMATS, default="json")
+    args = parser.parse_args()
+    convert(args.source, args.target, args.format)
+    print(f"{args.source} -> {args.target} ({args.format})")
@@ -1,11 +1,64 @@
 # database.py
 import asyncio
+import bisect
+import copy
+import heapq
 import json
+import logging
 import os
-from datetime import datetime
-from typing import Any, Dict, List, Tuple, Optional
+import re
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Set, Tuple, Optional
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from archive import Archive
+from codec import FORMATS, decode, dump, require_msgpack
+from metrics import DB_OP_ERRORS, DB_OP_SECONDS, DB_PHASE_SECONDS, timed_coroutine
+from search import SearchIndex
+
+# DB_PATH is a small manifest; the data lives in segment files next to it
+# (see "store segments" below).
 DB_PATH = os.getenv("DATABASE", "./shop.json")
+# The JSON store belongs to one bot process: the first read takes an
+# exclusive lock on LOCK_PATH, held until the process exits, and a second
+# process fails in init_db. Segment file names, stale-file cleanup and the
+# id counters all assume a single writer. Run several bot processes only
+# with DATABASE_BACKEND=sqlite (and SESSION_BACKEND=sqlite, since the memory
+# sessions and their sessions.json snapshot are per process as well).
+LOCK_PATH = DB_PATH + ".lock"
+# "json" (DB_PATH) or "sqlite" (see database_sqlite.py).
+STORAGE_BACKEND = os.getenv("DATABASE_BACKEND", "json").lower()
+# How DB_PATH snapshots are written: "json", "json-compact" or "binary"
+# (MessagePack, needs msgpack; see codec.py). Any of them is read back
+# regardless.
+DB_FORMAT = os.getenv("DATABASE_FORMAT", "json").lower()
+if DB_FORMAT not in FORMATS:
+    raise ValueError(f"DATABASE_FORMAT must be one of {', '.join(FORMATS)}, not {DB_FORMAT!r}")
+if DB_FORMAT == "binary":
+    require_msgpack()
+# Journal mode: mutations are appended to JOURNAL_PATH and folded into the
+# snapshot at DB_PATH by a periodic compaction.
+JOURNAL_MODE = os.getenv("DATABASE_JOURNAL", "0").lower() in ("1", "true", "yes", "on")
+JOURNAL_PATH = os.getenv("DATABASE_JOURNAL_PATH", DB_PATH + ".log")
+JOURNAL_COMPACT_INTERVAL = float(os.getenv("DATABASE_COMPACT_INTERVAL", "300"))
+# Group commit: mutations staged within this window share one disk flush.
+COMMIT_WINDOW = float(os.getenv("DATABASE_COMMIT_WINDOW_MS", "5")) / 1000.0
+# Sales statistics count days in this time zone (default Asia/Tashkent).
+STATS_UTC_OFFSET = int(os.getenv("STATS_UTC_OFFSET_HOURS", "5"))
+# Orders in ARCHIVE_STATUSES created more than ARCHIVE_AFTER_DAYS ago move to
+# per-month segments in ARCHIVE_DIR (see archive.py); 0 disables archiving.
+ARCHIVE_DIR = os.getenv("DATABASE_ARCHIVE_DIR", DB_PATH + ".archive")
+ARCHIVE_AFTER_DAYS = float(os.getenv("DATABASE_ARCHIVE_AFTER_DAYS", "90"))
+ARCHIVE_INTERVAL = float(os.getenv("DATABASE_ARCHIVE_INTERVAL", "3600"))
+ARCHIVE_BATCH = int(os.getenv("DATABASE_ARCHIVE_BATCH", "5000"))
+ARCHIVE_STATUSES = ("delivered", "cancelled")
+
+logger = logging.getLogger(__name__)
 
 DEFAULT_CATEGORIES = [
     "👗 Qizlar kiyimlari",
@@ -38,14 +91,314 @@ def _default_db() -> Dict[str, Any]:
             "categories": list(DEFAULT_CATEGORIES),
             "menu_rows": [list(row) for row in DEFAULT_MENU_ROWS],
         },
+        "stats": _empty_stats(),
     }
 
 
-async def _read_db() -> Dict[str, Any]:
-    if not os.path.exists(DB_PATH):
-        await _write_db(_default_db())
-    loop = asyncio.get_running_loop()
-    data = await loop.run_in_executor(None, _read_db_sync)
+# -- store segments -----------------------------------------------------------
+# The store is split into segments that are loaded and written on their own:
+# the catalog (products), orders, order_items, settings and stats. DB_PATH
+# holds the manifest, with meta and the file of each segment's snapshot:
+#   {"meta": {...}, "generation": 7,
+#    "segments": {"products": "shop.json.products.7", "orders": ...}}
+# A snapshot writes the segments changed since the previous one to files of
+# the next generation and then replaces the manifest, so a crash leaves
+# either the old or the new store. Readers ask for the segments they use:
+# browsing the catalog never parses order history.
+SEGMENTS = ("products", "orders", "order_items", "settings", "stats")
+CATALOG = ("products",)
+ORDERS = ("orders", "order_items")
+# Order mutations also move the stats, which need the products' categories.
+ORDER_WRITES = ("products", "orders", "order_items", "stats")
+_SEGMENT_FILE = re.compile(re.escape(os.path.basename(DB_PATH)) + r"\.(%s)\.\d+" % "|".join(SEGMENTS))
+
+# Resident copy of the store shared by every reader. It is refreshed only when
+# the files on disk change (mtime/size), and every write goes through it.
+# "data" has meta plus the segments loaded so far, "index" the lookup tables
+# built by _build_index for them, "manifest" the segment files on disk,
+# "dirty" the segments changed since they were last written and "writing"
+# whether our own snapshot or journal append is on its way to disk.
+_CACHE: Dict[str, Any] = {
+    "data": None,
+    "stamp": None,
+    "index": None,
+    "manifest": None,
+    "dirty": set(),
+    "writing": False,
+}
+# Serializes snapshot rewrites, journal appends and reloads from disk.
+_WRITE_LOCK = asyncio.Lock()
+# Cleared while the store is being reloaded from disk.
+_LOADED = asyncio.Event()
+_LOADED.set()
+# The single writer: mutations applied in memory but not yet on disk, the
+# futures their callers wait on, and the task that flushes them.
+_BATCH: Dict[str, Any] = {"data": None, "lines": [], "waiters": [], "flusher": None}
+ARCHIVE = Archive(ARCHIVE_DIR)
+# Serializes archiving runs.
+_ARCHIVE_LOCK = asyncio.Lock()
+# The open LOCK_PATH file while this process owns the store.
+_STORE_LOCK: Dict[str, Any] = {"file": None}
+
+
+def _lock_store_sync(path: str = LOCK_PATH):
+    f = open(path, "a+b")
+    try:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        f.close()
+        raise RuntimeError(
+            f"{DB_PATH} is in use by another bot process; the JSON store serves one "
+            "process only (use DATABASE_BACKEND=sqlite to run several)"
+        )
+    return f
+
+
+def _file_stamp(path: str = DB_PATH) -> Optional[Tuple[int, int]]:
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _store_stamp() -> Optional[Tuple[Any, ...]]:
+    snapshot = _file_stamp()
+    if snapshot is None:
+        return None
+    if JOURNAL_MODE:
+        return (snapshot, _file_stamp(JOURNAL_PATH))
+    return (snapshot,)
+
+
+def _invalidate_cache() -> None:
+    _CACHE["data"] = None
+    _CACHE["stamp"] = None
+    _CACHE["index"] = None
+    _CACHE["manifest"] = None
+    _CACHE["dirty"] = set()
+
+
+def _set_cache(data: Dict[str, Any], index: Optional[Dict[str, Any]] = None) -> None:
+    if index is not None:
+        _CACHE["index"] = index
+    elif _CACHE["data"] is not data or _CACHE["index"] is None:
+        _CACHE["index"] = _build_index(data)
+    _CACHE["data"] = data
+    _CACHE["stamp"] = _store_stamp()
+
+
+def _empty_index() -> Dict[str, Any]:
+    return {
+        "products": {},
+        "orders": {},
+        "order_items": {},
+        # sorted ids, for cursor paging
+        "product_ids": [],
+        "order_ids": [],
+        # category -> sorted product ids
+        "by_category": {},
+        # order id -> sorted order item ids
+        "items_by_order": {},
+        # catalog SearchIndex, built on the first search, and the task
+        # building it meanwhile
+        "search": None,
+        "search_build": None,
+    }
+
+
+# The index entries each table fills.
+_INDEX_KEYS = {
+    "products": ("products", "product_ids", "by_category", "search"),
+    "orders": ("orders", "order_ids"),
+    "order_items": ("order_items", "items_by_order"),
+}
+
+
+def _build_index(data: Dict[str, Any]) -> Dict[str, Any]:
+    index = _empty_index()
+    for table in _INDEX_KEYS:
+        for row in data.get(table, ()):
+            _index_add(index, table, row)
+    return index
+
+
+def _index_add(index: Dict[str, Any], table: str, row: Dict[str, Any]) -> None:
+    index[table][row["id"]] = row
+    if table == "products":
+        bisect.insort(index["product_ids"], row["id"])
+        bisect.insort(index["by_category"].setdefault(row["category"], []), row["id"])
+        if index["search"] is not None:
+            index["search"].add(row["id"], row["name"], row["desc"])
+    elif table == "orders":
+        bisect.insort(index["order_ids"], row["id"])
+    elif table == "order_items":
+        bisect.insort(index["items_by_order"].setdefault(row["order_id"], []), row["id"])
+
+
+def _index_remove(index: Dict[str, Any], table: str, row: Dict[str, Any]) -> None:
+    index[table].pop(row["id"], None)
+    if table == "products":
+        _remove_id(index["product_ids"], row["id"])
+        _remove_sorted(index["by_category"], row["category"], row["id"])
+        if index["search"] is not None:
+            index["search"].remove(row["id"])
+    elif table == "orders":
+        _remove_id(index["order_ids"], row["id"])
+    elif table == "order_items":
+        _remove_sorted(index["items_by_order"], row["order_id"], row["id"])
+
+
+def _remove_id(ids: List[int], row_id: int) -> None:
+    pos = bisect.bisect_left(ids, row_id)
+    if pos < len(ids) and ids[pos] == row_id:
+        del ids[pos]
+
+
+def _remove_sorted(groups: Dict[Any, List[int]], key: Any, row_id: int) -> None:
+    ids = groups.get(key)
+    if not ids:
+        return
+    _remove_id(ids, row_id)
+    if not ids:
+        del groups[key]
+
+
+# -- sales statistics -------------------------------------------------------
+# data["stats"] holds running totals that _apply_op keeps in step with every
+# mutation: a change removes the old row's contribution and adds the new
+# one, so replaying the journal or rebuilding from the rows gives the same
+# numbers.
+#   days:       local day -> status -> [orders, revenue]
+#   statuses:   status -> [orders, revenue]
+#   products:   product id (as str) -> [qty, revenue, category, name]
+#   categories: category -> [qty, revenue]
+# Order items count towards products and categories while their order
+# exists and is not cancelled. Entries are replaced, never changed in place,
+# so a snapshot only has to copy the dicts (see _snapshot_segment).
+
+
+def _empty_stats() -> Dict[str, Any]:
+    return {"utc_offset": STATS_UTC_OFFSET, "days": {}, "statuses": {}, "products": {}, "categories": {}}
+
+
+def stats_day(created_ts: str, utc_offset: int = STATS_UTC_OFFSET) -> str:
+    return (datetime.fromisoformat(created_ts) + timedelta(hours=utc_offset)).date().isoformat()
+
+
+def _bump(totals: Dict[str, List[int]], key: str, count: int, amount: int) -> None:
+    entry = totals.get(key, (0, 0))
+    count, amount = entry[0] + count, entry[1] + amount
+    if count == 0 and amount == 0:
+        totals.pop(key, None)
+    else:
+        totals[key] = [count, amount]
+
+
+def _stats_order(stats: Dict[str, Any], order: Dict[str, Any], sign: int) -> None:
+    day = stats_day(order["created_ts"], stats["utc_offset"])
+    statuses = stats["days"].setdefault(day, {})
+    _bump(statuses, order["status"], sign, sign * order["total"])
+    if not statuses:
+        del stats["days"][day]
+    _bump(stats["statuses"], order["status"], sign, sign * order["total"])
+
+
+def _stats_item(
+    stats: Dict[str, Any], item: Dict[str, Any], product: Optional[Dict[str, Any]], sign: int
+) -> None:
+    key = str(item["product_id"])
+    entry = stats["products"].get(key)
+    if entry is None:
+        entry = [0, 0, product["category"] if product else "", product["name"] if product else None]
+    qty, amount = sign * item["qty"], sign * item["qty"] * item["price"]
+    _bump(stats["categories"], entry[2], qty, amount)
+    if entry[0] + qty == 0 and entry[1] + amount == 0:
+        stats["products"].pop(key, None)
+    else:
+        stats["products"][key] = [entry[0] + qty, entry[1] + amount, entry[2], entry[3]]
+
+
+def _item_counted(order: Optional[Dict[str, Any]]) -> bool:
+    return order is not None and order["status"] != "cancelled"
+
+
+def _find(data: Dict[str, Any], index: Optional[Dict[str, Any]], table: str, row_id: Any):
+    if index is not None:
+        return index[table].get(row_id)
+    return next((r for r in data[table] if r["id"] == row_id), None)
+
+
+def _items_of(data: Dict[str, Any], index: Optional[Dict[str, Any]], order_id: int) -> List[Dict[str, Any]]:
+    if index is not None:
+        return [index["order_items"][i] for i in index["items_by_order"].get(order_id, ())]
+    return [item for item in data["order_items"] if item["order_id"] == order_id]
+
+
+def _stats_change(
+    data: Dict[str, Any],
+    index: Optional[Dict[str, Any]],
+    table: str,
+    before: Optional[Dict[str, Any]],
+    after: Optional[Dict[str, Any]],
+) -> None:
+    stats = data["stats"]
+    if table == "orders":
+        for row, sign in ((before, -1), (after, 1)):
+            if row is not None:
+                _stats_order(stats, row, sign)
+        counted_before, counted_after = _item_counted(before), _item_counted(after)
+        if counted_before != counted_after:
+            sign = 1 if counted_after else -1
+            for item in _items_of(data, index, (after or before)["id"]):
+                _stats_item(stats, item, _find(data, index, "products", item["product_id"]), sign)
+    elif table == "order_items":
+        for row, sign in ((before, -1), (after, 1)):
+            if row is not None and _item_counted(_find(data, index, "orders", row["order_id"])):
+                _stats_item(stats, row, _find(data, index, "products", row["product_id"]), sign)
+    elif table == "products" and before is not None and after is not None:
+        entry = stats["products"].get(str(after["id"]))
+        if entry is None:
+            return
+        if entry[2] != after["category"]:
+            _bump(stats["categories"], entry[2], -entry[0], -entry[1])
+            _bump(stats["categories"], after["category"], entry[0], entry[1])
+        stats["products"][str(after["id"])] = [entry[0], entry[1], after["category"], after["name"]]
+
+
+def _build_stats(data: Dict[str, Any], index: Dict[str, Any]) -> Dict[str, Any]:
+    stats = data["stats"] = _empty_stats()
+    for order in data["orders"]:
+        _stats_change(data, index, "orders", None, order)
+    # Archived orders are still sales.
+    for _, segment in ARCHIVE.segments():
+        for order_id, order in segment["orders"].items():
+            if order_id in index["orders"]:
+                continue
+            _stats_order(stats, order, 1)
+            if _item_counted(order):
+                for item in segment["items"].get(order_id, ()):
+                    _stats_item(stats, item, index["products"].get(item["product_id"]), 1)
+    return stats
+
+
+def _stats_stale(stats: Optional[Dict[str, Any]]) -> bool:
+    # Stores written before statistics existed, or counted in another zone.
+    return stats is None or stats.get("utc_offset") != STATS_UTC_OFFSET
+
+
+async def _read_store(*segments: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    data = await _read_db(*segments)
+    if _CACHE["data"] is not data or _CACHE["index"] is None:
+        _set_cache(data)
+    return data, _CACHE["index"]
+
+
+def _ensure_settings(data: Dict[str, Any]) -> bool:
     changed = False
     if "settings" not in data:
         data["settings"] = {
@@ -60,80 +413,728 @@ async def _read_db() -> Dict[str, Any]:
         if "menu_rows" not in data["settings"]:
             data["settings"]["menu_rows"] = [list(row) for row in DEFAULT_MENU_ROWS]
             changed = True
-    if changed:
-        await _write_db(data)
-    return data
+    return changed
+
+
+def _cache_is_current() -> bool:
+    if _CACHE["data"] is None:
+        return False
+    # While our own writes are pending or in flight the files are expected to
+    # differ from the recorded stamp; reloading then would drop staged
+    # mutations or read a half-written journal record. A reload holding
+    # _WRITE_LOCK is not such a write: readers wait for it instead.
+    if _BATCH["waiters"] or _CACHE["writing"]:
+        return True
+    stamp = _store_stamp()
+    return stamp is not None and stamp == _CACHE["stamp"]
+
+
+async def _read_db(*segments: str) -> Dict[str, Any]:
+    # Returns the store with at least `segments` (and meta) loaded.
+    data = _CACHE["data"]
+    if _cache_is_current() and all(name in data for name in segments):
+        return data
+    async with _WRITE_LOCK:
+        loop = asyncio.get_running_loop()
+        if _STORE_LOCK["file"] is None:
+            _STORE_LOCK["file"] = _lock_store_sync()
+        # Concurrent readers queue here; only the first one reloads.
+        if _CACHE["data"] is None or not (_BATCH["waiters"] or _store_stamp() == _CACHE["stamp"]):
+            if _store_stamp() is None:
+                data = _default_db()
+                _CACHE["manifest"] = {"generation": 0, "segments": {}}
+                _CACHE["dirty"] = set(SEGMENTS)
+                await _write_snapshot(data)
+                return data
+            _LOADED.clear()
+            try:
+                data, index, manifest, dirty, repaired = await loop.run_in_executor(
+                    None, _load_store_sync, segments
+                )
+            finally:
+                _LOADED.set()
+            _set_cache(data, index)
+            _CACHE["manifest"] = manifest
+            _CACHE["dirty"] = dirty
+        else:
+            data, index = _CACHE["data"], _CACHE["index"]
+            missing = [name for name in segments if name not in data]
+            if not missing:
+                return data
+            values = await loop.run_in_executor(
+                None, _read_segments_sync, _CACHE["manifest"], missing, set(data)
+            )
+            repaired = _attach_segments(data, index, values)
+        if repaired:
+            _CACHE["dirty"] |= repaired
+            await _write_snapshot(data)
+        return data
+
+
+def _read_file_sync(path: str) -> Dict[str, Any]:
+    with DB_PHASE_SECONDS.time("read"):
+        with open(path, "rb") as f:
+            raw = f.read()
+    with DB_PHASE_SECONDS.time("parse"):
+        return decode(raw)
+
 
+def _segment_default(name: str) -> Any:
+    # A segment the manifest does not list yet; stats are rebuilt.
+    return None if name == "stats" else {} if name == "settings" else []
 
-def _read_db_sync() -> Dict[str, Any]:
-    with open(DB_PATH, "r", encoding="utf-8") as f:
-        return json.load(f)
+
+def _read_segments_sync(
+    manifest: Dict[str, Any], names, loaded: Set[str], path: str = DB_PATH
+) -> Dict[str, Tuple[Any, Optional[Dict[str, Any]]]]:
+    # {segment: (value, its part of the index)}. Stale stats pull in the
+    # segments they are rebuilt from.
+    values: Dict[str, Tuple[Any, Optional[Dict[str, Any]]]] = {}
+    pending = [name for name in names if name not in loaded]
+    while pending:
+        name = pending.pop()
+        if name in values or name in loaded:
+            continue
+        filename = manifest["segments"].get(name)
+        if filename is None:
+            value = _segment_default(name)
+        else:
+            value = _read_file_sync(os.path.join(os.path.dirname(path), filename))[name]
+        values[name] = (value, _build_index({name: value}) if name in _INDEX_KEYS else None)
+        if name == "stats" and _stats_stale(value):
+            pending += ORDER_WRITES
+    return values
+
+
+def _attach_segments(
+    data: Dict[str, Any], index: Dict[str, Any], values: Dict[str, Tuple[Any, Optional[Dict[str, Any]]]]
+) -> Set[str]:
+    # Puts freshly read segments in place, without awaiting in between, and
+    # returns the ones that had to be filled in or rebuilt.
+    repaired: Set[str] = set()
+    for name in SEGMENTS:
+        if name not in values:
+            continue
+        value, part = values[name]
+        data[name] = value
+        for key in _INDEX_KEYS.get(name, ()):
+            index[key] = part[key]
+    if "settings" in values and _ensure_settings(data):
+        repaired.add("settings")
+    if "stats" in values and _stats_stale(data["stats"]):
+        _build_stats(data, index)
+        repaired.add("stats")
+    return repaired
+
+
+def _load_store_sync(
+    segments=(), path: str = DB_PATH, journal: Optional[str] = None, repair: bool = True
+) -> Tuple[Dict[str, Any], Dict[str, Any], Dict[str, Any], Set[str], Set[str]]:
+    # Reads the manifest, the requested segments and those the journal
+    # touches, and replays the journal. Returns (data, index, manifest,
+    # dirty, repaired).
+    if journal is None and JOURNAL_MODE:
+        journal = JOURNAL_PATH
+    raw = _read_file_sync(path)
+    data = {"meta": raw["meta"]}
+    index = _empty_index()
+    records = _read_journal_sync(data["meta"].get("journal_seq", 0), journal, repair) if journal else []
+    if "segments" in raw:
+        manifest = {"generation": raw["generation"], "segments": raw["segments"]}
+        needed = set(segments)
+        for record in records:
+            for op in record["ops"]:
+                needed.update(_op_segments(op)[0])
+        values = _read_segments_sync(manifest, needed, set(), path)
+        repaired = _attach_segments(data, index, values)
+        if repair:
+            _remove_stale_segments(manifest, path)
+    else:
+        # A single-file store from before segments: everything is loaded
+        # already, and the next snapshot splits it.
+        manifest = {"generation": 0, "segments": {}}
+        values = {}
+        for name in SEGMENTS:
+            value = raw[name] if name in raw else _segment_default(name)
+            values[name] = (value, _build_index({name: value}) if name in _INDEX_KEYS else None)
+        _attach_segments(data, index, values)
+        repaired = set(SEGMENTS)
+    dirty: Set[str] = set()
+    with DB_PHASE_SECONDS.time("replay"):
+        for record in records:
+            for op in record["ops"]:
+                _apply_op(data, op, index)
+                dirty.update(_op_segments(op)[1])
+            data["meta"]["journal_seq"] = record["seq"]
+    return data, index, manifest, dirty, repaired
+
+
+def _remove_stale_segments(manifest: Dict[str, Any], path: str = DB_PATH) -> None:
+    # Segment files a crash left behind: written, but never in a manifest.
+    directory = os.path.dirname(path) or "."
+    current = set(manifest["segments"].values())
+    for name in os.listdir(directory):
+        if _SEGMENT_FILE.fullmatch(name) and name not in current:
+            os.remove(os.path.join(directory, name))
+
+
+def _read_journal_sync(applied: int, path: str = JOURNAL_PATH, repair: bool = True) -> List[Dict[str, Any]]:
+    # The journal records after seq `applied`.
+    try:
+        f = open(path, "r+b" if repair else "rb")
+    except FileNotFoundError:
+        return []
+    records = []
+    with f:
+        good_offset = 0
+        for line in f:
+            # A record without its newline (or that does not parse) was torn by
+            # a crash mid-append: that mutation never completed.
+            if not line.endswith(b"\n"):
+                break
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            good_offset += len(line)
+            if record["seq"] > applied:
+                records.append(record)
+                applied = record["seq"]
+        if repair:
+            f.seek(0, os.SEEK_END)
+            if f.tell() != good_offset:
+                f.truncate(good_offset)
+    return records
+
+
+def load_store_file(path: str = DB_PATH, journal: Optional[str] = None) -> Dict[str, Any]:
+    # The whole store at `path` (plus `journal`), read-only, for tools such
+    # as the SQLite migrator.
+    data, _, _, _, _ = _load_store_sync(SEGMENTS, path, journal, repair=False)
+    return data
 
 
 async def _write_db(data: Dict[str, Any]) -> None:
+    async with _WRITE_LOCK:
+        await _write_snapshot(data)
+
+
+async def _write_snapshot(data: Dict[str, Any]) -> None:
+    # Caller holds _WRITE_LOCK. Writes the dirty segments and the manifest.
+    manifest = _CACHE["manifest"]
+    generation = manifest["generation"] + 1
+    segments = dict(manifest["segments"])
+    files: List[Tuple[str, Dict[str, Any]]] = []
+    replaced: List[str] = []
+    for name in SEGMENTS:
+        if name not in _CACHE["dirty"] or name not in data:
+            continue
+        if name in segments:
+            replaced.append(segments[name])
+        segments[name] = f"{os.path.basename(DB_PATH)}.{name}.{generation}"
+        files.append((segments[name], {name: _snapshot_segment(name, data[name])}))
+    manifest = {"meta": dict(data["meta"]), "generation": generation, "segments": segments}
+    # Mutations staged while this is written mark their segments again.
+    _CACHE["dirty"] = set()
     loop = asyncio.get_running_loop()
-    await loop.run_in_executor(None, _write_db_sync, data)
+    _CACHE["writing"] = True
+    try:
+        await loop.run_in_executor(None, _write_db_sync, files, manifest, replaced)
+    except BaseException:
+        _invalidate_cache()
+        raise
+    finally:
+        _CACHE["writing"] = False
+    _CACHE["manifest"] = {"generation": generation, "segments": segments}
+    _set_cache(data)
 
 
-def _write_db_sync(data: Dict[str, Any]) -> None:
-    with open(DB_PATH, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+def _snapshot_segment(name: str, value: Any) -> Any:
+    # A copy of a segment that an executor thread can encode while the event
+    # loop keeps applying ops. Rows and stats entries are replaced, never
+    # changed in place (see _apply_op and _bump), so copying the containers
+    # is enough: no row is copied.
+    if name == "stats" and value is not None:
+        stats = dict(value)
+        stats["days"] = {day: dict(totals) for day, totals in value["days"].items()}
+        for key in ("statuses", "products", "categories"):
+            stats[key] = dict(value[key])
+        return stats
+    if name == "settings":
+        return copy.deepcopy(value)
+    return list(value) if isinstance(value, list) else value
 
 
-async def init_db():
-    if not os.path.exists(DB_PATH):
-        await _write_db(_default_db())
+def _write_db_sync(
+    files: List[Tuple[str, Dict[str, Any]]], manifest: Dict[str, Any], replaced: List[str]
+) -> None:
+    # Segments go to new files and the manifest is renamed over DB_PATH last,
+    # so a crash leaves either the old or the new store, never a mix.
+    directory = os.path.dirname(DB_PATH)
+    tmp_path = DB_PATH + ".tmp"
+    # Encoding is streamed straight into the files, so "write" covers it.
+    with DB_PHASE_SECONDS.time("write"):
+        for filename, segment in files:
+            with open(os.path.join(directory, filename), "wb") as f:
+                dump(segment, DB_FORMAT, f)
+                f.flush()
+                os.fsync(f.fileno())
+        with open(tmp_path, "wb") as f:
+            dump(manifest, DB_FORMAT, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, DB_PATH)
+    for filename in replaced:
+        try:
+            os.remove(os.path.join(directory, filename))
+        except FileNotFoundError:
+            pass
+    if JOURNAL_MODE:
+        # Everything up to meta.journal_seq is in the snapshot now.
+        with open(JOURNAL_PATH, "wb") as f:
+            os.fsync(f.fileno())
+
+
+def _append_journal_sync(lines: str) -> None:
+    with DB_PHASE_SECONDS.time("append"), open(JOURNAL_PATH, "ab") as f:
+        f.write(lines.encode("utf-8"))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _op_segments(op: Dict[str, Any]) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+    # (segments applying the op needs loaded, segments it changes)
+    kind = op["op"]
+    if kind == "set":
+        section = () if op["section"] == "meta" else (op["section"],)
+        return section, section
+    if kind == "archive":
+        return ORDERS, ORDERS
+    table = op["table"]
+    if table == "products":
+        if kind == "update":
+            # Renaming or moving a product renames it in the stats too.
+            return ("products", "stats"), ("products", "stats")
+        return CATALOG, CATALOG
+    return ORDER_WRITES, (table, "stats")
+
+
+def _apply_op(
+    data: Dict[str, Any], op: Dict[str, Any], index: Optional[Dict[str, Any]] = None
+) -> None:
+    kind = op["op"]
+    if kind == "set":
+        data[op["section"]].update(op["fields"])
+        return
+    if kind == "archive":
+        _drop_archived(data, set(op["ids"]), index)
+        return
+    table = op["table"]
+    stats = "stats" in data
+    if kind == "insert":
+        data[table].append(op["row"])
+        if index is not None:
+            _index_add(index, table, op["row"])
+        if stats:
+            _stats_change(data, index, table, None, op["row"])
+        return
+    if index is not None:
+        row = index[table].get(op["id"])
+    else:
+        row = next((r for r in data[table] if r["id"] == op["id"]), None)
+    if row is None:
+        return
+    if kind == "update":
+        # The row is replaced rather than changed in place, so a snapshot
+        # being written keeps the old one (see _snapshot_segment).
+        before, row = row, {**row, **op["fields"]}
+        data[table][_row_position(data[table], before)] = row
+        if index is not None:
+            index[table][row["id"]] = row
+        # Only a product's category is a grouping key that can change.
+        if index is not None and table == "products" and row["category"] != before["category"]:
+            _remove_sorted(index["by_category"], before["category"], row["id"])
+            bisect.insort(index["by_category"].setdefault(row["category"], []), row["id"])
+        if (
+            index is not None
+            and table == "products"
+            and index["search"] is not None
+            and ("name" in op["fields"] or "desc" in op["fields"])
+        ):
+            index["search"].add(row["id"], row["name"], row["desc"])
+        if stats:
+            _stats_change(data, index, table, before, row)
+    elif kind == "delete":
+        del data[table][_row_position(data[table], row)]
+        if index is not None:
+            _index_remove(index, table, row)
+        if stats:
+            _stats_change(data, index, table, row, None)
     else:
-        await _read_db()
+        raise ValueError(f"Unknown store operation: {kind}")
 
 
-async def add_product(name, category, price, desc, photo):
+def _row_position(rows: List[Dict[str, Any]], row: Dict[str, Any]) -> int:
+    # Tables are appended to in id order, so a binary search finds the row;
+    # the scan is only a fallback for stores edited by hand.
+    lo, hi = 0, len(rows)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if rows[mid]["id"] < row["id"]:
+            lo = mid + 1
+        else:
+            hi = mid
+    if lo < len(rows) and rows[lo] is row:
+        return lo
+    return next(pos for pos, other in enumerate(rows) if other is row)
+
+
+def _drop_archived(data: Dict[str, Any], order_ids: set, index: Optional[Dict[str, Any]]) -> None:
+    # Removes orders (and their items) that now live in the archive. The
+    # statistics keep counting them: the sales still happened.
+    data["orders"] = [order for order in data["orders"] if order["id"] not in order_ids]
+    data["order_items"] = [item for item in data["order_items"] if item["order_id"] not in order_ids]
+    if index is None:
+        return
+    for order_id in order_ids:
+        index["orders"].pop(order_id, None)
+        for item_id in index["items_by_order"].pop(order_id, ()):
+            index["order_items"].pop(item_id, None)
+    index["order_ids"] = [order_id for order_id in index["order_ids"] if order_id not in order_ids]
+
+
+async def _commit(data: Dict[str, Any], ops: List[Dict[str, Any]]) -> None:
+    # Callers read the store and build ops without awaiting in between, so the
+    # read-modify-apply step is atomic on the event loop; only durability is
+    # awaited, together with every other mutation staged in the same window.
+    # Ops built on a copy that a reload has replaced (or is replacing) are
+    # applied to the reloaded store instead, as journal replay would.
+    while not _LOADED.is_set() or _CACHE["data"] is not data:
+        await _LOADED.wait()
+        data = await _read_db(*{name for op in ops for name in _op_segments(op)[0]})
+    await _stage(data, ops)
+
+
+def _stage(data: Dict[str, Any], ops: List[Dict[str, Any]]) -> "asyncio.Future[None]":
+    index = _CACHE["index"] if _CACHE["data"] is data else None
+    touched: Set[str] = set()
+    for op in ops:
+        needs, changes = _op_segments(op)
+        missing = [name for name in needs if name not in data]
+        if missing:
+            raise RuntimeError(f"store segments not loaded for {op['op']}: {', '.join(missing)}")
+        touched.update(changes)
+    for op in ops:
+        _apply_op(data, op, index)
+    if index is not None:
+        _CACHE["dirty"] |= touched
+    if JOURNAL_MODE:
+        seq = data["meta"].get("journal_seq", 0) + 1
+        data["meta"]["journal_seq"] = seq
+        with DB_PHASE_SECONDS.time("serialize"):
+            line = json.dumps({"seq": seq, "ops": ops}, ensure_ascii=False)
+        _BATCH["lines"].append(line + "\n")
+    _BATCH["data"] = data
+    waiter = asyncio.get_running_loop().create_future()
+    _BATCH["waiters"].append(waiter)
+    if _BATCH["flusher"] is None:
+        _BATCH["flusher"] = asyncio.create_task(_flush_batches())
+    return waiter
+
+
+async def _flush_batches() -> None:
+    try:
+        while _BATCH["waiters"]:
+            if COMMIT_WINDOW > 0:
+                await asyncio.sleep(COMMIT_WINDOW)
+            async with _WRITE_LOCK:
+                data, lines, waiters = _BATCH["data"], _BATCH["lines"], _BATCH["waiters"]
+                _BATCH["lines"], _BATCH["waiters"] = [], []
+                try:
+                    if JOURNAL_MODE:
+                        loop = asyncio.get_running_loop()
+                        _CACHE["writing"] = True
+                        try:
+                            await loop.run_in_executor(None, _append_journal_sync, "".join(lines))
+                        finally:
+                            _CACHE["writing"] = False
+                        _CACHE["stamp"] = _store_stamp()
+                    else:
+                        await _write_snapshot(data)
+                except BaseException as exc:
+                    # Everything staged so far was applied on top of the failed
+                    # batch, so none of it can be trusted: fail it all and let
+                    # the next read reload from disk.
+                    waiters += _BATCH["waiters"]
+                    _BATCH["lines"], _BATCH["waiters"] = [], []
+                    _invalidate_cache()
+                    for waiter in waiters:
+                        if waiter.done():
+                            continue
+                        if isinstance(exc, asyncio.CancelledError):
+                            waiter.cancel()
+                        else:
+                            waiter.set_exception(exc)
+                    if not isinstance(exc, Exception):
+                        raise
+                    continue
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(None)
+    finally:
+        _BATCH["flusher"] = None
+
+
+async def close_db():
+    # Waits for staged mutations to reach the disk.
+    flusher = _BATCH["flusher"]
+    if flusher is not None:
+        await flusher
+
+
+def pending_commits() -> int:
+    # Mutations applied in memory and still waiting for their disk flush.
+    return len(_BATCH["waiters"])
+
+
+def store_files() -> List[str]:
+    if STORAGE_BACKEND == "sqlite":
+        from database_sqlite import SQLITE_PATH
+
+        return [SQLITE_PATH, SQLITE_PATH + "-wal"]
+    files = [DB_PATH]
+    if _CACHE["manifest"] is not None:
+        directory = os.path.dirname(DB_PATH)
+        files += [os.path.join(directory, name) for name in _CACHE["manifest"]["segments"].values()]
+    return files + [JOURNAL_PATH] if JOURNAL_MODE else files
+
+
+async def compact_journal() -> bool:
+    if not JOURNAL_MODE:
+        return False
     data = await _read_db()
+    await _write_db(data)
+    return True
+
+
+async def _compaction_loop(interval: float) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        stamp = _file_stamp(JOURNAL_PATH)
+        if not stamp or not stamp[1]:
+            continue
+        try:
+            await compact_journal()
+        except Exception:
+            logger.exception("Journal compaction failed")
+
+
+def start_journal_compaction(interval: Optional[float] = None) -> Optional["asyncio.Task[None]"]:
+    if not JOURNAL_MODE:
+        return None
+    return asyncio.create_task(_compaction_loop(interval or JOURNAL_COMPACT_INTERVAL))
+
+
+async def archive_orders(older_than_days: Optional[float] = None, limit: Optional[int] = None) -> int:
+    # Moves up to `limit` old orders in ARCHIVE_STATUSES, with their items,
+    # into the archive and returns how many left the hot store. Rows are
+    # written to the archive first and dropped from the store after, so a
+    # crash in between only leaves copies in both places (reads prefer the
+    # store, and the next run archives them again).
+    days = ARCHIVE_AFTER_DAYS if older_than_days is None else older_than_days
+    cutoff = (datetime.utcnow() - timedelta(days=days)).isoformat()
+    async with _ARCHIVE_LOCK:
+        _, index = await _read_store(*ORDERS)
+        orders, items = index["orders"], index["order_items"]
+        months: Dict[str, Dict[str, List[Dict[str, Any]]]] = {}
+        copies: Dict[int, Dict[str, Any]] = {}
+        for order_id in index["order_ids"]:
+            order = orders[order_id]
+            if order["status"] not in ARCHIVE_STATUSES or order["created_ts"] >= cutoff:
+                continue
+            month = months.setdefault(order["created_ts"][:7], {"orders": [], "order_items": []})
+            copies[order_id] = dict(order)
+            month["orders"].append(copies[order_id])
+            month["order_items"].extend(dict(items[i]) for i in index["items_by_order"].get(order_id, ()))
+            if len(copies) >= (limit or ARCHIVE_BATCH):
+                break
+        if not copies:
+            return 0
+        loop = asyncio.get_running_loop()
+        with DB_PHASE_SECONDS.time("archive"):
+            await loop.run_in_executor(None, ARCHIVE.write, months)
+        # Orders changed while the archive was written stay hot this time.
+        data, index = await _read_store(*ORDERS)
+        archived = sorted(
+            order_id for order_id, copy in copies.items() if index["orders"].get(order_id) == copy
+        )
+        if archived:
+            await _commit(data, [{"op": "archive", "ids": archived}])
+        return len(archived)
+
+
+async def _archive_loop(interval: float) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            while await archive_orders() >= ARCHIVE_BATCH:
+                pass
+        except Exception:
+            logger.exception("Archiving orders failed")
+
+
+def start_archiving(interval: Optional[float] = None) -> Optional["asyncio.Task[None]"]:
+    if ARCHIVE_AFTER_DAYS <= 0:
+        return None
+    return asyncio.create_task(_archive_loop(interval or ARCHIVE_INTERVAL))
+
+
+async def _archived_order(order_id: int):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, ARCHIVE.find, order_id)
+
+
+async def is_order_archived(order_id: int) -> bool:
+    # True for an order that left the hot store for the archive.
+    _, index = await _read_store("orders")
+    return order_id not in index["orders"] and await _archived_order(order_id) is not None
+
+
+async def list_archive_months() -> List[str]:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, ARCHIVE.months)
+
+
+async def archived_orders(
+    month: str,
+    after_id: Optional[int] = None,
+    limit: int = 200,
+    statuses: Optional[List[str]] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+):
+    # export_orders_page for one archive segment, minus orders that are
+    # (still) in the hot store: returns (page, cursor). The segment is sliced
+    # in an executor thread, one page at a time.
+    loop = asyncio.get_running_loop()
+    chunk, cursor = await loop.run_in_executor(None, ARCHIVE.page, month, after_id, limit)
+    _, index = await _read_store("products", "orders")
+    products = index["products"]
+    page = []
+    for order, items in chunk:
+        order_id = order["id"]
+        if (
+            order_id in index["orders"]
+            or (statuses and order["status"] not in statuses)
+            or (since and order["created_ts"] < since)
+            or (until and order["created_ts"] >= until)
+        ):
+            continue
+        lines = []
+        for item in items:
+            product = products.get(item["product_id"])
+            lines.append((item["product_id"], product["name"] if product else None, item["qty"], item["price"]))
+        page.append((_order_row(order), lines))
+    return page, cursor
+
+
+async def init_db():
+    # Locks the store for this process (see LOCK_PATH) and creates it, or
+    # splits a single-file one into segments.
+    await _read_db()
+
+
+async def add_product(name, category, price, desc, photo):
+    data = await _read_db(*CATALOG)
     pid = data["meta"]["next_product_id"]
-    data["meta"]["next_product_id"] += 1
-    data["products"].append(
-        {
-            "id": pid,
-            "name": name,
-            "category": category,
-            "price": price,
-            "desc": desc,
-            "photo": photo,
-        }
+    await _commit(
+        data,
+        [
+            {"op": "set", "section": "meta", "fields": {"next_product_id": pid + 1}},
+            {
+                "op": "insert",
+                "table": "products",
+                "row": {
+                    "id": pid,
+                    "name": name,
+                    "category": category,
+                    "price": price,
+                    "desc": desc,
+                    "photo": photo,
+                },
+            },
+        ],
     )
-    await _write_db(data)
     return pid
 
 
-async def list_products_by_category(category):
-    data = await _read_db()
-    rows: List[Tuple[Any, ...]] = []
-    for product in data["products"]:
-        if product["category"] == category:
-            rows.append(
-                (
-                    product["id"],
-                    product["name"],
-                    product["price"],
-                    product["desc"],
-                    product["photo"],
-                )
-            )
-    return rows
+def _product_row(product: Dict[str, Any]) -> Tuple[Any, ...]:
+    return (
+        product["id"],
+        product["name"],
+        product["category"],
+        product["price"],
+        product["desc"],
+        product["photo"],
+    )
 
 
-async def list_all_products(limit: Optional[int] = None):
-    data = await _read_db()
-    products = sorted(data["products"], key=lambda p: p["id"])
-    if limit is not None:
-        products = products[:limit]
-    rows = []
-    for product in products:
+def _order_row(order: Dict[str, Any]) -> Tuple[Any, ...]:
+    return (
+        order["id"],
+        order["user_id"],
+        order["fullname"],
+        order["address"],
+        order["phone"],
+        order["total"],
+        order["status"],
+        order["created_ts"],
+    )
+
+
+def _order_item_row(item: Dict[str, Any]) -> Tuple[Any, ...]:
+    return (
+        item["id"],
+        item["order_id"],
+        item["product_id"],
+        item["qty"],
+        item["price"],
+    )
+
+
+def _page_ids(
+    ids: List[int],
+    after_id: Optional[int] = None,
+    before_id: Optional[int] = None,
+    limit: Optional[int] = None,
+) -> List[int]:
+    # ids is sorted ascending. With only before_id the page is the last
+    # `limit` ids below it, so paging backwards mirrors paging forwards.
+    lo = bisect.bisect_right(ids, after_id) if after_id is not None else 0
+    hi = bisect.bisect_left(ids, before_id) if before_id is not None else len(ids)
+    if limit is None:
+        return ids[lo:hi]
+    if before_id is not None and after_id is None:
+        return ids[max(lo, hi - limit) : hi]
+    return ids[lo : min(hi, lo + limit)]
+
+
+async def list_products_by_category(
+    category,
+    after_id: Optional[int] = None,
+    before_id: Optional[int] = None,
+    limit: Optional[int] = None,
+):
+    _, index = await _read_store(*CATALOG)
+    products = index["products"]
+    rows: List[Tuple[Any, ...]] = []
+    ids = index["by_category"].get(category, [])
+    for pid in _page_ids(ids, after_id, before_id, limit):
+        product = products[pid]
         rows.append(
             (
                 product["id"],
                 product["name"],
-                product["category"],
                 product["price"],
                 product["desc"],
                 product["photo"],
@@ -142,57 +1143,112 @@ async def list_all_products(limit: Optional[int] = None):
     return rows
 
 
+async def list_all_products(
+    limit: Optional[int] = None,
+    after_id: Optional[int] = None,
+    before_id: Optional[int] = None,
+):
+    _, index = await _read_store(*CATALOG)
+    products = index["products"]
+    page = _page_ids(index["product_ids"], after_id, before_id, limit)
+    return [_product_row(products[pid]) for pid in page]
+
+
 async def get_product(pid):
-    data = await _read_db()
-    for product in data["products"]:
-        if product["id"] == pid:
-            return (
-                product["id"],
-                product["name"],
-                product["category"],
-                product["price"],
-                product["desc"],
-                product["photo"],
-            )
-    return None
+    _, index = await _read_store(*CATALOG)
+    product = index["products"].get(pid)
+    return _product_row(product) if product else None
 
 
-async def update_product(pid, name=None, category=None, price=None, desc=None, photo=None):
-    data = await _read_db()
-    updated = False
-    for product in data["products"]:
-        if product["id"] == pid:
-            if name is not None:
-                product["name"] = name
-            if category is not None:
-                product["category"] = category
-            if price is not None:
-                product["price"] = price
-            if desc is not None:
-                product["desc"] = desc
-            if photo is not None:
-                product["photo"] = photo
-            updated = True
+async def _build_search(index: Dict[str, Any]) -> None:
+    # Builds the SearchIndex in an executor thread (seconds for a large
+    # catalog) from a copy of the names, then catches up with the products
+    # changed meanwhile, which _apply_op could not add to a missing index.
+    try:
+        rows = {pid: (p["name"], p["desc"]) for pid, p in index["products"].items()}
+        loop = asyncio.get_running_loop()
+        search = await loop.run_in_executor(
+            None,
+            SearchIndex.build,
+            [{"id": pid, "name": name, "desc": desc} for pid, (name, desc) in rows.items()],
+        )
+        products = index["products"]
+        for pid in rows.keys() - products.keys():
+            search.remove(pid)
+        for pid, product in products.items():
+            if rows.get(pid) != (product["name"], product["desc"]):
+                search.add(pid, product["name"], product["desc"])
+        index["search"] = search
+    finally:
+        index["search_build"] = None
+
+
+async def search_products(query: str, limit: int = 10, offset: int = 0):
+    # Returns (rows, total); rows are shaped like list_products_by_category's.
+    while True:
+        _, index = await _read_store(*CATALOG)
+        if index["search"] is not None:
             break
-    if updated:
-        await _write_db(data)
-    return updated
+        if index["search_build"] is None:
+            index["search_build"] = asyncio.ensure_future(_build_search(index))
+        await asyncio.shield(index["search_build"])
+    ids, total = index["search"].search(query, limit, offset)
+    products = index["products"]
+    rows = [
+        (
+            products[pid]["id"],
+            products[pid]["name"],
+            products[pid]["price"],
+            products[pid]["desc"],
+            products[pid]["photo"],
+        )
+        for pid in ids
+    ]
+    return rows, total
+
+
+async def get_products(ids):
+    # Returns {pid: product row} for the ids that exist, from one snapshot.
+    _, index = await _read_store(*CATALOG)
+    products = index["products"]
+    rows = {}
+    for pid in ids:
+        product = products.get(pid)
+        if product:
+            rows[pid] = _product_row(product)
+    return rows
+
+
+async def update_product(pid, name=None, category=None, price=None, desc=None, photo=None):
+    data, index = await _read_store("products", "stats")
+    if pid not in index["products"]:
+        return False
+    fields = {
+        key: value
+        for key, value in (
+            ("name", name),
+            ("category", category),
+            ("price", price),
+            ("desc", desc),
+            ("photo", photo),
+        )
+        if value is not None
+    }
+    await _commit(data, [{"op": "update", "table": "products", "id": pid, "fields": fields}])
+    return True
 
 
 async def delete_product(pid):
-    data = await _read_db()
-    before = len(data["products"])
-    data["products"] = [p for p in data["products"] if p["id"] != pid]
-    if len(data["products"]) != before:
-        await _write_db(data)
-        return True
-    return False
+    data, index = await _read_store(*CATALOG)
+    if pid not in index["products"]:
+        return False
+    await _commit(data, [{"op": "delete", "table": "products", "id": pid}])
+    return True
 
 
 async def create_order(user_id, fullname, address, phone, total):
-    data = await _read_db()
+    data = await _read_db(*ORDER_WRITES)
     order_id = data["meta"]["next_order_id"]
-    data["meta"]["next_order_id"] += 1
     order = {
         "id": order_id,
         "user_id": user_id,
@@ -203,42 +1259,92 @@ async def create_order(user_id, fullname, address, phone, total):
         "status": "pending",
         "created_ts": datetime.utcnow().isoformat(),
     }
-    data["orders"].append(order)
-    await _write_db(data)
+    await _commit(
+        data,
+        [
+            {"op": "set", "section": "meta", "fields": {"next_order_id": order_id + 1}},
+            {"op": "insert", "table": "orders", "row": order},
+        ],
+    )
     return order_id
 
 
 async def add_order_item(order_id, product_id, qty, price):
-    data = await _read_db()
+    data = await _read_db(*ORDER_WRITES)
     order_item_id = data["meta"]["next_order_item_id"]
-    data["meta"]["next_order_item_id"] += 1
-    data["order_items"].append(
-        {
-            "id": order_item_id,
-            "order_id": order_id,
-            "product_id": product_id,
-            "qty": qty,
-            "price": price,
-        }
+    await _commit(
+        data,
+        [
+            {"op": "set", "section": "meta", "fields": {"next_order_item_id": order_item_id + 1}},
+            {
+                "op": "insert",
+                "table": "order_items",
+                "row": {
+                    "id": order_item_id,
+                    "order_id": order_id,
+                    "product_id": product_id,
+                    "qty": qty,
+                    "price": price,
+                },
+            },
+        ],
     )
-    await _write_db(data)
+
+
+async def place_order(user_id, fullname, address, phone, items):
+    # items: iterable of (product_id, qty, price). The order and all of its
+    # items are written as one commit, so a failure never leaves half an order.
+    data = await _read_db(*ORDER_WRITES)
+    meta = data["meta"]
+    order_id = meta["next_order_id"]
+    next_item_id = meta["next_order_item_id"]
+    ops: List[Dict[str, Any]] = []
+    total = 0
+    for product_id, qty, price in items:
+        total += price * qty
+        ops.append(
+            {
+                "op": "insert",
+                "table": "order_items",
+                "row": {
+                    "id": next_item_id,
+                    "order_id": order_id,
+                    "product_id": product_id,
+                    "qty": qty,
+                    "price": price,
+                },
+            }
+        )
+        next_item_id += 1
+    order = {
+        "id": order_id,
+        "user_id": user_id,
+        "fullname": fullname,
+        "address": address,
+        "phone": phone,
+        "total": total,
+        "status": "pending",
+        "created_ts": datetime.utcnow().isoformat(),
+    }
+    ops[:0] = [
+        {
+            "op": "set",
+            "section": "meta",
+            "fields": {"next_order_id": order_id + 1, "next_order_item_id": next_item_id},
+        },
+        {"op": "insert", "table": "orders", "row": order},
+    ]
+    await _commit(data, ops)
+    return order_id
 
 
 async def get_order(order_id):
-    data = await _read_db()
-    for order in data["orders"]:
-        if order["id"] == order_id:
-            return (
-                order["id"],
-                order["user_id"],
-                order["fullname"],
-                order["address"],
-                order["phone"],
-                order["total"],
-                order["status"],
-                order["created_ts"],
-            )
-    return None
+    _, index = await _read_store("orders")
+    order = index["orders"].get(order_id)
+    if order is None:
+        archived = await _archived_order(order_id)
+        return _order_row(archived[0]) if archived else None
+    return _order_row(order)
 
 
 async def get_order_total(order_id):
@@ -246,68 +1352,226 @@ async def get_order_total(order_id):
     return order[5] if order else None
 
 
-async def list_orders(limit: int = 10):
-    data = await _read_db()
-    orders = sorted(data["orders"], key=lambda o: o["id"], reverse=True)
-    result = []
-    for order in orders[:limit]:
-        result.append(
-            (
-                order["id"],
-                order["user_id"],
-                order["fullname"],
-                order["address"],
-                order["phone"],
-                order["total"],
-                order["status"],
-                order["created_ts"],
-            )
-        )
-    return result
+async def list_orders(
+    limit: int = 10,
+    after_id: Optional[int] = None,
+    before_id: Optional[int] = None,
+):
+    # Newest first. before_id pages towards older orders, after_id towards
+    # newer ones (the `limit` orders just above it).
+    _, index = await _read_store("orders")
+    ids = index["order_ids"]
+    if after_id is None and before_id is None:
+        page = ids[-limit:] if limit else []
+    else:
+        page = _page_ids(ids, after_id, before_id, limit)
+    orders = index["orders"]
+    return [_order_row(orders[order_id]) for order_id in reversed(page)]
 
 
 async def get_order_items(order_id: int):
-    data = await _read_db()
-    items = []
-    for item in data["order_items"]:
-        if item["order_id"] == order_id:
-            items.append(
-                (
-                    item["id"],
-                    item["order_id"],
-                    item["product_id"],
-                    item["qty"],
-                    item["price"],
-                )
-            )
-    return items
+    _, index = await _read_store(*ORDERS)
+    if order_id not in index["orders"]:
+        archived = await _archived_order(order_id)
+        if archived:
+            return [_order_item_row(item) for item in archived[1]]
+    items = index["order_items"]
+    return [_order_item_row(items[item_id]) for item_id in index["items_by_order"].get(order_id, ())]
 
 
-async def update_order_status(order_id: int, status: str):
-    data = await _read_db()
-    updated = False
-    for order in data["orders"]:
-        if order["id"] == order_id:
-            order["status"] = status
-            updated = True
+async def export_orders_page(
+    after_id: Optional[int] = None,
+    limit: int = 200,
+    statuses: Optional[List[str]] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+):
+    # One page of orders for reports, oldest first: [(order row, [(product_id,
+    # product name, qty, price), ...]), ...]. The bounds select
+    #   since <= created_ts < until
+    # and are compared as ISO text, so they are UTC too. Returns (page,
+    # cursor): pass cursor as after_id for the next page; it is None once
+    # every order was seen. A page scans a bounded number of orders, so it
+    # may be empty before the end.
+    _, index = await _read_store("products", *ORDERS)
+    ids = index["order_ids"]
+    start = bisect.bisect_right(ids, after_id) if after_id is not None else 0
+    stop = min(len(ids), start + limit * 20)
+    orders, items, products = index["orders"], index["order_items"], index["products"]
+    page = []
+    cursor = None
+    for pos in range(start, stop):
+        order = orders[ids[pos]]
+        cursor = order["id"]
+        if (
+            (statuses and order["status"] not in statuses)
+            or (since and order["created_ts"] < since)
+            or (until and order["created_ts"] >= until)
+        ):
+            continue
+        lines = []
+        for item_id in index["items_by_order"].get(order["id"], ()):
+            item = items[item_id]
+            product = products.get(item["product_id"])
+            lines.append((item["product_id"], product["name"] if product else None, item["qty"], item["price"]))
+        page.append((_order_row(order), lines))
+        if len(page) >= limit:
             break
-    if updated:
-        await _write_db(data)
-    return updated
+    if cursor is None or cursor == ids[-1]:
+        cursor = None
+    return page, cursor
+
+
+async def update_order_status(order_id: int, status: str):
+    # Archived orders are read-only: False, as for a missing order (see
+    # is_order_archived).
+    data, index = await _read_store(*ORDER_WRITES)
+    if order_id not in index["orders"]:
+        return False
+    await _commit(
+        data, [{"op": "update", "table": "orders", "id": order_id, "fields": {"status": status}}]
+    )
+    return True
+
+
+async def update_orders_status(
+    order_ids: List[int], status: str, from_statuses: Optional[List[str]] = None
+) -> List[int]:
+    # One commit for the whole batch; returns the ids that exist. With
+    # from_statuses only orders currently in one of them change, and only
+    # those are returned. Archived orders are read-only and never returned.
+    data, index = await _read_store(*ORDER_WRITES)
+    orders = index["orders"]
+    found = [
+        oid
+        for oid in dict.fromkeys(order_ids)
+        if oid in orders and (from_statuses is None or orders[oid]["status"] in from_statuses)
+    ]
+    if found:
+        await _commit(
+            data,
+            [
+                {"op": "update", "table": "orders", "id": oid, "fields": {"status": status}}
+                for oid in found
+            ],
+        )
+    return found
 
 
 async def get_settings():
-    data = await _read_db()
+    data = await _read_db("settings")
     return data["settings"]
 
 
+async def get_stats(days: int = 7, top: int = 5):
+    # Reads only the running totals: cost depends on `days` and the number of
+    # products and categories sold, not on how many orders exist.
+    #   {"today": "YYYY-MM-DD",
+    #    "days": [(day, {status: (orders, revenue)}), ...] newest first,
+    #    "statuses": {status: (orders, revenue)},
+    #    "categories": [(category, qty, revenue), ...] by revenue,
+    #    "top_products": [(product_id, name, category, qty, revenue), ...]}
+    data = await _read_db("stats")
+    stats = data["stats"]
+    today = stats_day(datetime.utcnow().isoformat(), stats["utc_offset"])
+    first = datetime.fromisoformat(today)
+    day_list = [(first - timedelta(days=n)).date().isoformat() for n in range(days)]
+    products = heapq.nlargest(top, stats["products"].items(), key=lambda item: item[1][1])
+    return {
+        "today": today,
+        "days": [
+            (day, {status: tuple(entry) for status, entry in stats["days"].get(day, {}).items()})
+            for day in day_list
+        ],
+        "statuses": {status: tuple(entry) for status, entry in stats["statuses"].items()},
+        "categories": sorted(
+            ((category, qty, revenue) for category, (qty, revenue) in stats["categories"].items()),
+            key=lambda row: -row[2],
+        ),
+        "top_products": [
+            (int(pid), name, category, qty, revenue) for pid, (qty, revenue, category, name) in products
+        ],
+    }
+
+
 async def set_categories(categories: List[str]):
-    data = await _read_db()
-    data["settings"]["categories"] = categories
-    await _write_db(data)
+    data = await _read_db("settings")
+    await _commit(
+        data, [{"op": "set", "section": "settings", "fields": {"categories": categories}}]
+    )
 
 
 async def set_menu_rows(menu_rows: List[List[str]]):
-    data = await _read_db()
-    data["settings"]["menu_rows"] = menu_rows
-    await _write_db(data)
+    data = await _read_db("settings")
+    await _commit(
+        data, [{"op": "set", "section": "settings", "fields": {"menu_rows": menu_rows}}]
+    )
+
+
+if STORAGE_BACKEND == "sqlite":
+    from database_sqlite import (  # noqa: E402,F401,F811
+        init_db,
+        add_product,
+        list_products_by_category,
+        list_all_products,
+        get_product,
+        get_products,
+        search_products,
+        update_product,
+        delete_product,
+        create_order,
+        add_order_item,
+        place_order,
+        get_order,
+        get_order_total,
+        list_orders,
+        get_order_items,
+        export_orders_page,
+        update_order_status,
+        update_orders_status,
+        get_settings,
+        get_stats,
+        set_categories,
+        set_menu_rows,
+        compact_journal,
+        start_journal_compaction,
+        archive_orders,
+        start_archiving,
+        is_order_archived,
+        list_archive_months,
+        archived_orders,
+        close_db,
+    )
+
+# Per-operation latency and error counts for /metrics.
+for _name in (
+    "init_db",
+    "add_product",
+    "list_products_by_category",
+    "list_all_products",
+    "get_product",
+    "get_products",
+    "search_products",
+    "update_product",
+    "delete_product",
+    "create_order",
+    "add_order_item",
+    "place_order",
+    "get_order",
+    "get_order_total",
+    "list_orders",
+    "get_order_items",
+    "export_orders_page",
+    "update_order_status",
+    "update_orders_status",
+    "get_settings",
+    "get_stats",
+    "set_categories",
+    "set_menu_rows",
+    "compact_journal",
+    "archive_orders",
+    "is_order_archived",
+    "list_archive_months",
+    "archived_orders",
+):
+    globals()[_name] = timed_coroutine(globals()[_name], DB_OP_SECONDS, DB_OP_ERRORS, _name)
@@ -0,0 +1,802 @@
+# database_sqlite.py
+# SQLite storage backend. It implements the same coroutines as database.py and
+# is selected with DATABASE_BACKEND=sqlite; database.py re-exports them then.
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+import aiosqlite
+
+from archive import Archive
+from database import (
+    ARCHIVE_DIR,
+    DB_PATH,
+    DEFAULT_CATEGORIES,
+    DEFAULT_MENU_ROWS,
+    STATS_UTC_OFFSET,
+    load_store_file,
+    stats_day,
+)
+from search import NAME_WEIGHT, DESC_WEIGHT, PREFIX_MIN, query_terms, tokenize
+
+SQLITE_PATH = os.getenv("SQLITE_DATABASE", "./shop.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS products (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    category TEXT NOT NULL,
+    price INTEGER NOT NULL,
+    "desc" TEXT,
+    photo TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_products_category ON products (category, id);
+
+CREATE TABLE IF NOT EXISTS orders (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    fullname TEXT,
+    address TEXT,
+    phone TEXT,
+    total INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    created_ts TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_orders_status ON orders (status, id);
+
+CREATE TABLE IF NOT EXISTS order_items (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    order_id INTEGER NOT NULL,
+    product_id INTEGER NOT NULL,
+    qty INTEGER NOT NULL,
+    price INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items (order_id, id);
+
+-- Catalog search: normalized name and description (search.tokenize), rowid
+-- is the product id. Kept in step with products by the functions below.
+CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+    name, "desc", tokenize = 'unicode61 remove_diacritics 0', prefix = '2 3'
+);
+
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+
+-- Sales statistics, maintained by the triggers in _stats_triggers() with the
+-- same rules as data["stats"] in database.py.
+CREATE TABLE IF NOT EXISTS stats_days (
+    day TEXT NOT NULL,
+    status TEXT NOT NULL,
+    orders INTEGER NOT NULL,
+    revenue INTEGER NOT NULL,
+    PRIMARY KEY (day, status)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS stats_statuses (
+    status TEXT PRIMARY KEY,
+    orders INTEGER NOT NULL,
+    revenue INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS stats_products (
+    product_id INTEGER PRIMARY KEY,
+    qty INTEGER NOT NULL,
+    revenue INTEGER NOT NULL,
+    category TEXT NOT NULL,
+    name TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_stats_products_revenue ON stats_products (revenue);
+CREATE TABLE IF NOT EXISTS stats_categories (
+    category TEXT PRIMARY KEY,
+    qty INTEGER NOT NULL,
+    revenue INTEGER NOT NULL
+);
+-- utc_offset the day buckets were computed with
+CREATE TABLE IF NOT EXISTS stats_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+PRODUCT_COLUMNS = 'id, name, category, price, "desc", photo'
+ORDER_COLUMNS = "id, user_id, fullname, address, phone, total, status, created_ts"
+ORDER_ITEM_COLUMNS = "id, order_id, product_id, qty, price"
+
+def _upsert(table: str, key: str, select: str) -> str:
+    # Adds the selected (count, amount) rows onto the running totals.
+    count, amount = ("qty", "revenue") if table in ("stats_products", "stats_categories") else ("orders", "revenue")
+    return (
+        f"INSERT INTO {table} {select} ON CONFLICT ({key}) DO UPDATE SET "
+        f"{count} = {count} + excluded.{count}, {amount} = {amount} + excluded.{amount};"
+    )
+
+
+def _order_totals_sql(row: str, sign: int, day: str) -> str:
+    # row is NEW or OLD in an orders trigger.
+    return _upsert(
+        "stats_days",
+        "day, status",
+        f"(day, status, orders, revenue) SELECT {day.format(row=row)}, {row}.status, {sign}, {sign} * {row}.total",
+    ) + _upsert(
+        "stats_statuses",
+        "status",
+        f"(status, orders, revenue) SELECT {row}.status, {sign}, {sign} * {row}.total",
+    )
+
+
+def _order_items_sql(row: str, sign: int, condition: str) -> str:
+    # Every item of the order `row` enters (+1) or leaves (-1) the product
+    # and category totals, when `condition` holds.
+    return _upsert(
+        "stats_products",
+        "product_id",
+        "(product_id, qty, revenue, category, name) "
+        f"SELECT i.product_id, {sign} * SUM(i.qty), {sign} * SUM(i.qty * i.price), COALESCE(p.category, ''), p.name "
+        "FROM order_items AS i LEFT JOIN products AS p ON p.id = i.product_id "
+        f"WHERE i.order_id = {row}.id AND {condition} GROUP BY i.product_id",
+    ) + _upsert(
+        "stats_categories",
+        "category",
+        f"(category, qty, revenue) SELECT s.category, {sign} * SUM(i.qty), {sign} * SUM(i.qty * i.price) "
+        "FROM order_items AS i JOIN stats_products AS s ON s.product_id = i.product_id "
+        f"WHERE i.order_id = {row}.id AND {condition} GROUP BY s.category",
+    )
+
+
+def _item_sql(row: str, sign: int) -> str:
+    # One order item, counted while its order exists and is not cancelled.
+    counted = f"o.id = {row}.order_id AND o.status <> 'cancelled'"
+    return _upsert(
+        "stats_products",
+        "product_id",
+        "(product_id, qty, revenue, category, name) "
+        f"SELECT {row}.product_id, {sign} * {row}.qty, {sign} * {row}.qty * {row}.price, "
+        "COALESCE(p.category, ''), p.name "
+        f"FROM orders AS o LEFT JOIN products AS p ON p.id = {row}.product_id WHERE {counted}",
+    ) + _upsert(
+        "stats_categories",
+        "category",
+        f"(category, qty, revenue) SELECT s.category, {sign} * {row}.qty, {sign} * {row}.qty * {row}.price "
+        f"FROM orders AS o, stats_products AS s WHERE {counted} AND s.product_id = {row}.product_id",
+    )
+
+
+def _stats_triggers(utc_offset: int) -> str:
+    day = "date({row}.created_ts, '%+d hours')" % utc_offset
+    triggers = {
+        "stats_order_insert": (
+            "AFTER INSERT ON orders",
+            _order_totals_sql("NEW", 1, day) + _order_items_sql("NEW", 1, "NEW.status <> 'cancelled'"),
+        ),
+        "stats_order_delete": (
+            "AFTER DELETE ON orders",
+            _order_totals_sql("OLD", -1, day) + _order_items_sql("OLD", -1, "OLD.status <> 'cancelled'"),
+        ),
+        "stats_order_update": (
+            "AFTER UPDATE OF status, total, created_ts ON orders",
+            _order_totals_sql("OLD", -1, day)
+            + _order_totals_sql("NEW", 1, day)
+            + _order_items_sql("NEW", 1, "OLD.status = 'cancelled' AND NEW.status <> 'cancelled'")
+            + _order_items_sql("NEW", -1, "OLD.status <> 'cancelled' AND NEW.status = 'cancelled'"),
+        ),
+        "stats_item_insert": ("AFTER INSERT ON order_items", _item_sql("NEW", 1)),
+        "stats_item_delete": ("AFTER DELETE ON order_items", _item_sql("OLD", -1)),
+        "stats_item_update": ("AFTER UPDATE ON order_items", _item_sql("OLD", -1) + _item_sql("NEW", 1)),
+        "stats_product_update": (
+            "AFTER UPDATE OF category, name ON products",
+            _upsert(
+                "stats_categories",
+                "category",
+                "(category, qty, revenue) SELECT category, -qty, -revenue FROM stats_products "
+                "WHERE product_id = NEW.id AND category <> NEW.category",
+            )
+            + _upsert(
+                "stats_categories",
+                "category",
+                "(category, qty, revenue) SELECT NEW.category, qty, revenue FROM stats_products "
+                "WHERE product_id = NEW.id AND category <> NEW.category",
+            )
+            + "UPDATE stats_products SET category = NEW.category, name = NEW.name WHERE product_id = NEW.id;",
+        ),
+    }
+    return "".join(
+        f"DROP TRIGGER IF EXISTS {name};\nCREATE TRIGGER {name} {event} BEGIN\n{body}\nEND;\n"
+        for name, (event, body) in triggers.items()
+    )
+
+
+def _rebuild_stats_sql(utc_offset: int) -> str:
+    day = "date(created_ts, '%+d hours')" % utc_offset
+    return f"""
+DELETE FROM stats_days;
+DELETE FROM stats_statuses;
+DELETE FROM stats_products;
+DELETE FROM stats_categories;
+INSERT INTO stats_days SELECT {day}, status, COUNT(*), SUM(total) FROM orders GROUP BY 1, 2;
+INSERT INTO stats_statuses SELECT status, COUNT(*), SUM(total) FROM orders GROUP BY status;
+INSERT INTO stats_products
+    SELECT i.product_id, SUM(i.qty), SUM(i.qty * i.price), COALESCE(p.category, ''), p.name
+    FROM order_items AS i JOIN orders AS o ON o.id = i.order_id LEFT JOIN products AS p ON p.id = i.product_id
+    WHERE o.status <> 'cancelled' GROUP BY i.product_id;
+INSERT INTO stats_categories SELECT category, SUM(qty), SUM(revenue) FROM stats_products GROUP BY category;
+INSERT OR REPLACE INTO stats_meta (key, value) VALUES ('utc_offset', '{utc_offset}');
+"""
+
+
+# One connection for writes and one for reads: with WAL the reader never
+# waits for the writer, and other processes can read the file concurrently.
+_CONNECTIONS: Dict[str, Optional[aiosqlite.Connection]] = {"writer": None, "reader": None}
+_CONNECT_LOCK = asyncio.Lock()
+# Write transactions share the writer connection, so they must not interleave.
+_WRITE_LOCK = asyncio.Lock()
+
+
+def _default_settings() -> Dict[str, Any]:
+    return {
+        "categories": list(DEFAULT_CATEGORIES),
+        "menu_rows": [list(row) for row in DEFAULT_MENU_ROWS],
+    }
+
+
+async def _open(path: str) -> aiosqlite.Connection:
+    conn = await aiosqlite.connect(path)
+    await conn.execute("PRAGMA journal_mode=WAL")
+    await conn.execute("PRAGMA synchronous=NORMAL")
+    await conn.execute("PRAGMA busy_timeout=5000")
+    return conn
+
+
+async def _connection(role: str) -> aiosqlite.Connection:
+    conn = _CONNECTIONS[role]
+    if conn is not None:
+        return conn
+    async with _CONNECT_LOCK:
+        if _CONNECTIONS["writer"] is None:
+            writer = await _open(SQLITE_PATH)
+            await writer.executescript(SCHEMA)
+            await writer.executescript(_stats_triggers(STATS_UTC_OFFSET))
+            # Databases without statistics, or counted in another time zone,
+            # are recounted from the rows.
+            async with writer.execute("SELECT value FROM stats_meta WHERE key = 'utc_offset'") as cursor:
+                row = await cursor.fetchone()
+            if row is None or int(row[0]) != STATS_UTC_OFFSET:
+                await writer.executescript(_rebuild_stats_sql(STATS_UTC_OFFSET))
+            await writer.commit()
+            _CONNECTIONS["writer"] = writer
+        if _CONNECTIONS["reader"] is None:
+            _CONNECTIONS["reader"] = await _open(SQLITE_PATH)
+    return _CONNECTIONS[role]
+
+
+async def _fetchall(sql: str, params: tuple = ()) -> List[tuple]:
+    conn = await _connection("reader")
+    return list(await conn.execute_fetchall(sql, params))
+
+
+async def _fetchone(sql: str, params: tuple = ()) -> Optional[tuple]:
+    rows = await _fetchall(sql, params)
+    return rows[0] if rows else None
+
+
+async def close_db():
+    for role in ("reader", "writer"):
+        conn = _CONNECTIONS[role]
+        _CONNECTIONS[role] = None
+        if conn is not None:
+            await conn.close()
+
+
+def _fts_row(pid, name, desc) -> tuple:
+    return (pid, " ".join(tokenize(name)), " ".join(tokenize(desc)))
+
+
+async def _index_product(writer: aiosqlite.Connection, pid, name, desc) -> None:
+    await writer.execute("DELETE FROM products_fts WHERE rowid = ?", (pid,))
+    await writer.execute(
+        'INSERT INTO products_fts (rowid, name, "desc") VALUES (?, ?, ?)', _fts_row(pid, name, desc)
+    )
+
+
+async def init_db():
+    writer = await _connection("writer")
+    async with _WRITE_LOCK:
+        for key, value in _default_settings().items():
+            await writer.execute(
+                "INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)",
+                (key, json.dumps(value, ensure_ascii=False)),
+            )
+        # Databases created before catalog search have no search rows yet.
+        async with writer.execute("SELECT 1 FROM products_fts LIMIT 1") as cursor:
+            indexed = await cursor.fetchone() is not None
+        if not indexed:
+            async with writer.execute('SELECT id, name, "desc" FROM products') as cursor:
+                products = await cursor.fetchall()
+            await writer.executemany(
+                'INSERT INTO products_fts (rowid, name, "desc") VALUES (?, ?, ?)',
+                [_fts_row(*product) for product in products],
+            )
+        await writer.commit()
+
+
+async def add_product(name, category, price, desc, photo):
+    writer = await _connection("writer")
+    async with _WRITE_LOCK:
+        cursor = await writer.execute(
+            'INSERT INTO products (name, category, price, "desc", photo) VALUES (?, ?, ?, ?, ?)',
+            (name, category, price, desc, photo),
+        )
+        await _index_product(writer, cursor.lastrowid, name, desc)
+        await writer.commit()
+    return cursor.lastrowid
+
+
+def _page_clause(after_id, before_id, limit):
+    # Returns (conditions, params, descending, tail) for an id cursor. The
+    # limit parameter comes last in params, matching the ORDER BY/LIMIT tail.
+    # A before_id-only page is read descending and reversed by the caller.
+    conditions = []
+    params: List[Any] = []
+    if after_id is not None:
+        conditions.append("id > ?")
+        params.append(after_id)
+    if before_id is not None:
+        conditions.append("id < ?")
+        params.append(before_id)
+    descending = before_id is not None and after_id is None and limit is not None
+    order = " ORDER BY id DESC" if descending else " ORDER BY id"
+    tail = order
+    if limit is not None:
+        tail += " LIMIT ?"
+        params.append(limit)
+    return conditions, params, descending, tail
+
+
+async def list_products_by_category(
+    category,
+    after_id: Optional[int] = None,
+    before_id: Optional[int] = None,
+    limit: Optional[int] = None,
+):
+    conditions, params, descending, tail = _page_clause(after_id, before_id, limit)
+    where = " AND ".join(["category = ?"] + conditions)
+    rows = await _fetchall(
+        f'SELECT id, name, price, "desc", photo FROM products WHERE {where}{tail}',
+        tuple([category] + params),
+    )
+    return rows[::-1] if descending else rows
+
+
+async def list_all_products(
+    limit: Optional[int] = None,
+    after_id: Optional[int] = None,
+    before_id: Optional[int] = None,
+):
+    conditions, params, descending, tail = _page_clause(after_id, before_id, limit)
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+    rows = await _fetchall(f"SELECT {PRODUCT_COLUMNS} FROM products{where}{tail}", tuple(params))
+    return rows[::-1] if descending else rows
+
+
+async def get_product(pid):
+    return await _fetchone(f"SELECT {PRODUCT_COLUMNS} FROM products WHERE id = ?", (pid,))
+
+
+async def get_products(ids):
+    ids = list(dict.fromkeys(ids))
+    rows = {}
+    # Stay well below SQLite's bound-parameter limit.
+    for start in range(0, len(ids), 500):
+        chunk = ids[start : start + 500]
+        placeholders = ", ".join("?" for _ in chunk)
+        for row in await _fetchall(
+            f"SELECT {PRODUCT_COLUMNS} FROM products WHERE id IN ({placeholders})", tuple(chunk)
+        ):
+            rows[row[0]] = row
+    return rows
+
+
+async def update_product(pid, name=None, category=None, price=None, desc=None, photo=None):
+    fields = [
+        (column, value)
+        for column, value in (
+            ("name", name),
+            ("category", category),
+            ("price", price),
+            ('"desc"', desc),
+            ("photo", photo),
+        )
+        if value is not None
+    ]
+    if not fields:
+        return await get_product(pid) is not None
+    assignments = ", ".join(f"{column} = ?" for column, _ in fields)
+    writer = await _connection("writer")
+    async with _WRITE_LOCK:
+        cursor = await writer.execute(
+            f"UPDATE products SET {assignments} WHERE id = ?",
+            tuple(value for _, value in fields) + (pid,),
+        )
+        if cursor.rowcount > 0 and (name is not None or desc is not None):
+            async with writer.execute('SELECT name, "desc" FROM products WHERE id = ?', (pid,)) as current:
+                row = await current.fetchone()
+            await _index_product(writer, pid, row[0], row[1])
+        await writer.commit()
+    return cursor.rowcount > 0
+
+
+async def delete_product(pid):
+    writer = await _connection("writer")
+    async with _WRITE_LOCK:
+        cursor = await writer.execute("DELETE FROM products WHERE id = ?", (pid,))
+        await writer.execute("DELETE FROM products_fts WHERE rowid = ?", (pid,))
+        await writer.commit()
+    return cursor.rowcount > 0
+
+
+async def search_products(query: str, limit: int = 10, offset: int = 0):
+    # Words are normalized like the indexed text; each must match, and words
+    # of PREFIX_MIN characters or more also match as prefixes. Ranked by
+    # bm25 with name hits weighted above description hits.
+    words = query_terms(query)
+    if not words:
+        return [], 0
+    match = " ".join(f'"{word}"*' if len(word) >= PREFIX_MIN else f'"{word}"' for word in words)
+    total = await _fetchone("SELECT COUNT(*) FROM products_fts WHERE products_fts MATCH ?", (match,))
+    if not total[0]:
+        return [], 0
+    rows = await _fetchall(
+        'SELECT p.id, p.name, p.price, p."desc", p.photo FROM ('
+        "SELECT rowid, bm25(products_fts, ?, ?) AS score FROM products_fts WHERE products_fts MATCH ? "
+        "ORDER BY score, rowid LIMIT ? OFFSET ?"
+        ") AS m JOIN products AS p ON p.id = m.rowid ORDER BY m.score, p.id",
+        (NAME_WEIGHT, DESC_WEIGHT, match, limit, offset),
+    )
+    return rows, total[0]
+
+
+async def create_order(user_id, fullname, address, phone, total):
+    writer = await _connection("writer")
+    async with _WRITE_LOCK:
+        cursor = await writer.execute(
+            "INSERT INTO orders (user_id, fullname, address, phone, total, status, created_ts)"
+            " VALUES (?, ?, ?, ?, ?, 'pending', ?)",
+            (user_id, fullname, address, phone, total, datetime.utcnow().isoformat()),
+        )
+        await writer.commit()
+    return cursor.lastrowid
+
+
+async def add_order_item(order_id, product_id, qty, price):
+    writer = await _connection("writer")
+    async with _WRITE_LOCK:
+        await writer.execute(
+            "INSERT INTO order_items (order_id, product_id, qty, price) VALUES (?, ?, ?, ?)",
+            (order_id, product_id, qty, price),
+        )
+        await writer.commit()
+
+
+async def place_order(user_id, fullname, address, phone, items):
+    items = list(items)
+    total = sum(price * qty for _, qty, price in items)
+    writer = await _connection("writer")
+    async with _WRITE_LOCK:
+        try:
+            cursor = await writer.execute(
+                "INSERT INTO orders (user_id, fullname, address, phone, total, status, created_ts)"
+                " VALUES (?, ?, ?, ?, ?, 'pending', ?)",
+                (user_id, fullname, address, phone, total, datetime.utcnow().isoformat()),
+            )
+            order_id = cursor.lastrowid
+            await writer.executemany(
+                "INSERT INTO order_items (order_id, product_id, qty, price) VALUES (?, ?, ?, ?)",
+                [(order_id, product_id, qty, price) for product_id, qty, price in items],
+            )
+            await writer.commit()
+        except BaseException:
+            await writer.rollback()
+            raise
+    return order_id
+
+
+async def get_order(order_id):
+    return await _fetchone(f"SELECT {ORDER_COLUMNS} FROM orders WHERE id = ?", (order_id,))
+
+
+async def get_order_total(order_id):
+    order = await get_order(order_id)
+    return order[5] if order else None
+
+
+async def list_orders(
+    limit: int = 10,
+    after_id: Optional[int] = None,
+    before_id: Optional[int] = None,
+):
+    # Newest first, like the JSON store.
+    if after_id is not None:
+        rows = await _fetchall(
+            f"SELECT {ORDER_COLUMNS} FROM orders WHERE id > ?"
+            + (" AND id < ?" if before_id is not None else "")
+            + " ORDER BY id LIMIT ?",
+            (after_id,) + ((before_id,) if before_id is not None else ()) + (limit,),
+        )
+        return rows[::-1]
+    if before_id is not None:
+        return await _fetchall(
+            f"SELECT {ORDER_COLUMNS} FROM orders WHERE id < ? ORDER BY id DESC LIMIT ?",
+            (before_id, limit),
+        )
+    return await _fetchall(
+        f"SELECT {ORDER_COLUMNS} FROM orders ORDER BY id DESC LIMIT ?", (limit,)
+    )
+
+
+async def get_order_items(order_id: int):
+    return await _fetchall(
+        f"SELECT {ORDER_ITEM_COLUMNS} FROM order_items WHERE order_id = ? ORDER BY id",
+        (order_id,),
+    )
+
+
+async def export_orders_page(
+    after_id: Optional[int] = None,
+    limit: int = 200,
+    statuses: Optional[List[str]] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+):
+    # Same contract as database.export_orders_page.
+    conditions = ["id > ?"]
+    params: List[Any] = [after_id or 0]
+    if statuses:
+        conditions.append(f"status IN ({', '.join('?' for _ in statuses)})")
+        params += list(statuses)
+    if since:
+        conditions.append("created_ts >= ?")
+        params.append(since)
+    if until:
+        conditions.append("created_ts < ?")
+        params.append(until)
+    orders = await _fetchall(
+        f"SELECT {ORDER_COLUMNS} FROM orders WHERE {' AND '.join(conditions)} ORDER BY id LIMIT ?",
+        tuple(params + [limit]),
+    )
+    if not orders:
+        return [], None
+    lines: Dict[int, List[tuple]] = {}
+    placeholders = ", ".join("?" for _ in orders)
+    for order_id, product_id, name, qty, price in await _fetchall(
+        "SELECT i.order_id, i.product_id, p.name, i.qty, i.price FROM order_items AS i "
+        f"LEFT JOIN products AS p ON p.id = i.product_id WHERE i.order_id IN ({placeholders}) "
+        "ORDER BY i.order_id, i.id",
+        tuple(order[0] for order in orders),
+    ):
+        lines.setdefault(order_id, []).append((product_id, name, qty, price))
+    page = [(order, lines.get(order[0], [])) for order in orders]
+    return page, orders[-1][0] if len(orders) == limit else None
+
+
+async def update_order_status(order_id: int, status: str):
+    writer = await _connection("writer")
+    async with _WRITE_LOCK:
+        cursor = await writer.execute(
+            "UPDATE orders SET status = ? WHERE id = ?", (status, order_id)
+        )
+        await writer.commit()
+    return cursor.rowcount > 0
+
+
+async def update_orders_status(
+    order_ids: List[int], status: str, from_statuses: Optional[List[str]] = None
+) -> List[int]:
+    order_ids = list(dict.fromkeys(order_ids))
+    if not order_ids:
+        return []
+    writer = await _connection("writer")
+    async with _WRITE_LOCK:
+        where = f"id IN ({','.join('?' * len(order_ids))})"
+        params: List[Any] = list(order_ids)
+        if from_statuses is not None:
+            from_statuses = list(from_statuses)
+            where += f" AND status IN ({','.join('?' * len(from_statuses))})"
+            params += from_statuses
+        async with writer.execute(f"SELECT id FROM orders WHERE {where}", params) as cursor:
+            found = {row[0] for row in await cursor.fetchall()}
+        await writer.execute(f"UPDATE orders SET status = ? WHERE {where}", [status, *params])
+        await writer.commit()
+    return [oid for oid in order_ids if oid in found]
+
+
+async def get_settings():
+    settings = _default_settings()
+    for key, value in await _fetchall("SELECT key, value FROM settings"):
+        settings[key] = json.loads(value)
+    return settings
+
+
+async def _set_setting(key: str, value: Any):
+    writer = await _connection("writer")
+    async with _WRITE_LOCK:
+        await writer.execute(
+            "INSERT INTO settings (key, value) VALUES (?, ?)"
+            " ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, json.dumps(value, ensure_ascii=False)),
+        )
+        await writer.commit()
+
+
+async def set_categories(categories: List[str]):
+    await _set_setting("categories", categories)
+
+
+async def set_menu_rows(menu_rows: List[List[str]]):
+    await _set_setting("menu_rows", menu_rows)
+
+
+async def get_stats(days: int = 7, top: int = 5):
+    # Same result as database.get_stats, read from the stats_* tables.
+    today = stats_day(datetime.utcnow().isoformat())
+    first = datetime.fromisoformat(today)
+    day_list = [(first - timedelta(days=n)).date().isoformat() for n in range(days)]
+    by_day: Dict[str, Dict[str, tuple]] = {day: {} for day in day_list}
+    for day, status, orders, revenue in await _fetchall(
+        "SELECT day, status, orders, revenue FROM stats_days "
+        "WHERE day >= ? AND day <= ? AND (orders <> 0 OR revenue <> 0)",
+        (day_list[-1], today) if day_list else (today, ""),
+    ):
+        by_day[day][status] = (orders, revenue)
+    statuses = await _fetchall(
+        "SELECT status, orders, revenue FROM stats_statuses WHERE orders <> 0 OR revenue <> 0"
+    )
+    categories = await _fetchall(
+        "SELECT category, qty, revenue FROM stats_categories "
+        "WHERE qty <> 0 OR revenue <> 0 ORDER BY revenue DESC"
+    )
+    products = await _fetchall(
+        "SELECT product_id, name, category, qty, revenue FROM stats_products "
+        "WHERE qty <> 0 OR revenue <> 0 ORDER BY revenue DESC LIMIT ?",
+        (top,),
+    )
+    return {
+        "today": today,
+        "days": [(day, by_day[day]) for day in day_list],
+        "statuses": {status: (orders, revenue) for status, orders, revenue in statuses},
+        "categories": categories,
+        "top_products": products,
+    }
+
+
+async def compact_journal() -> bool:
+    return False
+
+
+def start_journal_compaction(interval: Optional[float] = None):
+    return None
+
+
+# Orders stay in their table: indexed lookups do not slow down as it grows,
+# so there is nothing to archive. Archives made by the JSON store are
+# imported by migrate_json_to_sqlite.
+async def archive_orders(older_than_days: Optional[float] = None, limit: Optional[int] = None) -> int:
+    return 0
+
+
+def start_archiving(interval: Optional[float] = None):
+    return None
+
+
+async def is_order_archived(order_id: int) -> bool:
+    return False
+
+
+async def list_archive_months() -> List[str]:
+    return []
+
+
+async def archived_orders(month: str, after_id=None, limit=200, statuses=None, since=None, until=None):
+    return [], None
+
+
+def migrate_json_to_sqlite(
+    json_path: str = DB_PATH, sqlite_path: str = SQLITE_PATH, archive_path: Optional[str] = None
+) -> Dict[str, int]:
+    # Imports a shop.json store (plus its journal and archived orders, if
+    # any). Ids are preserved and the AUTOINCREMENT counters continue from
+    # the JSON next_* counters. A database that already has products or
+    # orders is refused: importing again would overwrite changes made since.
+    data = load_store_file(json_path, json_path + ".log")
+    hot = {order["id"] for order in data["orders"]}
+    if archive_path is None:
+        archive_path = ARCHIVE_DIR if json_path == DB_PATH else json_path + ".archive"
+    for _, segment in Archive(archive_path).segments():
+        for order_id, order in segment["orders"].items():
+            if order_id not in hot:
+                data["orders"].append(order)
+                data["order_items"].extend(segment["items"].get(order_id, ()))
+    meta = data.get("meta", {})
+    settings = data.get("settings") or _default_settings()
+
+    conn = sqlite3.connect(sqlite_path)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+        for table in ("products", "orders", "order_items"):
+            if conn.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone():
+                raise RuntimeError(f"{sqlite_path} already has {table}; migrate into a new database")
+        with conn:
+            conn.executemany(
+                f"INSERT OR REPLACE INTO products ({PRODUCT_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (p["id"], p["name"], p["category"], p["price"], p.get("desc"), p.get("photo"))
+                    for p in data.get("products", [])
+                ],
+            )
+            conn.execute("DELETE FROM products_fts")
+            conn.executemany(
+                'INSERT INTO products_fts (rowid, name, "desc") VALUES (?, ?, ?)',
+                [_fts_row(p["id"], p["name"], p.get("desc")) for p in data.get("products", [])],
+            )
+            conn.executemany(
+                f"INSERT OR REPLACE INTO orders ({ORDER_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        o["id"],
+                        o["user_id"],
+                        o.get("fullname"),
+                        o.get("address"),
+                        o.get("phone"),
+                        o["total"],
+                        o.get("status", "pending"),
+                        o["created_ts"],
+                    )
+                    for o in data.get("orders", [])
+                ],
+            )
+            conn.executemany(
+                f"INSERT OR REPLACE INTO order_items ({ORDER_ITEM_COLUMNS}) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (i["id"], i["order_id"], i["product_id"], i["qty"], i["price"])
+                    for i in data.get("order_items", [])
+                ],
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
+                [(key, json.dumps(value, ensure_ascii=False)) for key, value in settings.items()],
+            )
+            for table, counter in (
+                ("products", "next_product_id"),
+                ("orders", "next_order_id"),
+                ("order_items", "next_order_item_id"),
+            ):
+                last_id = max(meta.get(counter, 1) - 1, 0)
+                conn.execute("DELETE FROM sqlite_sequence WHERE name = ?", (table,))
+                conn.execute(
+                    "INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (table, last_id)
+                )
+        conn.executescript(_stats_triggers(STATS_UTC_OFFSET) + _rebuild_stats_sql(STATS_UTC_OFFSET))
+    finally:
+        conn.close()
+    return {
+        "products": len(data.get("products", [])),
+        "orders": len(data.get("orders", [])),
+        "order_items": len(data.get("order_items", [])),
+    }
+
+
+if __name__ == "__main__":
+    # python database_sqlite.py [shop.json] [shop.db]
+    source = sys.argv[1] if len(sys.argv) > 1 else DB_PATH
+    target = sys.argv[2] if len(sys.argv) > 2 else SQLITE_PATH
+    try:
+        counts = migrate_json_to_sqlite(source, target)
+    except RuntimeError as exc:
+        raise SystemExit(str(exc))
+    print(
+        f"{source} -> {target}: {counts['products']} products, "
+        f"{counts['orders']} orders, {counts['order_items']} order items"
+    )
@@ -0,0 +1,292 @@
+# loadtest/bot_load.py
+# End-to-end load test: runs main.py against the fake Bot API in
+# loadtest/fake_telegram.py and drives simulated users through
+#   category -> /t{pid} (or the inline "add" button) -> /cart -> /checkout
+#   -> "Ism — Manzil — Telefon" -> /pay_*_{order}
+# Each stage runs --users journeys with a given number of users active at
+# once; give several --concurrency values to find the saturation point
+# (updates/s stops growing while latency climbs).
+#
+#   python loadtest/bot_load.py --users 2000 --concurrency 10,50,200 --output load.json
+#   python loadtest/bot_load.py --mode webhook --max-error-rate 0.01   # CI
+#   python loadtest/bot_load.py --bot-env DATABASE_BACKEND=sqlite --bot-env SESSION_BACKEND=sqlite
+#
+# The bot runs as a subprocess with a fresh store in a temp dir (shop.json,
+# imported into shop.db for the SQLite backend); seeds make
+# the journeys repeatable. By default the outbound rate limits are raised so
+# the bot itself, not the Telegram limits, is measured (--real-limits keeps
+# them). Exits non-zero when the error rate exceeds --max-error-rate.
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, HERE)
+
+from database import DEFAULT_CATEGORIES  # noqa: E402
+from fake_telegram import FakeTelegram  # noqa: E402
+
+BOT_TOKEN = "123456:loadtest"
+STEPS = ("browse", "add", "cart", "checkout", "address", "pay")
+
+
+class StepFailed(Exception):
+    pass
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def seed_store(path, products, photos, seed):
+    rng = random.Random(seed)
+    rows = [
+        {
+            "id": pid,
+            "name": f"Mahsulot {pid}",
+            "category": DEFAULT_CATEGORIES[pid % len(DEFAULT_CATEGORIES)],
+            "price": rng.randrange(5000, 200000, 500),
+            "desc": "Yuklama testi uchun mahsulot",
+            "photo": f"AgACAgIAAxkBAAI{pid}" if photos else "",
+        }
+        for pid in range(1, products + 1)
+    ]
+    data = {
+        "meta": {"next_product_id": products + 1, "next_order_id": 1, "next_order_item_id": 1},
+        "products": rows,
+        "orders": [],
+        "order_items": [],
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * pct / 100))]
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    ms = lambda value: None if value is None else round(value * 1000, 2)  # noqa: E731
+    return {
+        "count": len(samples),
+        "p50_ms": ms(percentile(samples, 50)),
+        "p90_ms": ms(percentile(samples, 90)),
+        "p99_ms": ms(percentile(samples, 99)),
+        "max_ms": ms(samples[-1] if samples else None),
+    }
+
+
+class Journeys:
+    def __init__(self, telegram, timeout, seed):
+        self.telegram = telegram
+        self.timeout = timeout
+        self.seed = seed
+        self.latency = {step: [] for step in STEPS}
+        self.errors = {step: 0 for step in STEPS}
+        self.updates = 0
+
+    async def step(self, name, user_id, update, expect):
+        # Sends one update and waits for the bot message that completes the
+        # step (albums sent before a category card are skipped).
+        inbox = self.telegram.inbox(user_id)
+        while not inbox.empty():
+            inbox.get_nowait()
+        started = time.perf_counter()
+        await self.telegram.push(update)
+        self.updates += 1
+        deadline = started + self.timeout
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                self.errors[name] += 1
+                raise StepFailed(name)
+            try:
+                reply = await asyncio.wait_for(inbox.get(), remaining)
+            except asyncio.TimeoutError:
+                continue
+            match = re.search(expect, reply["text"] or "")
+            if match:
+                self.latency[name].append(reply["at"] - started)
+                return match, reply
+
+    async def journey(self, user_id):
+        rng = random.Random(self.seed * 1000003 + user_id)
+        tg = self.telegram
+        try:
+            category = rng.choice(DEFAULT_CATEGORIES)
+            _, reply = await self.step("browse", user_id, tg.text_update(user_id, category), r"/t\d+")
+            pid = int(rng.choice(re.findall(r"/t(\d+)", reply["text"])))
+            if rng.random() < 0.5:
+                await self.step("add", user_id, tg.text_update(user_id, f"/t{pid}"), r"[Ss]avatchaga")
+            else:
+                await self.step("add", user_id, tg.callback_update(user_id, f"add:{pid}"), r"[Ss]avatchaga")
+            await self.step("cart", user_id, tg.text_update(user_id, "/cart"), r"Jami")
+            await self.step("checkout", user_id, tg.text_update(user_id, "/checkout"), r"Buyurtma jami")
+            match, _ = await self.step(
+                "address",
+                user_id,
+                tg.text_update(user_id, f"User{user_id} — Toshkent, Chilonzor — +998901234567"),
+                r"qabul qilindi — #(\d+)",
+            )
+            provider = rng.choice(("payme", "click", "usdt"))
+            await self.step(
+                "pay", user_id, tg.text_update(user_id, f"/pay_{provider}_{match.group(1)}"), r"To‘lov|USDT"
+            )
+        except StepFailed:
+            return False
+        return True
+
+
+async def run_stage(telegram, users, concurrency, timeout, seed, first_user):
+    journeys = Journeys(telegram, timeout, seed)
+    pending = iter(range(first_user, first_user + users))
+    completed = 0
+
+    async def worker():
+        nonlocal completed
+        for user_id in pending:
+            ok = await journeys.journey(user_id)
+            completed += ok
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    everything = [value for samples in journeys.latency.values() for value in samples]
+    failed = users - completed
+    return {
+        "concurrency": concurrency,
+        "users": users,
+        "completed": completed,
+        "failed": failed,
+        "error_rate": round(failed / users, 4) if users else 0.0,
+        "updates": journeys.updates,
+        "elapsed_s": round(elapsed, 3),
+        "updates_per_s": round(journeys.updates / elapsed, 1),
+        "latency": summarize(everything),
+        "steps": {
+            step: dict(summarize(samples), errors=journeys.errors[step])
+            for step, samples in journeys.latency.items()
+        },
+    }
+
+
+def print_stage(stage):
+    lat = stage["latency"]
+    print(
+        f"\nconcurrency {stage['concurrency']}: {stage['updates']} updates in {stage['elapsed_s']}s "
+        f"= {stage['updates_per_s']} updates/s, {stage['failed']}/{stage['users']} journeys failed, "
+        f"latency p50 {lat['p50_ms']}ms p90 {lat['p90_ms']}ms p99 {lat['p99_ms']}ms max {lat['max_ms']}ms"
+    )
+    for step, entry in stage["steps"].items():
+        print(
+            f"  {step:<9} p50 {entry['p50_ms']}ms p99 {entry['p99_ms']}ms "
+            f"max {entry['max_ms']}ms errors {entry['errors']}"
+        )
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=1000, help="journeys per stage")
+    parser.add_argument("--concurrency", default="10,50,100", help="active users per stage, comma-separated")
+    parser.add_argument("--mode", choices=("polling", "webhook"), default="polling")
+    parser.add_argument("--products", type=int, default=300)
+    parser.add_argument("--photos", action="store_true", help="give products photos (albums, sendPhoto)")
+    parser.add_argument("--timeout", type=float, default=10.0, help="seconds to wait for each reply")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--real-limits", action="store_true", help="keep the outbound Telegram rate limits")
+    parser.add_argument("--bot-env", action="append", default=[], help="extra KEY=VALUE for the bot process")
+    parser.add_argument("--max-error-rate", type=float, default=None)
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    telegram = FakeTelegram()
+    runner = await telegram.start()
+    workdir = tempfile.mkdtemp(prefix="bot_load_")
+    bot_port = free_port()
+    env = dict(
+        os.environ,
+        BOT_TOKEN=BOT_TOKEN,
+        TELEGRAM_API_URL=f"http://127.0.0.1:{telegram.port}",
+        BOT_MODE=args.mode,
+        PORT=str(bot_port),
+        WEBHOOK_HOST=f"http://127.0.0.1:{bot_port}",
+        PYTHONUNBUFFERED="1",
+    )
+    env.pop("ADMIN_ID", None)
+    if not args.real_limits:
+        env.update(
+            OUTBOX_GLOBAL_RATE="100000",
+            OUTBOX_GLOBAL_BURST="100000",
+            OUTBOX_CHAT_RATE="1000",
+            OUTBOX_CHAT_BURST="1000",
+        )
+    for item in args.bot_env:
+        key, _, value = item.partition("=")
+        env[key] = value
+    json_path = os.path.join(workdir, "shop.json")
+    seed_store(json_path, args.products, args.photos, args.seed)
+    if env.get("DATABASE_BACKEND", "json").lower() == "sqlite":
+        # The SQLite backend never reads shop.json: import the seeded store
+        # into the database the bot will open (relative to its cwd).
+        from database_sqlite import migrate_json_to_sqlite
+
+        sqlite_path = os.path.join(workdir, env.get("SQLITE_DATABASE", "shop.db"))
+        migrate_json_to_sqlite(json_path, sqlite_path)
+    log_path = os.path.join(workdir, "bot.log")
+    with open(log_path, "wb") as log:
+        bot = subprocess.Popen(
+            [sys.executable, os.path.join(ROOT, "main.py")], cwd=workdir, env=env, stdout=log, stderr=log
+        )
+    report = {"args": vars(args), "stages": []}
+    try:
+        try:
+            await asyncio.wait_for(telegram.ready.wait(), 30)
+        except asyncio.TimeoutError:
+            raise SystemExit(f"bot did not start; see {log_path}")
+        first_user = 1
+        for concurrency in (int(c) for c in args.concurrency.split(",")):
+            stage = await run_stage(telegram, args.users, concurrency, args.timeout, args.seed, first_user)
+            first_user += args.users
+            report["stages"].append(stage)
+            print_stage(stage)
+        report["bot_api_calls"] = telegram.calls
+        report["webhook_retries"] = telegram.webhook_retries
+        print(f"\nBot API calls: {telegram.calls}; webhook redeliveries: {telegram.webhook_retries}")
+    finally:
+        bot.send_signal(signal.SIGINT)
+        try:
+            bot.wait(15)
+        except subprocess.TimeoutExpired:
+            bot.kill()
+        await telegram.close(runner)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    worst = max((stage["error_rate"] for stage in report["stages"]), default=0.0)
+    if args.max_error_rate is not None and worst > args.max_error_rate:
+        print(f"error rate {worst} exceeds {args.max_error_rate}; bot log: {log_path}")
+        return 1
+    shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
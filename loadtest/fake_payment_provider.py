@@ -0,0 +1,119 @@
+# loadtest/fake_payment_provider.py
+# Fake payment provider: sends "paid" callbacks the way a provider under a
+# retry storm would. Every payment is delivered several times, concurrently
+# and out of order, and some duplicates carry the same transaction id.
+#
+#   PAYMENT_SECRET=... python loadtest/fake_payment_provider.py --url http://localhost:8080/webhook/payment
+#   python loadtest/fake_payment_provider.py --local     # in-process PaymentInbox
+#
+# --local runs the pipeline against a temporary inbox with a fake database
+# and admin, then checks that every order was marked paid and notified
+# exactly once.
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+from aiohttp import ClientSession, ClientTimeout, web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from payments import PAYMENT_SECRET, PAYMENT_SIGNATURE_HEADER, PaymentInbox, sign  # noqa: E402
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+async def storm(url, secret, orders, deliveries, concurrency, first_order=1):
+    payloads = []
+    for order_id in range(first_order, first_order + orders):
+        body = {"order": order_id, "paid": True, "provider": "fakepay", "transaction": f"tx{order_id}"}
+        payloads.extend([json.dumps(body).encode()] * deliveries)
+    random.shuffle(payloads)
+
+    latencies, statuses = [], {}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send(session, body):
+        async with semaphore:
+            started = time.perf_counter()
+            headers = {"Content-Type": "application/json", PAYMENT_SIGNATURE_HEADER: sign(secret, body)}
+            async with session.post(url, data=body, headers=headers) as response:
+                await response.read()
+                latencies.append(time.perf_counter() - started)
+                statuses[response.status] = statuses.get(response.status, 0) + 1
+
+    started = time.perf_counter()
+    async with ClientSession(timeout=ClientTimeout(total=30)) as session:
+        await asyncio.gather(*(send(session, body) for body in payloads))
+    elapsed = time.perf_counter() - started
+    print(
+        f"{len(payloads)} callbacks in {elapsed:.2f}s ({len(payloads) / elapsed:.0f}/s), "
+        f"statuses {statuses}, latency p50 {percentile(latencies, 50) * 1000:.1f}ms "
+        f"p99 {percentile(latencies, 99) * 1000:.1f}ms max {max(latencies) * 1000:.1f}ms"
+    )
+    return statuses
+
+
+async def run_local(args):
+    applied, notified = [], []
+
+    async def apply_batch(order_ids):
+        await asyncio.sleep(0.01)  # a database commit
+        applied.extend(order_ids)
+        return order_ids
+
+    async def notify(order_ids):
+        await asyncio.sleep(0.2)  # a slow Telegram API
+        notified.extend(order_ids)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        inbox = PaymentInbox(apply_batch, notify, path=os.path.join(tmp, "payments.log"), secret=args.secret)
+        tasks = await inbox.start()
+        app = web.Application()
+        app.router.add_post("/webhook/payment", inbox.handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        url = f"http://127.0.0.1:{port}/webhook/payment"
+        await storm(url, args.secret, args.orders, args.deliveries, args.concurrency)
+        while inbox.queue_depth() or len(notified) < len(set(applied)) or len(applied) < args.orders:
+            await asyncio.sleep(0.05)
+        for task in tasks:
+            task.cancel()
+        await runner.cleanup()
+
+    print(f"inbox metrics: {inbox.metrics}")
+    ok = sorted(applied) == list(range(1, args.orders + 1)) and sorted(notified) == sorted(applied)
+    print("exactly once:", "ok" if ok else "FAILED")
+    return 0 if ok else 1
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:8080/webhook/payment")
+    parser.add_argument("--local", action="store_true")
+    parser.add_argument("--orders", type=int, default=500)
+    parser.add_argument("--deliveries", type=int, default=5, help="copies of every callback")
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--first-order", type=int, default=1)
+    parser.add_argument("--secret", default=PAYMENT_SECRET or "loadtest", help="defaults to PAYMENT_SECRET")
+    args = parser.parse_args()
+    if args.local:
+        return await run_local(args)
+    await storm(args.url, args.secret, args.orders, args.deliveries, args.concurrency, args.first_order)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
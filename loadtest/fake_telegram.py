@@ -0,0 +1,182 @@
+# loadtest/fake_telegram.py
+# Local stand-in for the Telegram Bot API, for load tests. It serves
+# /bot<token>/<method> for the calls the bot makes (getMe, getUpdates,
+# setWebhook/deleteWebhook, sendMessage, sendPhoto, sendMediaGroup,
+# answerCallbackQuery, ...) and delivers simulated updates either through
+# getUpdates long polling or by POSTing them to the registered webhook.
+# Everything the bot sends is put in a per-chat inbox that simulated users
+# wait on, so the time from update to reply can be measured.
+import asyncio
+import itertools
+import json
+import time
+from typing import Any, Dict, List, Optional
+
+from aiohttp import ClientError, ClientSession, web
+
+BOT_USER = {"id": 1000000001, "is_bot": True, "first_name": "Load test bot", "username": "loadtest_bot"}
+
+
+class FakeTelegram:
+    def __init__(self) -> None:
+        self.updates: List[Dict[str, Any]] = []
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._new_updates = asyncio.Event()
+        self.ready = asyncio.Event()
+        self.webhook_url: Optional[str] = None
+        self.webhook_secret = ""
+        self._session: Optional[ClientSession] = None
+        self.inboxes: Dict[int, "asyncio.Queue[Dict[str, Any]]"] = {}
+        self._callback_chats: Dict[str, int] = {}
+        self.calls: Dict[str, int] = {}
+        self.webhook_retries = 0
+
+    # -- simulated users' side ----------------------------------------------
+
+    def inbox(self, chat_id: int) -> "asyncio.Queue[Dict[str, Any]]":
+        queue = self.inboxes.get(chat_id)
+        if queue is None:
+            queue = self.inboxes[chat_id] = asyncio.Queue()
+        return queue
+
+    def _user(self, user_id: int) -> Dict[str, Any]:
+        return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+
+    def text_update(self, user_id: int, text: str) -> Dict[str, Any]:
+        return {
+            "message": {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": self._user(user_id),
+                "text": text,
+            }
+        }
+
+    def callback_update(self, user_id: int, data: str) -> Dict[str, Any]:
+        callback_id = f"cb{next(self._message_ids)}"
+        self._callback_chats[callback_id] = user_id
+        return {
+            "callback_query": {
+                "id": callback_id,
+                "from": self._user(user_id),
+                "chat_instance": str(user_id),
+                "data": data,
+                "message": {
+                    "message_id": next(self._message_ids),
+                    "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private"},
+                    "from": BOT_USER,
+                    "text": "…",
+                },
+            }
+        }
+
+    async def push(self, update: Dict[str, Any]) -> None:
+        update["update_id"] = next(self._update_ids)
+        if self.webhook_url is None:
+            self.updates.append(update)
+            self._new_updates.set()
+            return
+        # Like Telegram: redeliver until the bot answers 2xx.
+        headers = {"X-Telegram-Bot-Api-Secret-Token": self.webhook_secret}
+        for attempt in itertools.count():
+            try:
+                async with self._session.post(self.webhook_url, json=update, headers=headers) as response:
+                    if response.status < 300:
+                        return
+            except ClientError:
+                pass
+            self.webhook_retries += 1
+            await asyncio.sleep(min(1.0, 0.05 * 2**attempt))
+
+    # -- Bot API side --------------------------------------------------------
+
+    def _message(self, chat_id: Any, **fields: Any) -> Dict[str, Any]:
+        return dict(
+            message_id=next(self._message_ids),
+            date=int(time.time()),
+            chat={"id": int(chat_id), "type": "private"},
+            **fields,
+        )
+
+    def _deliver(self, chat_id: int, method: str, text: str) -> None:
+        self.inbox(chat_id).put_nowait({"method": method, "text": text, "at": time.perf_counter()})
+
+    async def _get_updates(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        timeout = float(params.get("timeout") or 0)
+        self.updates = [u for u in self.updates if u["update_id"] >= offset]
+        if not self.updates and timeout:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.updates[:limit]
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        if request.content_type == "application/json":
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+        self.calls[method] = self.calls.get(method, 0) + 1
+        name = method.lower()
+        result: Any = True
+        if name == "getme":
+            result = BOT_USER
+        elif name == "getupdates":
+            self.ready.set()
+            result = await self._get_updates(params)
+        elif name == "setwebhook":
+            self.webhook_url = params["url"]
+            self.webhook_secret = params.get("secret_token", "")
+            self.ready.set()
+        elif name == "deletewebhook":
+            self.webhook_url = None
+        elif name == "sendmessage":
+            chat_id = int(params["chat_id"])
+            self._deliver(chat_id, method, params.get("text", ""))
+            result = self._message(chat_id, text=params.get("text", ""))
+        elif name == "sendphoto":
+            chat_id = int(params["chat_id"])
+            self._deliver(chat_id, method, params.get("caption", ""))
+            result = self._message(
+                chat_id,
+                caption=params.get("caption", ""),
+                photo=[{"file_id": "p", "file_unique_id": "p", "width": 1, "height": 1}],
+            )
+        elif name == "sendmediagroup":
+            chat_id = int(params["chat_id"])
+            media = params["media"]
+            media = json.loads(media) if isinstance(media, str) else media
+            self._deliver(chat_id, method, "\n".join(item.get("caption", "") for item in media))
+            result = [
+                self._message(chat_id, photo=[{"file_id": "p", "file_unique_id": "p", "width": 1, "height": 1}])
+                for _ in media
+            ]
+        elif name == "answercallbackquery":
+            chat_id = self._callback_chats.pop(params.get("callback_query_id"), None)
+            if chat_id is not None:
+                self._deliver(chat_id, method, params.get("text", ""))
+        return web.json_response({"ok": True, "result": result})
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> web.AppRunner:
+        self._session = ClientSession()
+        app = web.Application(client_max_size=16 * 1024 * 1024)
+        app.router.add_route("*", "/bot{token}/{method}", self.handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, host, port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return runner
+
+    async def close(self, runner: web.AppRunner) -> None:
+        self._new_updates.set()
+        await runner.cleanup()
+        if self._session is not None:
+            await self._session.close()
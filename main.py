@@ -1,46 +1,114 @@
 import logging
 import os
 import asyncio
-from aiogram import Bot, Dispatcher, types
-from aiogram.filters import Command
+import time
+from aiogram import BaseMiddleware, Bot, Dispatcher, types
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiohttp import web
 
+from metrics import CallbackMetric, monitor_loop_lag, observe_handler, render
+from outbox import PRIORITY_ADMIN, PRIORITY_USER, OutboundLimiter
+from payments import PaymentInbox
+from reports import export_report, parse_export_args
+from routing import MessageRouter
+from sessions import create_session_backend
+from webhook import WebhookIngress, default_secret
+
 from database import (
     init_db,
+    close_db,
     list_products_by_category,
     get_product,
+    get_products,
+    search_products,
     get_order,
-    create_order,
-    add_order_item,
+    place_order,
     add_product,
     get_order_total,
     list_orders,
     get_order_items,
     update_order_status,
+    update_orders_status,
+    is_order_archived,
     list_all_products,
     update_product,
     delete_product,
     get_settings,
+    get_stats,
+    pending_commits,
+    store_files,
+    start_journal_compaction,
+    start_archiving,
     set_categories as update_categories_in_db,
     set_menu_rows as update_menu_rows_in_db,
 )
 
-BOT_TOKEN = "8204649083:AAFcQQS2VfP9AqUim1q-Ha-WwDA9mjt5tlY"
+BOT_TOKEN = os.getenv("BOT_TOKEN", "8204649083:AAFcQQS2VfP9AqUim1q-Ha-WwDA9mjt5tlY")
 ADMIN_ID = os.getenv("ADMIN_ID")
 ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD", "123login123")
 ALLOWED_STATUSES = {"pending", "processing", "paid", "shipped", "delivered", "cancelled"}
 WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook/payment")
 WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "")
+# Alternative Bot API server (e.g. a local Bot API server, or the fake one in
+# loadtest/), as a base URL such as http://127.0.0.1:8081.
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "")
+METRICS_PATH = os.getenv("METRICS_PATH", "/metrics")
+# If set, /metrics requires "Authorization: Bearer <METRICS_TOKEN>".
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+# "polling" (default) or "webhook": Telegram posts updates to
+# WEBHOOK_HOST + TELEGRAM_WEBHOOK_PATH on this app instead.
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+TELEGRAM_WEBHOOK_PATH = os.getenv("TELEGRAM_WEBHOOK_PATH", "/webhook/telegram")
+TELEGRAM_WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET") or default_secret(BOT_TOKEN)
+# With several instances behind a proxy only one of them needs to register the URL.
+TELEGRAM_SET_WEBHOOK = os.getenv("TELEGRAM_SET_WEBHOOK", "1") == "1"
+# Products per category page; Telegram albums hold at most 10 photos.
+CATEGORY_PAGE_SIZE = max(1, min(10, int(os.getenv("CATEGORY_PAGE_SIZE", "5"))))
+SEARCH_PAGE_SIZE = max(1, min(10, int(os.getenv("SEARCH_PAGE_SIZE", "5"))))
+
+if TELEGRAM_API_URL:
+    bot = Bot(BOT_TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)))
+else:
+    bot = Bot(BOT_TOKEN)
+# Per-user state (carts, checkout, admin logins and flows) lives in the session
+# backend: in-process by default, or SQLite shared by several bot processes
+# (SESSION_BACKEND=sqlite).
+SESSIONS = create_session_backend()
+dp = Dispatcher(storage=SESSIONS.fsm_storage())
+# Text messages are dispatched by ROUTER (hash/trie lookups) from a single
+# catch-all handler; see route_message below.
+ROUTER = MessageRouter(observe=observe_handler)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    # Times callback-query handlers; messages are timed by ROUTER per route.
+    async def __call__(self, handler, event, data):
+        target = data.get("handler")
+        name = target.callback.__name__ if target is not None else type(event).__name__
+        started = time.perf_counter()
+        failed = True
+        try:
+            result = await handler(event, data)
+            failed = False
+            return result
+        finally:
+            observe_handler(name, time.perf_counter() - started, failed)
+
+
+dp.callback_query.middleware(HandlerMetricsMiddleware())
+
 
-bot = Bot(BOT_TOKEN)
-dp = Dispatcher()
+def outbound_priority(chat_id):
+    # Replies to customers go out before notifications to the admin chat.
+    if ADMIN_ID and str(chat_id) == str(ADMIN_ID):
+        return PRIORITY_ADMIN
+    return PRIORITY_USER
 
 
-CARTS = {}
-CHECKOUT = {}
-LOGGED_ADMINS = set()
-PENDING_ADMIN_PASSWORD = set()
-ADMIN_PRODUCT_FLOW = {}
+OUTBOX = OutboundLimiter(priority_for=outbound_priority)
+bot.session.middleware(OUTBOX)
+
 
 DEFAULT_CATEGORIES = [
     "👗 Qizlar kiyimlari",
@@ -52,6 +120,7 @@ DEFAULT_CATEGORIES = [
 ]
 
 CATEGORIES = list(DEFAULT_CATEGORIES)
+CATEGORY_INDEX = {name: idx for idx, name in enumerate(CATEGORIES)}
 
 DEFAULT_MENU_ROWS = [
     ("👗 Qizlar kiyimlari", "🧥 O‘g‘il bolalar kiyimlari"),
@@ -90,14 +159,37 @@ def _normalize_menu_rows(rows):
     return normalized or [tuple(row) for row in DEFAULT_MENU_ROWS]
 
 
+# Bumped whenever categories or menu rows change; keyboards built from them
+# are cached per version (see cached_markup).
+SETTINGS_VERSION = 0
+MARKUP_CACHE = {}
+
+
 def apply_settings(settings):
-    global CATEGORIES, MENU_ROWS
+    global CATEGORIES, CATEGORY_INDEX, MENU_ROWS, SETTINGS_VERSION
     categories = settings.get("categories") if settings else None
     menu_rows = settings.get("menu_rows") if settings else None
-    if categories:
+    changed = False
+    if categories and categories != CATEGORIES:
         CATEGORIES = categories
+        CATEGORY_INDEX = {name: idx for idx, name in enumerate(CATEGORIES)}
+        ROUTER.set_group_texts("categories", CATEGORIES)
+        changed = True
     if menu_rows:
-        MENU_ROWS = _normalize_menu_rows(menu_rows)
+        rows = _normalize_menu_rows(menu_rows)
+        if rows != MENU_ROWS:
+            MENU_ROWS = rows
+            changed = True
+    if changed:
+        SETTINGS_VERSION += 1
+
+
+def cached_markup(name, build):
+    # Markups are immutable once sent, so handlers can share one instance.
+    entry = MARKUP_CACHE.get(name)
+    if entry is None or entry[0] != SETTINGS_VERSION:
+        entry = MARKUP_CACHE[name] = (SETTINGS_VERSION, build())
+    return entry[1]
 
 
 async def load_settings():
@@ -145,6 +237,10 @@ def build_product_step_prompt(flow):
 
 
 def build_category_keyboard():
+    return cached_markup("categories", _build_category_keyboard)
+
+
+def _build_category_keyboard():
     if not CATEGORIES:
         return None
     rows = []
@@ -169,6 +265,10 @@ async def send_product_step_prompt(msg: types.Message, flow: dict):
 
 
 def build_main_menu():
+    return cached_markup("main_menu", _build_main_menu)
+
+
+def _build_main_menu():
     keyboard = []
     for row in MENU_ROWS:
         keyboard.append([types.KeyboardButton(text=btn) for btn in row])
@@ -180,6 +280,10 @@ def build_main_menu():
 
 
 def build_admin_menu():
+    return cached_markup("admin_menu", _build_admin_menu)
+
+
+def _build_admin_menu():
     keyboard = []
     for row in ADMIN_MENU_ROWS:
         keyboard.append([types.KeyboardButton(text=btn) for btn in row])
@@ -190,10 +294,24 @@ def build_admin_menu():
     )
 
 
-def is_admin(user_id: int) -> bool:
+async def is_admin(user_id: int) -> bool:
     if ADMIN_ID and str(user_id) == str(ADMIN_ID):
         return True
-    return user_id in LOGGED_ADMINS
+    return await SESSIONS.contains("admins", user_id)
+
+
+async def sender_is_admin(m: types.Message) -> bool:
+    return await is_admin(m.from_user.id)
+
+
+async def awaiting_admin_password(m: types.Message) -> bool:
+    return await SESSIONS.contains("pending_admin_password", m.from_user.id)
+
+
+async def in_product_flow(m: types.Message) -> bool:
+    return await is_admin(m.from_user.id) and await SESSIONS.contains(
+        "admin_product_flow", m.from_user.id
+    )
 
 
 def admin_help_text():
@@ -203,6 +321,8 @@ def admin_help_text():
         "/orders — oxirgi 10 buyurtma ro‘yxati\n"
         "/order <id> — aniq buyurtmani ko‘rish\n"
         "/setstatus <id> <status> — statusni o‘zgartirish\n"
+        "/export [2024-01-01 [2024-12-31]] [status,...] [xlsx|csv] — savdo hisoboti fayli\n"
+        "/stats — savdo statistikasi\n"
         "/products — mahsulotlar ro‘yxati\n"
         "/product <id> — mahsulot tafsiloti\n"
         "/add_product — yangi mahsulot qo‘shish\n"
@@ -218,10 +338,10 @@ def admin_only_message():
     return "Bu buyruq faqat adminlar uchun. /login orqali parolni kiriting."
 
 
-def logout_admin(user_id: int):
-    LOGGED_ADMINS.discard(user_id)
-    PENDING_ADMIN_PASSWORD.discard(user_id)
-    ADMIN_PRODUCT_FLOW.pop(user_id, None)
+async def logout_admin(user_id: int):
+    await SESSIONS.delete("admins", user_id)
+    await SESSIONS.delete("pending_admin_password", user_id)
+    await SESSIONS.delete("admin_product_flow", user_id)
 
 
 def format_order_summary(order):
@@ -229,13 +349,51 @@ def format_order_summary(order):
     return f"#{order_id} | {fullname} | {phone} | {total} so'm | {status} | {created_ts.split('T')[0]}"
 
 
-async def send_recent_orders(msg: types.Message):
-    orders = await list_orders(limit=10)
+def build_page_nav(prefix, first_id, last_id, has_prev, has_next, prev_text, next_text):
+    # "<prefix>:p<id>" pages back from first_id, "<prefix>:n<id>" forward from last_id.
+    nav = []
+    if has_prev:
+        nav.append(types.InlineKeyboardButton(text=prev_text, callback_data=f"{prefix}:p{first_id}"))
+    if has_next:
+        nav.append(types.InlineKeyboardButton(text=next_text, callback_data=f"{prefix}:n{last_id}"))
+    return types.InlineKeyboardMarkup(inline_keyboard=[nav]) if nav else None
+
+
+def parse_page_cursor(data):
+    # "<prefix>:n<id>" / "<prefix>:p<id>" -> ("n" | "p", id)
+    cursor = data.split(":", 1)[1]
+    if not cursor or cursor[0] not in "np":
+        raise ValueError(data)
+    return cursor[0], int(cursor[1:])
+
+
+async def build_orders_page(limit: int = 10, newer_than=None, older_than=None):
+    # Orders are shown newest first; one extra row tells whether another page
+    # exists in the direction we are moving.
+    orders = await list_orders(limit=limit + 1, after_id=newer_than, before_id=older_than)
+    if newer_than is not None:
+        has_newer = len(orders) > limit
+        orders = orders[-limit:]
+        has_older = True
+    else:
+        has_older = len(orders) > limit
+        orders = orders[:limit]
+        has_newer = older_than is not None
     if not orders:
+        return None, None
+    text = "Oxirgi buyurtmalar:\n" + "\n".join(format_order_summary(o) for o in orders)
+    markup = build_page_nav(
+        "ord", orders[0][0], orders[-1][0], has_newer, has_older, "⬅️ Yangiroq", "Eskiroq ➡️"
+    )
+    return text, markup
+
+
+async def send_recent_orders(msg: types.Message):
+    text, markup = await build_orders_page()
+    if not text:
         await msg.answer("Hozircha buyurtmalar yo‘q.", reply_markup=build_admin_menu())
         return
-    text = "Oxirgi buyurtmalar:\n" + "\n".join(format_order_summary(o) for o in orders)
-    await msg.answer(text)
+    await msg.answer(text, reply_markup=markup)
 
 
 def format_product_summary(product):
@@ -243,35 +401,83 @@ def format_product_summary(product):
     return f"#{pid} | {name} | {category} | {price} so'm"
 
 
-async def send_product_list(msg: types.Message, limit: int = 20):
-    products = await list_all_products(limit=limit)
+async def build_product_list_page(limit: int = 20, after_id=None, before_id=None):
+    products = await list_all_products(limit=limit + 1, after_id=after_id, before_id=before_id)
+    if before_id is not None:
+        has_prev = len(products) > limit
+        products = products[-limit:]
+        has_next = True
+    else:
+        has_next = len(products) > limit
+        products = products[:limit]
+        has_prev = after_id is not None
     if not products:
-        await msg.answer("Mahsulotlar bazada topilmadi.", reply_markup=build_admin_menu())
-        return
+        return None, None
     lines = ["Mahsulotlar ro‘yxati:"]
     lines.extend(format_product_summary(p) for p in products)
     lines.append("Batafsil ma'lumot uchun /product <id> yuboring.")
-    await msg.answer("\n".join(lines), reply_markup=build_admin_menu())
+    markup = build_page_nav(
+        "prd", products[0][0], products[-1][0], has_prev, has_next, "⬅️ Oldingi", "Keyingi ➡️"
+    )
+    return "\n".join(lines), markup
+
 
+async def send_product_list(msg: types.Message, limit: int = 20):
+    text, markup = await build_product_list_page(limit=limit)
+    if not text:
+        await msg.answer("Mahsulotlar bazada topilmadi.", reply_markup=build_admin_menu())
+        return
+    await msg.answer(text, reply_markup=markup or build_admin_menu())
 
-def begin_product_flow(user_id: int, action: str, data=None, product_id=None):
+
+@dp.callback_query(lambda c: c.data and (c.data.startswith("ord:") or c.data.startswith("prd:")))
+async def admin_list_page(callback: types.CallbackQuery):
+    if not await is_admin(callback.from_user.id):
+        await callback.answer("Ruxsat berilmagan.", show_alert=True)
+        return
+    try:
+        direction, cursor_id = parse_page_cursor(callback.data)
+    except ValueError:
+        await callback.answer("Sahifa topilmadi.", show_alert=True)
+        return
+    if callback.data.startswith("ord:"):
+        # "p" (left button) goes to newer orders, "n" to older ones.
+        if direction == "p":
+            text, markup = await build_orders_page(newer_than=cursor_id)
+        else:
+            text, markup = await build_orders_page(older_than=cursor_id)
+    elif direction == "p":
+        text, markup = await build_product_list_page(before_id=cursor_id)
+    else:
+        text, markup = await build_product_list_page(after_id=cursor_id)
+    await callback.answer()
+    if not text:
+        await callback.message.answer("Bu sahifada ma'lumot yo‘q.")
+        return
+    await callback.message.edit_text(text, reply_markup=markup)
+
+
+async def begin_product_flow(user_id: int, action: str, data=None, product_id=None):
     flow = {
         "action": action,
         "step": PRODUCT_FLOW_STEPS[0],
         "data": data or {},
         "product_id": product_id,
     }
-    ADMIN_PRODUCT_FLOW[user_id] = flow
+    await SESSIONS.set("admin_product_flow", user_id, flow)
     return flow
 
 
-def cancel_product_flow(user_id: int):
-    ADMIN_PRODUCT_FLOW.pop(user_id, None)
+async def cancel_product_flow(user_id: int, flow=None):
+    # Marking the flow closed stops the caller from saving it back.
+    if flow is not None:
+        flow["closed"] = True
+    await SESSIONS.delete("admin_product_flow", user_id)
 
 
 async def start_add_product_flow(msg: types.Message):
     user = msg.from_user.id
-    flow = begin_product_flow(user, "add")
+    flow = await begin_product_flow(user, "add")
     await msg.answer("Mahsulot qo‘shish boshlandi.")
     await send_product_step_prompt(msg, flow)
 
@@ -285,30 +491,30 @@ async def start_edit_product_flow(msg: types.Message, product_id: int, product_t
         "desc": desc or "",
         "photo": photo or "",
     }
-    flow = begin_product_flow(msg.from_user.id, "edit", data=data, product_id=pid)
+    flow = await begin_product_flow(msg.from_user.id, "edit", data=data, product_id=pid)
     await msg.answer(f"Mahsulot #{pid} tahriri boshlandi.")
     await send_product_step_prompt(msg, flow)
 
 
-@dp.message(Command("login"))
+@ROUTER.command("login")
 async def admin_login(msg: types.Message):
     user = msg.from_user.id
-    if is_admin(user):
+    if await is_admin(user):
         return await msg.answer(
             "Allaqachon admin paneldasiz.\n" + admin_help_text(),
             reply_markup=build_admin_menu(),
         )
-    PENDING_ADMIN_PASSWORD.add(user)
+    await SESSIONS.set("pending_admin_password", user, True)
     await msg.answer("Admin parolini yuboring.")
 
 
-@dp.message(lambda m: m.from_user.id in PENDING_ADMIN_PASSWORD)
+@ROUTER.predicate(awaiting_admin_password)
 async def handle_admin_password(msg: types.Message):
     user = msg.from_user.id
     password = msg.text.strip() if msg.text else ""
-    PENDING_ADMIN_PASSWORD.discard(user)
+    await SESSIONS.delete("pending_admin_password", user)
     if password == ADMIN_PASSWORD:
-        LOGGED_ADMINS.add(user)
+        await SESSIONS.set("admins", user, True)
         await msg.answer(
             "✅ Admin paneliga muvaffaqiyatli kirdingiz.\n" + admin_help_text(),
             reply_markup=build_admin_menu(),
@@ -317,67 +523,67 @@ async def handle_admin_password(msg: types.Message):
         await msg.answer("❌ Parol noto‘g‘ri. /login orqali qayta urinib ko‘ring.")
 
 
-@dp.message(Command("logout"))
+@ROUTER.command("logout")
 async def admin_logout(msg: types.Message):
     user = msg.from_user.id
-    if not is_admin(user):
+    if not await is_admin(user):
         return await msg.answer("Siz admin rejimida emassiz.")
-    logout_admin(user)
+    await logout_admin(user)
     await msg.answer("Admin rejimdan chiqdingiz.", reply_markup=build_main_menu())
 
 
-@dp.message(Command("admin"))
+@ROUTER.command("admin")
 async def admin_panel(msg: types.Message):
     user = msg.from_user.id
-    if not is_admin(user):
+    if not await is_admin(user):
         return await msg.answer(admin_only_message())
     await msg.answer("Admin paneli:\n" + admin_help_text(), reply_markup=build_admin_menu())
 
 
-@dp.message(lambda m: is_admin(m.from_user.id) and m.text == "📋 Oxirgi buyurtmalar")
+@ROUTER.text("📋 Oxirgi buyurtmalar", guard=sender_is_admin)
 async def admin_recent_orders_button(msg: types.Message):
     await send_recent_orders(msg)
 
 
-@dp.message(lambda m: is_admin(m.from_user.id) and m.text == "🔍 Buyurtmani ko‘rish")
+@ROUTER.text("🔍 Buyurtmani ko‘rish", guard=sender_is_admin)
 async def admin_view_prompt(msg: types.Message):
     await msg.answer("Buyurtma raqamini /order <id> ko‘rinishida yuboring.")
 
 
-@dp.message(lambda m: is_admin(m.from_user.id) and m.text == "⚙️ Statusni o‘zgartirish")
+@ROUTER.text("⚙️ Statusni o‘zgartirish", guard=sender_is_admin)
 async def admin_status_prompt(msg: types.Message):
     await msg.answer(
         "Statusni o‘zgartirish uchun /setstatus <id> <status> yuboring.\n" + admin_help_text()
     )
 
 
-@dp.message(lambda m: is_admin(m.from_user.id) and m.text == "🚪 Admin chiqish")
+@ROUTER.text("🚪 Admin chiqish", guard=sender_is_admin)
 async def admin_logout_button(msg: types.Message):
-    logout_admin(msg.from_user.id)
+    await logout_admin(msg.from_user.id)
     await msg.answer("Admin rejimdan chiqdingiz.", reply_markup=build_main_menu())
 
 
-@dp.message(lambda m: is_admin(m.from_user.id) and m.text == "🗂 Mahsulotlar")
+@ROUTER.text("🗂 Mahsulotlar", guard=sender_is_admin)
 async def admin_products_button(msg: types.Message):
     await send_product_list(msg)
 
 
-@dp.message(lambda m: is_admin(m.from_user.id) and m.text == "➕ Mahsulot qo‘shish")
+@ROUTER.text("➕ Mahsulot qo‘shish", guard=sender_is_admin)
 async def admin_add_product_button(msg: types.Message):
     await start_add_product_flow(msg)
 
 
-@dp.message(lambda m: is_admin(m.from_user.id) and m.text == "✏️ Mahsulotni tahrirlash")
+@ROUTER.text("✏️ Mahsulotni tahrirlash", guard=sender_is_admin)
 async def admin_edit_product_button(msg: types.Message):
     await msg.answer("Foydalanish: /edit_product <id>")
 
 
-@dp.message(lambda m: is_admin(m.from_user.id) and m.text == "➖ Mahsulotni o‘chirish")
+@ROUTER.text("➖ Mahsulotni o‘chirish", guard=sender_is_admin)
 async def admin_delete_product_button(msg: types.Message):
     await msg.answer("Foydalanish: /delete_product <id>")
 
 
-@dp.message(lambda m: is_admin(m.from_user.id) and m.text == "🧾 Menyuni sozlash")
+@ROUTER.text("🧾 Menyuni sozlash", guard=sender_is_admin)
 async def admin_menu_settings_button(msg: types.Message):
     await msg.answer(
         "Menyuni yangilash uchun buyruqlar:\n"
@@ -388,16 +594,16 @@ async def admin_menu_settings_button(msg: types.Message):
     )
 
 
-@dp.message(Command("orders"))
+@ROUTER.command("orders")
 async def admin_recent_orders_command(msg: types.Message):
-    if not is_admin(msg.from_user.id):
+    if not await is_admin(msg.from_user.id):
         return await msg.answer(admin_only_message())
     await send_recent_orders(msg)
 
 
-@dp.message(Command("order"))
+@ROUTER.command("order")
 async def admin_order_detail(msg: types.Message):
-    if not is_admin(msg.from_user.id):
+    if not await is_admin(msg.from_user.id):
         return await msg.answer(admin_only_message())
     parts = msg.text.split()
     if len(parts) < 2:
@@ -424,16 +630,90 @@ async def admin_order_detail(msg: types.Message):
     if not items:
         lines.append("- Mahsulotlar topilmadi.")
     else:
+        products = await get_products([product_id for _, _, product_id, _, _ in items])
         for _, _, product_id, qty, price in items:
-            product = await get_product(product_id)
+            product = products.get(product_id)
             name = product[1] if product else f"Mahsulot #{product_id}"
             lines.append(f"- {name} x{qty} — {price * qty} so'm")
     await msg.answer("\n".join(lines))
 
 
-@dp.message(Command("setstatus"))
+def sales_summary(day_totals):
+    # (orders, revenue) over the given days' {status: (orders, revenue)},
+    # cancelled orders left out.
+    orders = revenue = 0
+    for statuses in day_totals:
+        for status, (count, amount) in statuses.items():
+            if status != "cancelled":
+                orders += count
+                revenue += amount
+    return orders, revenue
+
+
+@ROUTER.command("stats")
+async def admin_stats_command(msg: types.Message):
+    if not await is_admin(msg.from_user.id):
+        return await msg.answer(admin_only_message())
+    stats = await get_stats(days=30, top=5)
+    days = [statuses for _, statuses in stats["days"]]
+    lines = [f"📊 Savdo statistikasi ({stats['today']})", ""]
+    for label, window in (("Bugun", days[:1]), ("Kecha", days[1:2]), ("7 kun", days[:7]), ("30 kun", days)):
+        orders, revenue = sales_summary(window)
+        lines.append(f"{label}: {orders} ta buyurtma, {revenue} so'm")
+    lines.append("\nStatuslar bo‘yicha (hammasi):")
+    for status in sorted(ALLOWED_STATUSES):
+        orders, revenue = stats["statuses"].get(status, (0, 0))
+        if orders:
+            lines.append(f"- {status}: {orders} ta, {revenue} so'm")
+    if stats["categories"]:
+        lines.append("\nKategoriyalar:")
+        for category, qty, revenue in stats["categories"]:
+            lines.append(f"- {category or 'Boshqa'}: {qty} dona, {revenue} so'm")
+    if stats["top_products"]:
+        lines.append("\nEng ko‘p sotilgan mahsulotlar:")
+        for place, (pid, name, _, qty, revenue) in enumerate(stats["top_products"], 1):
+            lines.append(f"{place}. {name or f'Mahsulot #{pid}'} — {qty} dona, {revenue} so'm")
+    await msg.answer("\n".join(lines))
+
+
+# One export at a time; each already runs page by page in the background.
+EXPORT_LOCK = asyncio.Lock()
+# Bot API upload limit for documents.
+MAX_DOCUMENT_BYTES = 50 * 1024 * 1024
+
+
+@ROUTER.command("export")
+async def admin_export_command(msg: types.Message):
+    if not await is_admin(msg.from_user.id):
+        return await msg.answer(admin_only_message())
+    try:
+        options = parse_export_args(msg.text, ALLOWED_STATUSES)
+    except ValueError as exc:
+        return await msg.answer(f"{exc}\nFoydalanish: /export [2024-01-01 [2024-12-31]] [status,...] [xlsx|csv]")
+    if EXPORT_LOCK.locked():
+        return await msg.answer("Hisobot tayyorlanmoqda, biroz kuting.")
+    async with EXPORT_LOCK:
+        await msg.answer("⏳ Hisobot tayyorlanmoqda...")
+        report = await export_report(
+            options["format"], since=options["since"], until=options["until"], statuses=options["statuses"]
+        )
+        try:
+            if not report["orders"]:
+                return await msg.answer("Tanlangan davr va statuslar bo‘yicha buyurtma topilmadi.")
+            if os.path.getsize(report["path"]) > MAX_DOCUMENT_BYTES:
+                return await msg.answer("Hisobot 50 MB dan katta. Davrni qisqartiring.")
+            period = options["period"] or "barcha vaqt"
+            await msg.answer_document(
+                types.FSInputFile(report["path"], filename=f"hisobot.{options['format']}"),
+                caption=f"📊 Hisobot ({period}): {report['orders']} ta buyurtma, {report['rows']} ta qator",
+            )
+        finally:
+            os.remove(report["path"])
+
+
+@ROUTER.command("setstatus")
 async def admin_set_status(msg: types.Message):
-    if not is_admin(msg.from_user.id):
+    if not await is_admin(msg.from_user.id):
         return await msg.answer(admin_only_message())
     parts = msg.text.split()
     if len(parts) < 3:
@@ -445,22 +725,23 @@ async def admin_set_status(msg: types.Message):
     status = parts[2].lower()
     if status not in ALLOWED_STATUSES:
         return await msg.answer("Yaroqsiz status. " + admin_help_text())
-    updated = await update_order_status(order_id, status)
-    if not updated:
+    if not await update_order_status(order_id, status):
+        if await is_order_archived(order_id):
+            return await msg.answer(f"Buyurtma #{order_id} arxivda, statusini o‘zgartirib bo‘lmaydi.")
         return await msg.answer("Buyurtma topilmadi.")
     await msg.answer(f"Buyurtma #{order_id} statusi '{status}' ga o‘zgartirildi.")
 
 
-@dp.message(Command("products"))
+@ROUTER.command("products")
 async def admin_products_command(msg: types.Message):
-    if not is_admin(msg.from_user.id):
+    if not await is_admin(msg.from_user.id):
         return await msg.answer(admin_only_message())
     await send_product_list(msg)
 
 
-@dp.message(Command("product"))
+@ROUTER.command("product")
 async def admin_product_detail_command(msg: types.Message):
-    if not is_admin(msg.from_user.id):
+    if not await is_admin(msg.from_user.id):
         return await msg.answer(admin_only_message())
     parts = msg.text.split()
     if len(parts) < 2:
@@ -488,16 +769,16 @@ async def admin_product_detail_command(msg: types.Message):
     await msg.answer(caption)
 
 
-@dp.message(Command("add_product"))
+@ROUTER.command("add_product")
 async def admin_add_product_command(msg: types.Message):
-    if not is_admin(msg.from_user.id):
+    if not await is_admin(msg.from_user.id):
         return await msg.answer(admin_only_message())
     await start_add_product_flow(msg)
 
 
-@dp.message(Command("edit_product"))
+@ROUTER.command("edit_product")
 async def admin_edit_product_command(msg: types.Message):
-    if not is_admin(msg.from_user.id):
+    if not await is_admin(msg.from_user.id):
         return await msg.answer(admin_only_message())
     parts = msg.text.split()
     if len(parts) < 2:
@@ -512,9 +793,9 @@ async def admin_edit_product_command(msg: types.Message):
     await start_edit_product_flow(msg, product_id, product)
 
 
-@dp.message(Command("delete_product"))
+@ROUTER.command("delete_product")
 async def admin_delete_product_command(msg: types.Message):
-    if not is_admin(msg.from_user.id):
+    if not await is_admin(msg.from_user.id):
         return await msg.answer(admin_only_message())
     parts = msg.text.split()
     if len(parts) < 2:
@@ -529,9 +810,9 @@ async def admin_delete_product_command(msg: types.Message):
     await msg.answer(f"Mahsulot #{product_id} o‘chirildi.")
 
 
-@dp.message(Command("set_categories"))
+@ROUTER.command("set_categories")
 async def admin_set_categories(msg: types.Message):
-    if not is_admin(msg.from_user.id):
+    if not await is_admin(msg.from_user.id):
         return await msg.answer(admin_only_message())
     parts = msg.text.split(maxsplit=1)
     if len(parts) < 2:
@@ -544,9 +825,9 @@ async def admin_set_categories(msg: types.Message):
     await msg.answer("Kategoriyalar yangilandi.", reply_markup=build_main_menu())
 
 
-@dp.message(Command("set_menu"))
+@ROUTER.command("set_menu")
 async def admin_set_menu(msg: types.Message):
-    if not is_admin(msg.from_user.id):
+    if not await is_admin(msg.from_user.id):
         return await msg.answer(admin_only_message())
     parts = msg.text.split(maxsplit=1)
     if len(parts) < 2:
@@ -601,18 +882,27 @@ async def finalize_product_flow(msg: types.Message, flow: dict):
             await msg.answer(f"✏️ Mahsulot #{pid} yangilandi.")
         else:
             await msg.answer("Mahsulotni yangilashda xatolik yuz berdi.")
-    cancel_product_flow(user)
+    await cancel_product_flow(user, flow)
 
 
-@dp.message(lambda m: is_admin(m.from_user.id) and m.from_user.id in ADMIN_PRODUCT_FLOW)
+@ROUTER.predicate(in_product_flow)
 async def admin_product_flow_handler(msg: types.Message):
     user = msg.from_user.id
-    flow = ADMIN_PRODUCT_FLOW[user]
+    flow = await SESSIONS.get("admin_product_flow", user)
+    if not flow:
+        return
+    await advance_product_flow(msg, flow)
+    if not flow.get("closed"):
+        await SESSIONS.set("admin_product_flow", user, flow)
+
+
+async def advance_product_flow(msg: types.Message, flow: dict):
+    user = msg.from_user.id
     step = flow["step"]
     editing = flow["action"] == "edit"
     text = (msg.text or "").strip() if msg.text else ""
     if text.lower() == "/cancel":
-        cancel_product_flow(user)
+        await cancel_product_flow(user, flow)
         await msg.answer("Jarayon bekor qilindi.")
         return
     skip = editing and text and text.lower() in SKIP_WORDS
@@ -682,16 +972,16 @@ async def admin_product_flow_handler(msg: types.Message):
 @dp.callback_query(lambda c: c.data and (c.data == "cat_cancel" or c.data.startswith("cat:")))
 async def admin_category_select(callback: types.CallbackQuery):
     user = callback.from_user.id
-    if not is_admin(user):
+    if not await is_admin(user):
         await callback.answer("Ruxsat berilmagan.", show_alert=True)
         return
-    flow = ADMIN_PRODUCT_FLOW.get(user)
+    flow = await SESSIONS.get("admin_product_flow", user)
     if not flow or flow["step"] != "category":
         await callback.answer("Faol jarayon topilmadi.", show_alert=True)
         return
     data = flow["data"]
     if callback.data == "cat_cancel":
-        cancel_product_flow(user)
+        await cancel_product_flow(user, flow)
         await callback.message.answer("Jarayon bekor qilindi.")
         await callback.answer("Bekor qilindi.")
         return
@@ -703,21 +993,23 @@ async def admin_category_select(callback: types.CallbackQuery):
         return
     data["category"] = category
     flow["step"] = "price"
+    await SESSIONS.set("admin_product_flow", user, flow)
     await callback.answer(f"{category} tanlandi.")
     await send_product_step_prompt(callback.message, flow)
 
-@dp.message(Command("start"))
-@dp.message(Command("menu"))
+@ROUTER.command("start")
+@ROUTER.command("menu")
 async def start(msg: types.Message):
     kb = build_main_menu()
     await msg.answer(
         "👶 Bolalar buyumlari do‘koniga xush kelibsiz!\n"
-        "Kiyim-kechak, o‘yinchoqlar va aksessuarlarni tanlash uchun menyudan kerakli bo‘limni bosing.",
+        "Kiyim-kechak, o‘yinchoqlar va aksessuarlarni tanlash uchun menyudan kerakli bo‘limni bosing.\n"
+        "Mahsulotni nomi bo‘yicha qidirish: /search ko‘ylak",
         reply_markup=kb
     )
 
 
-@dp.message(lambda m: m.text == "ℹ️ Ma'lumot")
+@ROUTER.text("ℹ️ Ma'lumot")
 async def info_message(msg: types.Message):
     await msg.answer(
         "Bolalar butiki 0-12 yoshgacha bo‘lgan bolalar uchun kiyim-kechak, poyabzal, aksessuar va o‘yinchoqlarni taqdim etadi.\n"
@@ -725,7 +1017,7 @@ async def info_message(msg: types.Message):
     )
 
 
-@dp.message(lambda m: m.text == "📞 Aloqa")
+@ROUTER.text("📞 Aloqa")
 async def contact_message(msg: types.Message):
     await msg.answer(
         "📞 Aloqa markazi: +998 90 123 45 67\n"
@@ -733,43 +1025,193 @@ async def contact_message(msg: types.Message):
         "✉️ Telegram: @KidsShopSupport"
     )
 
-# show category
-@dp.message(lambda m: m.text in CATEGORIES)
-async def show_category(msg: types.Message):
-    cat = msg.text
-    products = await list_products_by_category(cat)
+def format_product_card(product):
+    pid, name, price, desc, _ = product
+    return f"🛒 {name}\n💵 Narx: {price} so'm\n{desc}\n\n/t{pid} — Savatchaga qo'shish"
+
+
+def build_category_page_keyboard(cat_idx, products, has_prev, has_next):
+    rows = [
+        [types.InlineKeyboardButton(text=f"🛒 {name} — {price} so'm", callback_data=f"add:{pid}")]
+        for pid, name, price, _, _ in products
+    ]
+    # Cursors are product ids: "pg:<category>:n<id>" is the page after id,
+    # "pg:<category>:p<id>" the page before it.
+    nav = []
+    if has_prev:
+        nav.append(
+            types.InlineKeyboardButton(text="⬅️ Oldingi", callback_data=f"pg:{cat_idx}:p{products[0][0]}")
+        )
+    if has_next:
+        nav.append(
+            types.InlineKeyboardButton(text="Keyingi ➡️", callback_data=f"pg:{cat_idx}:n{products[-1][0]}")
+        )
+    if nav:
+        rows.append(nav)
+    return types.InlineKeyboardMarkup(inline_keyboard=rows)
+
+
+async def send_category_page(msg: types.Message, cat_idx: int, after_id=None, before_id=None):
+    category = CATEGORIES[cat_idx]
+    # One extra row tells whether another page exists in that direction.
+    products = await list_products_by_category(
+        category, after_id=after_id, before_id=before_id, limit=CATEGORY_PAGE_SIZE + 1
+    )
+    if before_id is not None:
+        has_prev = len(products) > CATEGORY_PAGE_SIZE
+        products = products[-CATEGORY_PAGE_SIZE:]
+        has_next = True
+    else:
+        has_next = len(products) > CATEGORY_PAGE_SIZE
+        products = products[:CATEGORY_PAGE_SIZE]
+        has_prev = after_id is not None
     if not products:
         await msg.answer("Bu bo‘limda mahsulot yo‘q.")
         return
-    for p in products:
-        pid, name, price, desc, photo = p
-        caption = f"🛒 {name}\n💵 Narx: {price} so'm\n{desc}\n\n/t{pid} — Savatchaga qo'shish"
-        # If photo is file_id
+    keyboard = build_category_page_keyboard(cat_idx, products, has_prev, has_next)
+    if len(products) == 1:
+        product = products[0]
+        caption = format_product_card(product)
+        if product[4]:
+            try:
+                await msg.answer_photo(product[4], caption=caption, reply_markup=keyboard)
+                return
+            except Exception:
+                pass
+        await msg.answer(caption, reply_markup=keyboard)
+        return
+    # A page is one album plus one text card carrying the buttons, however
+    # many products the category has.
+    media = [
+        types.InputMediaPhoto(media=photo, caption=f"{name}\n💵 {price} so'm"[:1024])
+        for _, name, price, _, photo in products
+        if photo
+    ]
+    if len(media) >= 2:
         try:
-            await msg.answer_photo(photo, caption=caption)
+            await msg.answer_media_group(media)
         except Exception:
-            await msg.answer(caption)
+            pass
+    lines = [f"{category}:"]
+    for pid, name, price, desc, _ in products:
+        desc = desc or ""
+        short_desc = desc if len(desc) <= 120 else desc[:117] + "..."
+        lines.append(f"\n🛒 {name}\n💵 Narx: {price} so'm\n{short_desc}\n/t{pid} — Savatchaga qo'shish")
+    await msg.answer("\n".join(lines), reply_markup=keyboard)
+
+
+# show category
+@ROUTER.text_group("categories", CATEGORIES)
+async def show_category(msg: types.Message):
+    await send_category_page(msg, CATEGORY_INDEX[msg.text])
+
+
+@dp.callback_query(lambda c: c.data and c.data.startswith("pg:"))
+async def category_page(callback: types.CallbackQuery):
+    try:
+        _, cat_idx, cursor = callback.data.split(":", 2)
+        cat_idx = int(cat_idx)
+        cursor_id = int(cursor[1:])
+        if cat_idx >= len(CATEGORIES) or cursor[0] not in "np":
+            raise ValueError
+    except (ValueError, IndexError):
+        await callback.answer("Sahifa topilmadi.", show_alert=True)
+        return
+    await callback.answer()
+    if cursor[0] == "n":
+        await send_category_page(callback.message, cat_idx, after_id=cursor_id)
+    else:
+        await send_category_page(callback.message, cat_idx, before_id=cursor_id)
+
+
+@dp.callback_query(lambda c: c.data and c.data.startswith("add:"))
+async def add_to_cart_button(callback: types.CallbackQuery):
+    try:
+        pid = int(callback.data.split(":", 1)[1])
+    except ValueError:
+        await callback.answer("Mahsulot topilmadi.", show_alert=True)
+        return
+    await SESSIONS.cart_add(callback.from_user.id, pid)
+    await callback.answer("✅ Savatchaga qo‘shildi. /cart orqali ko‘ring.")
+
+def build_search_page_keyboard(products, offset, total):
+    rows = [
+        [types.InlineKeyboardButton(text=f"🛒 {name} — {price} so'm", callback_data=f"add:{pid}")]
+        for pid, name, price, _, _ in products
+    ]
+    # "srch:<offset>" opens the page starting at that result.
+    nav = []
+    if offset > 0:
+        nav.append(
+            types.InlineKeyboardButton(
+                text="⬅️ Oldingi", callback_data=f"srch:{max(0, offset - SEARCH_PAGE_SIZE)}"
+            )
+        )
+    if offset + len(products) < total:
+        nav.append(
+            types.InlineKeyboardButton(text="Keyingi ➡️", callback_data=f"srch:{offset + len(products)}")
+        )
+    if nav:
+        rows.append(nav)
+    return types.InlineKeyboardMarkup(inline_keyboard=rows)
+
+
+async def send_search_page(msg: types.Message, query: str, offset: int = 0):
+    products, total = await search_products(query, limit=SEARCH_PAGE_SIZE, offset=offset)
+    if not products:
+        await msg.answer(f"«{query}» bo‘yicha hech narsa topilmadi.")
+        return
+    lines = [f"🔎 «{query}» — {total} ta mahsulot ({offset + 1}-{offset + len(products)}):"]
+    for pid, name, price, desc, _ in products:
+        desc = desc or ""
+        short_desc = desc if len(desc) <= 120 else desc[:117] + "..."
+        lines.append(f"\n🛒 {name}\n💵 Narx: {price} so'm\n{short_desc}\n/t{pid} — Savatchaga qo'shish")
+    await msg.answer("\n".join(lines), reply_markup=build_search_page_keyboard(products, offset, total))
+
+
+@ROUTER.command("search")
+async def search_command(msg: types.Message):
+    query = msg.text.partition(" ")[2].strip()[:100]
+    if not query:
+        await msg.answer("Qidirish uchun so‘z yozing, masalan: /search ko‘ylak")
+        return
+    await SESSIONS.set("search", msg.from_user.id, query)
+    await send_search_page(msg, query)
+
+
+@dp.callback_query(lambda c: c.data and c.data.startswith("srch:"))
+async def search_page(callback: types.CallbackQuery):
+    query = await SESSIONS.get("search", callback.from_user.id)
+    try:
+        offset = max(0, int(callback.data.split(":", 1)[1]))
+    except ValueError:
+        offset = None
+    if not query or offset is None:
+        await callback.answer("Qidiruv eskirgan. /search orqali qayta qidiring.", show_alert=True)
+        return
+    await callback.answer()
+    await send_search_page(callback.message, query, offset)
 
 # add to cart via /t{product_id}
-@dp.message(lambda m: m.text and m.text.startswith("/t"))
+@ROUTER.prefix("/t")
 async def add_to_cart(msg: types.Message):
     user = msg.from_user.id
     pid = int(msg.text[2:])
-    CARTS.setdefault(user, {})
-    CARTS[user][pid] = CARTS[user].get(pid, 0) + 1
+    await SESSIONS.cart_add(user, pid)
     await msg.answer("✅ Mahsulot savatchaga qo‘shildi. /cart orqali savatchani ko‘ring.")
 
 # view cart
-@dp.message(Command("cart"))
+@ROUTER.command("cart")
 async def view_cart(msg: types.Message):
     user = msg.from_user.id
-    cart = CARTS.get(user, {})
+    cart = await SESSIONS.cart_get(user)
     if not cart:
         return await msg.answer("Savatcha bo‘sh.")
     lines = []
     total = 0
+    products = await get_products(list(cart))
     for pid, qty in cart.items():
-        pr = await get_product(pid)
+        pr = products.get(pid)
         if not pr: continue
         _, name, _, price, _, _ = pr
         subtotal = price * qty
@@ -778,39 +1220,43 @@ async def view_cart(msg: types.Message):
     lines.append(f"\nJami: {total} so'm\n/checkout — To‘lovga o‘tish")
     await msg.answer("\n".join(lines))
 
-@dp.message(lambda m: m.text and m.text.startswith("/remove_"))
+@ROUTER.prefix("/remove_")
 async def remove_item(msg: types.Message):
     user = msg.from_user.id
     pid = int(msg.text.split("_",1)[1])
-    cart = CARTS.get(user, {})
-    if pid in cart:
-        del cart[pid]
+    if await SESSIONS.cart_remove(user, pid):
         await msg.answer("Mahsulot o‘chirildi.")
     else:
         await msg.answer("Bu mahsulot savatchada yo‘q.")
 
 # checkout
-@dp.message(Command("checkout"))
+@ROUTER.command("checkout")
 async def checkout(msg: types.Message):
     user = msg.from_user.id
-    cart = CARTS.get(user, {})
+    cart = await SESSIONS.cart_get(user)
     if not cart:
         return await msg.answer("Savatcha bo‘sh.")
     total = 0
     items = []
+    products = await get_products(list(cart))
     for pid, qty in cart.items():
-        pr = await get_product(pid)
+        pr = products.get(pid)
         if not pr: continue
         _, name, _, price, _, _ = pr
         total += price * qty
         items.append((pid, qty, name, price))
-    CHECKOUT[user] = {"items": items, "total": total}
+    await SESSIONS.set("checkout", user, {"items": items, "total": total})
     await msg.answer(f"Buyurtma jami: {total} so'm\nIsm, manzil va telefoningizni quyidagi formatda yuboring:\nMasalan:\nAli — Toshkent, Shayxontohur — +998901234567")
 
-@dp.message(lambda m: m.text and "—" in m.text and "+" in m.text)  # simple parser
+async def looks_like_address(m: types.Message) -> bool:
+    # simple parser
+    return bool(m.text) and "—" in m.text and "+" in m.text
+
+
+@ROUTER.predicate(looks_like_address)
 async def receive_address(msg: types.Message):
     user = msg.from_user.id
-    info = CHECKOUT.get(user)
+    info = await SESSIONS.get("checkout", user)
     if not info:
         return
     # Very simple parse: assume "Name — Address — Phone"
@@ -822,13 +1268,17 @@ async def receive_address(msg: types.Message):
     except Exception:
         return await msg.answer("Format xato. Iltimos: Ism — Manzil — +998... tarzida yuboring.")
     total = info["total"]
-    # create order in DB
-    order_id = await create_order(user, fullname, address, phone, total)
-    for pid, qty, name, price in info["items"]:
-        await add_order_item(order_id, pid, qty, price)
+    # create order and its items in DB in one write
+    order_id = await place_order(
+        user,
+        fullname,
+        address,
+        phone,
+        [(pid, qty, price) for pid, qty, name, price in info["items"]],
+    )
     # Clear cart and checkout data after saving to DB
-    CARTS.pop(user, None)
-    CHECKOUT.pop(user, None)
+    await SESSIONS.cart_clear(user)
+    await SESSIONS.delete("checkout", user)
     # Prepare payment options
     text = (f"Buyurtma qabul qilindi — #{order_id}\nJami: {total} so'm\n"
             "To‘lovni tanlang:\n1) Payme/Click onlayn (bank kartasi)\n2) USDT (TRC20)\n\n"
@@ -859,7 +1309,7 @@ def create_payment_details_usdt(order_id, amount):
     return wallet, usdt_amount
 
 # payment commands
-@dp.message(lambda m: m.text and m.text.startswith("/pay_payme_"))
+@ROUTER.prefix("/pay_payme_")
 async def pay_payme(msg: types.Message):
     order_id = int(msg.text.split("_")[-1])
     total = await get_order_total(order_id)
@@ -868,7 +1318,7 @@ async def pay_payme(msg: types.Message):
     link = create_payment_link_payme(order_id, total)
     await msg.answer(f"To‘lov sahifasiga o‘ting: {link}")
 
-@dp.message(lambda m: m.text and m.text.startswith("/pay_click_"))
+@ROUTER.prefix("/pay_click_")
 async def pay_click(msg: types.Message):
     order_id = int(msg.text.split("_")[-1])
     total = await get_order_total(order_id)
@@ -877,7 +1327,7 @@ async def pay_click(msg: types.Message):
     link = create_payment_link_click(order_id, total)
     await msg.answer(f"To‘lov sahifasiga o‘ting: {link}")
 
-@dp.message(lambda m: m.text and m.text.startswith("/pay_usdt_"))
+@ROUTER.prefix("/pay_usdt_")
 async def pay_usdt(msg: types.Message):
     order_id = int(msg.text.split("_")[-1])
     total = await get_order_total(order_id)
@@ -887,26 +1337,142 @@ async def pay_usdt(msg: types.Message):
     await msg.answer(f"USDT (TRC20) yuboring:\nWallet: `{wallet}`\nSumma: {usdt_amount} USDT\n"
                      "To‘lov qilinganidan so‘ng to‘lov txidini yuboring.")
 
-# Webhook endpoint for payment callbacks (aiohttp)
-async def handle_payment_callback(request):
-    data = await request.json()
-    # Bu yerda Payme yoki Clickning callback formatini tekshirish va tasdiqlash kerak
-    # Agar to'lov muvaffaqiyatli bo'lsa, order_id ni topib orders.status ni 'paid' ga o'zgartiring va adminga yuboring
-    # MISOL:
-    order_id = data.get("order")
-    paid = data.get("paid", False)
-    if paid:
-        # update order status in DB (yozib qo'ying)
-        if ADMIN_ID:
-            await bot.send_message(int(ADMIN_ID), f"Buyurtma #{order_id} to‘landi.")
-    return web.json_response({"ok": True})
+@dp.message()
+async def route_message(msg: types.Message):
+    await ROUTER.dispatch(msg, msg.text)
+
+# Payment callbacks (aiohttp): signed with PAYMENT_SECRET (see payments.py),
+# recorded in a durable inbox and acknowledged at once; a background worker
+# marks orders paid in batches and tells the admin. Only pending or
+# processing orders become paid: a late callback must not revive a
+# cancelled order or roll a shipped one back, and only the orders that
+# actually changed are announced.
+PAYABLE_STATUSES = ["pending", "processing"]
+
+
+async def mark_orders_paid(order_ids):
+    return await update_orders_status(order_ids, "paid", from_statuses=PAYABLE_STATUSES)
+
+
+async def notify_orders_paid(order_ids):
+    if not ADMIN_ID:
+        return
+    if len(order_ids) == 1:
+        text = f"Buyurtma #{order_ids[0]} to‘landi."
+    else:
+        text = "Buyurtmalar to‘landi: " + ", ".join(f"#{oid}" for oid in order_ids)
+    await bot.send_message(int(ADMIN_ID), text)
+
+
+PAYMENTS = PaymentInbox(mark_orders_paid, notify_orders_paid)
 
 app = web.Application()
-app.router.add_post(WEBHOOK_PATH, handle_payment_callback)
+app.router.add_post(WEBHOOK_PATH, PAYMENTS.handle)
+
+TELEGRAM_WEBHOOK = WebhookIngress(dp, bot, TELEGRAM_WEBHOOK_SECRET)
+if BOT_MODE == "webhook":
+    app.router.add_post(TELEGRAM_WEBHOOK_PATH, TELEGRAM_WEBHOOK.handle)
+
+
+def store_file_sizes():
+    sizes = {}
+    for path in store_files():
+        try:
+            sizes[(path,)] = os.path.getsize(path)
+        except OSError:
+            pass
+    return sizes
+
+
+def queue_depths():
+    return {
+        ("db_commit",): pending_commits(),
+        ("telegram_outbound",): OUTBOX.queue_depth(),
+        ("webhook_updates",): TELEGRAM_WEBHOOK.queue_depth(),
+        ("payment_events",): PAYMENTS.queue_depth(),
+    }
+
+
+def labelled(counts):
+    return {(key,): value for key, value in counts.items()}
+
+
+CallbackMetric("shop_store_file_bytes", "Size of the store files on disk.", store_file_sizes, ["file"])
+CallbackMetric("shop_queue_depth", "Items waiting in in-process queues.", queue_depths, ["queue"])
+CallbackMetric(
+    "shop_telegram_errors_total",
+    "Bot API calls that failed after retries, by method.",
+    lambda: labelled(OUTBOX.metrics["failures"]),
+    ["method"],
+    kind="counter",
+)
+CallbackMetric(
+    "shop_telegram_retries_total", "Bot API call retries.", lambda: OUTBOX.metrics["retries"], kind="counter"
+)
+CallbackMetric(
+    "shop_telegram_retry_after_total",
+    "Flood-control (retry_after) responses.",
+    lambda: OUTBOX.metrics["retry_after"],
+    kind="counter",
+)
+CallbackMetric(
+    "shop_telegram_throttled_seconds_total",
+    "Time outbound calls waited for rate-limit tokens.",
+    lambda: OUTBOX.metrics["throttled_seconds"],
+    kind="counter",
+)
+CallbackMetric(
+    "shop_webhook_updates_total",
+    "Telegram webhook requests, by outcome.",
+    lambda: labelled(TELEGRAM_WEBHOOK.metrics),
+    ["outcome"],
+    kind="counter",
+)
+CallbackMetric(
+    "shop_payment_events_total",
+    "Payment callback pipeline events, by outcome.",
+    lambda: labelled(PAYMENTS.metrics),
+    ["outcome"],
+    kind="counter",
+)
+
+
+async def handle_metrics(request):
+    if METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+        return web.Response(status=401)
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+
+app.router.add_get(METRICS_PATH, handle_metrics)
+
+BACKGROUND_TASKS = set()
+
 
 async def on_startup():
     await init_db()
     await load_settings()
+    # Builds the catalog search index now rather than on a user's first /search.
+    await search_products("")
+    BACKGROUND_TASKS.update(await SESSIONS.start())
+    BACKGROUND_TASKS.update(await PAYMENTS.start())
+    BACKGROUND_TASKS.add(asyncio.create_task(monitor_loop_lag()))
+    for task in (start_journal_compaction(), start_archiving()):
+        if task:
+            BACKGROUND_TASKS.add(task)
+
+
+async def run_webhook():
+    BACKGROUND_TASKS.update(TELEGRAM_WEBHOOK.start())
+    if WEBHOOK_HOST and TELEGRAM_SET_WEBHOOK:
+        await bot.set_webhook(
+            WEBHOOK_HOST + TELEGRAM_WEBHOOK_PATH,
+            secret_token=TELEGRAM_WEBHOOK_SECRET,
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await TELEGRAM_WEBHOOK.close()
 
 async def main():
     await on_startup()
@@ -916,7 +1482,16 @@ async def main():
     site = web.TCPSite(runner, "0.0.0.0", int(os.getenv("PORT", "8080")))
     await site.start()
     # start bot
-    await dp.start_polling(bot)
+    try:
+        if BOT_MODE == "webhook":
+            await run_webhook()
+        else:
+            # getUpdates is refused while a webhook is registered
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
+    finally:
+        await SESSIONS.close()
+        await close_db()
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
@@ -0,0 +1,208 @@
+# metrics.py
+# Minimal Prometheus instrumentation (text exposition format 0.0.4) without
+# extra dependencies, so any module can import it. Metrics register
+# themselves in REGISTRY when created; render() produces the /metrics page.
+#
+# Observations may come from executor threads (database file I/O), so every
+# metric guards its samples with a lock.
+import asyncio
+import functools
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Sequence, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REGISTRY: List[Any] = []
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[Any], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()) -> None:
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self._values: Dict[Tuple[Any, ...], float] = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, *labels: Any, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            yield f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+
+
+class CallbackMetric:
+    """Value read at scrape time: `fn()` returns a number, or a dict of
+    label-value tuples to numbers."""
+
+    def __init__(
+        self, name: str, help: str, fn: Callable[[], Any], labelnames: Sequence[str] = (), kind: str = "gauge"
+    ) -> None:
+        self.name, self.help, self.fn, self.labelnames, self.kind = name, help, fn, tuple(labelnames), kind
+        REGISTRY.append(self)
+
+    def samples(self) -> Iterable[str]:
+        value = self.fn()
+        if value is None:
+            return
+        if not isinstance(value, dict):
+            value = {(): value}
+        for labels, number in value.items():
+            yield f"{self.name}{_labels(self.labelnames, labels)} {_number(number)}"
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> None:
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts..., +Inf count, sum]
+        self._values: Dict[Tuple[Any, ...], List[float]] = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value: float, *labels: Any) -> None:
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[i] += 1
+                    break
+            else:
+                entry[len(self.buckets)] += 1
+            entry[-1] += value
+
+    def time(self, *labels: Any) -> "_Timer":
+        return _Timer(self, labels)
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            values = [(labels, list(entry)) for labels, entry in self._values.items()]
+        for labels, entry in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), entry):
+                cumulative += count
+                le = 'le="' + _number(bound) + '"'
+                yield f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(entry[-1])}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}"
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram: Histogram, labels: Tuple[Any, ...]) -> None:
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self) -> "_Timer":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+
+
+def timed_coroutine(func: Callable[..., Any], histogram: Histogram, errors: Counter, label: str):
+    """Wraps an async function so every call is observed under `label`."""
+
+    @functools.wraps(func)
+    async def wrapper(*args: Any, **kwargs: Any) -> Any:
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        except Exception:
+            errors.inc(label)
+            raise
+        finally:
+            histogram.observe(time.perf_counter() - started, label)
+
+    return wrapper
+
+
+def render() -> str:
+    lines: List[str] = []
+    for metric in REGISTRY:
+        try:
+            samples = list(metric.samples())
+        except Exception:
+            logger.exception("Collecting %s failed", metric.name)
+            continue
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
+
+
+# -- shared metrics -------------------------------------------------------
+
+HANDLER_SECONDS = Histogram(
+    "shop_update_handler_seconds", "Time spent handling one update, by handler.", ["handler"]
+)
+HANDLER_ERRORS = Counter(
+    "shop_update_handler_errors_total", "Updates whose handler raised, by handler.", ["handler"]
+)
+DB_OP_SECONDS = Histogram(
+    "shop_db_operation_seconds", "Latency of database.py operations, by operation.", ["operation"]
+)
+DB_OP_ERRORS = Counter(
+    "shop_db_operation_errors_total", "database.py operations that raised, by operation.", ["operation"]
+)
+DB_PHASE_SECONDS = Histogram(
+    "shop_db_phase_seconds",
+    "JSON store I/O phases (read, parse, replay, serialize, write, append, archive).",
+    ["phase"],
+)
+TELEGRAM_SECONDS = Histogram(
+    "shop_telegram_request_seconds", "Latency of one Bot API call attempt, by method.", ["method"]
+)
+LOOP_LAG_SECONDS = Histogram(
+    "shop_event_loop_lag_seconds",
+    "How late a periodic event-loop tick fired.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0),
+)
+
+
+def observe_handler(handler: str, seconds: float, failed: bool = False) -> None:
+    HANDLER_SECONDS.observe(seconds, handler)
+    if failed:
+        HANDLER_ERRORS.inc(handler)
+
+
+async def monitor_loop_lag(interval: float = 0.5) -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        LOOP_LAG_SECONDS.observe(max(0.0, loop.time() - expected))
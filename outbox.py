@@ -0,0 +1,209 @@
+# outbox.py
+# Outbound delivery layer for the bot: every Bot API call goes through
+# OutboundLimiter (an aiogram request middleware), which paces sends with a
+# global and a per-chat token bucket, serves user replies before admin
+# notifications, and retries on flood control (retry_after) and transient
+# network/server errors (network errors only for calls that are safe to repeat).
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+
+from metrics import TELEGRAM_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Telegram allows about 30 messages/s per bot and about 1 message/s per chat
+# (short bursts are tolerated).
+GLOBAL_RATE = float(os.getenv("OUTBOX_GLOBAL_RATE", "25"))
+GLOBAL_BURST = float(os.getenv("OUTBOX_GLOBAL_BURST", "25"))
+CHAT_RATE = float(os.getenv("OUTBOX_CHAT_RATE", "1"))
+CHAT_BURST = float(os.getenv("OUTBOX_CHAT_BURST", "5"))
+MAX_RETRIES = int(os.getenv("OUTBOX_MAX_RETRIES", "5"))
+
+PRIORITY_USER = 0
+PRIORITY_ADMIN = 1
+
+# A network error can come after Telegram already accepted the call, so
+# methods that post a new message (sendMessage, sendPhoto, sendMediaGroup,
+# copyMessage, ...) are not repeated after one: the customer would get it twice.
+NOT_IDEMPOTENT_PREFIXES = ("Send", "Copy", "Forward")
+
+
+class TokenBucket:
+    """Reservation-style token bucket: callers reserve tokens and sleep for
+    the returned delay, so waiters on one bucket are served in order."""
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, cost: float = 1.0) -> float:
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens -= cost
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def delay(self, cost: float = 1.0) -> float:
+        self._refill(time.monotonic())
+        return 0.0 if self.tokens >= cost else (cost - self.tokens) / self.rate
+
+    def pause(self, seconds: float) -> None:
+        # Flood control: nothing may be sent through this bucket for `seconds`.
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens = min(self.tokens, 0.0) - seconds * self.rate
+
+    def idle(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+
+class OutboundLimiter(BaseRequestMiddleware):
+    def __init__(
+        self,
+        priority_for: Optional[Callable[[Any], int]] = None,
+        global_rate: float = GLOBAL_RATE,
+        global_burst: float = GLOBAL_BURST,
+        chat_rate: float = CHAT_RATE,
+        chat_burst: float = CHAT_BURST,
+        max_retries: int = MAX_RETRIES,
+    ) -> None:
+        self.priority_for = priority_for or (lambda chat_id: PRIORITY_USER)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, global_burst)
+        self._chats: Dict[Any, TokenBucket] = {}
+        # (priority, arrival, cost, future) waiting for a global token
+        self._waiters: List[Tuple[int, int, float, "asyncio.Future[None]"]] = []
+        self._arrivals = itertools.count()
+        self._pump_task: Optional["asyncio.Task[None]"] = None
+        self.metrics: Dict[str, Any] = {
+            "requests": 0,
+            "errors": 0,
+            "retries": 0,
+            "retry_after": 0,
+            "throttled_seconds": 0.0,
+            "latency": {},  # method name -> [count, total seconds]
+            "failures": {},  # method name -> count
+        }
+
+    # -- pacing ---------------------------------------------------------
+
+    def _chat_bucket(self, chat_id: Any) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 10000:
+                self._chats = {key: b for key, b in self._chats.items() if not b.idle()}
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    async def _acquire(self, chat_id: Any, cost: float) -> None:
+        started = time.monotonic()
+        delay = self._chat_bucket(chat_id).reserve(cost)
+        if delay:
+            await asyncio.sleep(delay)
+        # The bucket never holds more than its capacity, so an album costing
+        # more (OUTBOX_GLOBAL_BURST below 10) would wait for it forever.
+        cost = min(cost, self._global.capacity)
+        if self._waiters or self._global.delay(cost):
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(
+                self._waiters, (self.priority_for(chat_id), next(self._arrivals), cost, future)
+            )
+            if self._pump_task is None:
+                self._pump_task = asyncio.create_task(self._pump())
+            await future
+        else:
+            self._global.reserve(cost)
+        self.metrics["throttled_seconds"] += time.monotonic() - started
+
+    async def _pump(self) -> None:
+        # Hands out global tokens in priority order as they refill.
+        try:
+            while self._waiters:
+                if self._waiters[0][3].done():
+                    heapq.heappop(self._waiters)
+                    continue
+                cost = self._waiters[0][2]
+                delay = self._global.delay(cost)
+                if delay:
+                    await asyncio.sleep(delay)
+                    continue
+                _, _, cost, future = heapq.heappop(self._waiters)
+                if not future.done():
+                    self._global.reserve(cost)
+                    future.set_result(None)
+        finally:
+            self._pump_task = None
+
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    # -- middleware -----------------------------------------------------
+
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        chat_id = getattr(method, "chat_id", None)
+        # Albums count as one message per photo.
+        cost = float(len(getattr(method, "media", None) or ()) or 1)
+        attempt = 0
+        while True:
+            if chat_id is not None:
+                await self._acquire(chat_id, cost)
+            started = time.monotonic()
+            self.metrics["requests"] += 1
+            try:
+                response = await make_request(bot, method)
+            except TelegramRetryAfter as exc:
+                self._record(name, started)
+                self.metrics["retry_after"] += 1
+                if attempt >= self.max_retries:
+                    self._fail(name)
+                    raise
+                if chat_id is not None:
+                    self._chat_bucket(chat_id).pause(exc.retry_after)
+                else:
+                    await asyncio.sleep(exc.retry_after)
+                logger.warning("%s: flood control, retrying in %ss", name, exc.retry_after)
+            except (TelegramNetworkError, TelegramServerError) as exc:
+                self._record(name, started)
+                if attempt >= self.max_retries or (
+                    isinstance(exc, TelegramNetworkError) and name.startswith(NOT_IDEMPOTENT_PREFIXES)
+                ):
+                    self._fail(name)
+                    raise
+                await asyncio.sleep(min(30.0, 0.5 * 2**attempt))
+            except Exception:
+                self._record(name, started)
+                self._fail(name)
+                raise
+            else:
+                self._record(name, started)
+                return response
+            attempt += 1
+            self.metrics["retries"] += 1
+
+    def _record(self, name: str, started: float) -> None:
+        elapsed = time.monotonic() - started
+        entry = self.metrics["latency"].setdefault(name, [0, 0.0])
+        entry[0] += 1
+        entry[1] += elapsed
+        TELEGRAM_SECONDS.observe(elapsed, name)
+
+    def _fail(self, name: str) -> None:
+        self.metrics["errors"] += 1
+        self.metrics["failures"][name] = self.metrics["failures"].get(name, 0) + 1
@@ -0,0 +1,309 @@
+# payments.py
+# Payment-callback pipeline. The HTTP handler checks the callback's signature
+# (hex HMAC-SHA256 of the raw body with PAYMENT_SECRET, in the
+# PAYMENT_SIGNATURE_HEADER header; 403 otherwise, and every callback is
+# refused while PAYMENT_SECRET is unset), validates it, derives an
+# idempotency key and records the event in a durable JSONL inbox
+# (group-committed: one write + fsync for every callback that arrived in the
+# same window), then answers the provider. A background worker takes queued
+# events in batches, marks the orders "paid" with one database commit and
+# sends one admin notification per batch. Provider retries of an event that
+# is already recorded are acknowledged without doing anything again.
+#
+# Inbox lines are {"key", "order_id", "provider", "at"} for recorded events
+# and {"done": [keys]} once a batch has been applied; on startup recorded but
+# unapplied events are queued again. Applied events are kept, for dedup, only
+# for PAYMENT_RETRY_WINDOW seconds: once an hour (PAYMENT_COMPACT_INTERVAL)
+# older ones are dropped from memory and the inbox file is rewritten without
+# them.
+#
+# Dedup state lives in this process, so it only holds while a single bot
+# process serves the payment callback with this inbox file; two processes
+# would each accept their own copy of a retried callback.
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+PAYMENT_INBOX_PATH = os.getenv("PAYMENT_INBOX_PATH", "./payments.log")
+PAYMENT_COMMIT_WINDOW = float(os.getenv("PAYMENT_COMMIT_WINDOW_MS", "5")) / 1000.0
+PAYMENT_BATCH_SIZE = int(os.getenv("PAYMENT_BATCH_SIZE", "100"))
+PAYMENT_BATCH_WAIT = float(os.getenv("PAYMENT_BATCH_WAIT", "0.2"))
+PAYMENT_SECRET = os.getenv("PAYMENT_SECRET", "")
+PAYMENT_SIGNATURE_HEADER = os.getenv("PAYMENT_SIGNATURE_HEADER", "X-Signature")
+# Longest time a provider keeps retrying one callback.
+PAYMENT_RETRY_WINDOW = int(os.getenv("PAYMENT_RETRY_WINDOW", str(7 * 24 * 3600)))
+PAYMENT_COMPACT_INTERVAL = float(os.getenv("PAYMENT_COMPACT_INTERVAL", "3600"))
+
+
+def sign(secret: str, body: bytes) -> str:
+    return hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+def idempotency_key(provider: str, data: Dict[str, Any], order_id: int) -> str:
+    # Prefer the provider's own transaction id; otherwise one payment per order.
+    txn = data.get("transaction") or data.get("transaction_id") or data.get("id")
+    if txn:
+        return f"{provider}:{txn}"
+    return f"{provider}:order:{order_id}"
+
+
+class PaymentInbox:
+    def __init__(
+        self,
+        apply_batch: Callable[[List[int]], Awaitable[List[int]]],
+        notify: Callable[[List[int]], Awaitable[Any]],
+        path: str = PAYMENT_INBOX_PATH,
+        batch_size: int = PAYMENT_BATCH_SIZE,
+        batch_wait: float = PAYMENT_BATCH_WAIT,
+        secret: str = PAYMENT_SECRET,
+        retry_window: int = PAYMENT_RETRY_WINDOW,
+    ) -> None:
+        # apply_batch returns the order ids it actually changed; only those
+        # are counted and passed to notify.
+        self.apply_batch = apply_batch
+        self.notify = notify
+        self.path = path
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.secret = secret
+        self.retry_window = retry_window
+        # idempotency key -> when it was recorded; _pending: not applied yet
+        self._keys: Dict[str, int] = {}
+        self._pending: Set[str] = set()
+        self._queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue()
+        self._lines: List[str] = []
+        self._waiters: List["asyncio.Future[None]"] = []
+        self._flusher: Optional["asyncio.Task[None]"] = None
+        self._file_lock = asyncio.Lock()
+        self.metrics: Dict[str, int] = {
+            "received": 0,
+            "duplicates": 0,
+            "invalid": 0,
+            "rejected": 0,  # bad or missing signature
+            "applied": 0,
+            "batches": 0,
+            "failed_batches": 0,
+        }
+
+    # -- durable inbox --------------------------------------------------
+
+    def _read_sync(self) -> Tuple[Dict[str, Dict[str, Any]], Set[str]]:
+        events: Dict[str, Dict[str, Any]] = {}
+        done: Set[str] = set()
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # torn tail of an interrupted append; never acknowledged
+                        continue
+                    if "done" in record:
+                        done.update(record["done"])
+                    else:
+                        events[record["key"]] = record
+        except FileNotFoundError:
+            pass
+        return events, done
+
+    def _load_sync(self) -> List[Dict[str, Any]]:
+        events, done = self._read_sync()
+        cutoff = int(time.time()) - self.retry_window
+        self._keys = {
+            key: event["at"]
+            for key, event in events.items()
+            if key not in done or event["at"] >= cutoff
+        }
+        pending = [event for key, event in events.items() if key not in done]
+        self._pending = {event["key"] for event in pending}
+        return pending
+
+    def _compact_sync(self, cutoff: int) -> int:
+        events, done = self._read_sync()
+        kept = [e for key, e in events.items() if key not in done or e["at"] >= cutoff]
+        if len(kept) == len(events):
+            return 0
+        lines = [json.dumps(event, ensure_ascii=False) + "\n" for event in kept]
+        applied = [event["key"] for event in kept if event["key"] in done]
+        if applied:
+            lines.append(json.dumps({"done": applied}) + "\n")
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("".join(lines))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        return len(events) - len(kept)
+
+    async def compact(self) -> int:
+        """Forgets applied events older than the retry window; returns how many."""
+        cutoff = int(time.time()) - self.retry_window
+        for key in [k for k, at in self._keys.items() if at < cutoff and k not in self._pending]:
+            del self._keys[key]
+        # Under the file lock, so no append lands in the file being replaced.
+        async with self._file_lock:
+            return await asyncio.get_running_loop().run_in_executor(None, self._compact_sync, cutoff)
+
+    async def _compact_loop(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                dropped = await self.compact()
+            except Exception:
+                logger.exception("Payment inbox compaction failed")
+                continue
+            if dropped:
+                logger.info("Dropped %d applied payment events from the inbox", dropped)
+
+    def _append_sync(self, lines: List[str]) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("".join(lines))
+            f.flush()
+            os.fsync(f.fileno())
+
+    async def _append(self, lines: List[str]) -> None:
+        async with self._file_lock:
+            await asyncio.get_running_loop().run_in_executor(None, self._append_sync, lines)
+
+    def _stage(self, line: str) -> "asyncio.Future[None]":
+        waiter = asyncio.get_running_loop().create_future()
+        self._lines.append(line)
+        self._waiters.append(waiter)
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush())
+        return waiter
+
+    async def _flush(self) -> None:
+        try:
+            while self._waiters:
+                if PAYMENT_COMMIT_WINDOW > 0:
+                    await asyncio.sleep(PAYMENT_COMMIT_WINDOW)
+                lines, waiters = self._lines, self._waiters
+                self._lines, self._waiters = [], []
+                try:
+                    await self._append(lines)
+                except Exception as exc:
+                    for waiter in waiters:
+                        if not waiter.done():
+                            waiter.set_exception(exc)
+                else:
+                    for waiter in waiters:
+                        if not waiter.done():
+                            waiter.set_result(None)
+        finally:
+            self._flusher = None
+
+    async def record(self, key: str, order_id: int, provider: str) -> bool:
+        """Durably records a paid event; False if `key` was seen before."""
+        if key in self._keys:
+            self.metrics["duplicates"] += 1
+            return False
+        event = {"key": key, "order_id": order_id, "provider": provider, "at": int(time.time())}
+        self._keys[key] = event["at"]
+        self._pending.add(key)
+        try:
+            await self._stage(json.dumps(event, ensure_ascii=False) + "\n")
+        except Exception:
+            # Not durable, so not acknowledged: let the provider's retry record it.
+            self._keys.pop(key, None)
+            self._pending.discard(key)
+            raise
+        self.metrics["received"] += 1
+        self._queue.put_nowait(event)
+        return True
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    # -- worker ---------------------------------------------------------
+
+    async def _next_batch(self) -> List[Dict[str, Any]]:
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _work(self) -> None:
+        while True:
+            batch = await self._next_batch()
+            try:
+                applied = await self.apply_batch([event["order_id"] for event in batch])
+                keys = [event["key"] for event in batch]
+                await self._append([json.dumps({"done": keys}) + "\n"])
+            except Exception:
+                self.metrics["failed_batches"] += 1
+                logger.exception("Applying %d payment events failed; retrying", len(batch))
+                for event in batch:
+                    self._queue.put_nowait(event)
+                await asyncio.sleep(1)
+                continue
+            self._pending.difference_update(keys)
+            self.metrics["batches"] += 1
+            self.metrics["applied"] += len(applied)
+            missing = len(batch) - len(applied)
+            if missing:
+                logger.warning("%d payment events changed no order (unknown, or not awaiting payment)", missing)
+            if applied:
+                try:
+                    await self.notify(applied)
+                except Exception:
+                    logger.exception("Payment notification failed")
+
+    async def start(
+        self, compact_interval: float = PAYMENT_COMPACT_INTERVAL
+    ) -> List["asyncio.Task[None]"]:
+        if not self.secret:
+            logger.warning("PAYMENT_SECRET is not set; every payment callback will be refused")
+        pending = await asyncio.get_running_loop().run_in_executor(None, self._load_sync)
+        for event in pending:
+            self._queue.put_nowait(event)
+        if pending:
+            logger.info("Re-queued %d unapplied payment events", len(pending))
+        return [
+            asyncio.create_task(self._work()),
+            asyncio.create_task(self._compact_loop(compact_interval)),
+        ]
+
+    # -- HTTP -----------------------------------------------------------
+
+    def _signed(self, body: bytes, signature: str) -> bool:
+        if not self.secret:
+            return False
+        return hmac.compare_digest(signature.lower().encode(), sign(self.secret, body).encode())
+
+    async def handle(self, request: web.Request) -> web.Response:
+        body = await request.read()
+        if not self._signed(body, request.headers.get(PAYMENT_SIGNATURE_HEADER, "")):
+            self.metrics["rejected"] += 1
+            return web.json_response({"ok": False, "error": "bad signature"}, status=403)
+        try:
+            data = json.loads(body)
+            order_id = int(data["order"])
+        except (ValueError, TypeError, KeyError):
+            self.metrics["invalid"] += 1
+            return web.json_response({"ok": False, "error": "invalid payload"}, status=400)
+        if data.get("paid") is not True:
+            return web.json_response({"ok": True})
+        provider = str(data.get("provider") or "unknown")
+        try:
+            await self.record(idempotency_key(provider, data, order_id), order_id, provider)
+        except Exception:
+            logger.exception("Could not record payment callback for order %s", order_id)
+            return web.json_response({"ok": False}, status=500)
+        return web.json_response({"ok": True})
@@ -0,0 +1,202 @@
+# reports.py
+# Sales report export for admins (/export): one row per order item with the
+# order's details and the product name, as XLSX (openpyxl write-only mode)
+# or CSV. Archived orders come first, month by month, then the store, all of
+# it read a page at a time; every page is written from an executor thread,
+# so memory stays flat however many orders match and the event loop keeps
+# serving other users meanwhile.
+import asyncio
+import csv
+import os
+import re
+import tempfile
+from datetime import date, datetime, time, timedelta
+from typing import Any, Dict, List, Optional
+
+try:
+    from openpyxl import Workbook
+except ImportError:  # CSV exports still work
+    Workbook = None
+
+from database import STATS_UTC_OFFSET, archived_orders, export_orders_page, list_archive_months
+
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "200"))
+HEADER = (
+    "Buyurtma",
+    "Sana",
+    "Status",
+    "Foydalanuvchi",
+    "FIO",
+    "Telefon",
+    "Manzil",
+    "Buyurtma jami",
+    "Mahsulot ID",
+    "Mahsulot",
+    "Soni",
+    "Narx",
+    "Summa",
+)
+
+
+class CsvReport:
+    extension = "csv"
+
+    def __init__(self, path: str) -> None:
+        # utf-8-sig so Excel shows the Uzbek letters correctly.
+        self.file = open(path, "w", newline="", encoding="utf-8-sig")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(HEADER)
+
+    def write(self, rows: List[tuple]) -> None:
+        self.writer.writerows(rows)
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class XlsxReport:
+    extension = "xlsx"
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        # Write-only workbooks stream rows to a temporary file instead of
+        # keeping cells in memory.
+        self.workbook = Workbook(write_only=True)
+        self.sheet = self.workbook.create_sheet("Buyurtmalar")
+        self.sheet.append(HEADER)
+
+    def write(self, rows: List[tuple]) -> None:
+        for row in rows:
+            self.sheet.append(row)
+
+    def close(self) -> None:
+        self.workbook.save(self.path)
+
+
+REPORT_FORMATS = {"csv": CsvReport}
+if Workbook is not None:
+    REPORT_FORMATS["xlsx"] = XlsxReport
+DEFAULT_FORMAT = "xlsx" if Workbook is not None else "csv"
+
+_DATE = re.compile(r"^\d{4}-\d{2}(-\d{2})?$")
+
+
+def _period_start(text: str) -> date:
+    return date.fromisoformat(text if len(text) == 10 else text + "-01")
+
+
+def _period_end(text: str) -> date:
+    # First day after the period: a day, or a whole month for YYYY-MM.
+    if len(text) == 10:
+        return date.fromisoformat(text) + timedelta(days=1)
+    first = _period_start(text)
+    return (first.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def _utc_bound(day: date) -> str:
+    # Local midnight (STATS_UTC_OFFSET, as in the statistics) as created_ts text.
+    return (datetime.combine(day, time()) - timedelta(hours=STATS_UTC_OFFSET)).isoformat()
+
+
+def _local_time(created_ts: str) -> str:
+    return (datetime.fromisoformat(created_ts) + timedelta(hours=STATS_UTC_OFFSET)).isoformat(" ", "seconds")
+
+
+def parse_export_args(text: str, allowed_statuses) -> Dict[str, Any]:
+    """`/export [from [to]] [status,...] [xlsx|csv]`, dates as YYYY-MM-DD or
+    YYYY-MM (a whole month), in local time. since and until come back as UTC
+    timestamps, comparable with created_ts. Raises ValueError with a message
+    for the admin."""
+    dates: List[str] = []
+    statuses: List[str] = []
+    fmt = DEFAULT_FORMAT
+    for arg in text.split()[1:]:
+        arg = arg.lower()
+        if _DATE.match(arg):
+            dates.append(arg)
+        elif arg in ("xlsx", "csv"):
+            if arg not in REPORT_FORMATS:
+                raise ValueError("XLSX uchun serverda openpyxl o‘rnatilmagan, csv tanlang.")
+            fmt = arg
+        else:
+            for status in filter(None, arg.split(",")):
+                if status not in allowed_statuses:
+                    raise ValueError(f"Noma'lum status: {status}")
+                statuses.append(status)
+    if len(dates) > 2:
+        raise ValueError("Ko‘pi bilan ikki sana kiriting: boshlanish va tugash.")
+    try:
+        since = _period_start(dates[0]) if dates else None
+        until = _period_end(dates[-1]) if dates else None
+    except ValueError:
+        raise ValueError("Sana YYYY-MM-DD yoki YYYY-MM ko‘rinishida bo‘lishi kerak.")
+    if since and until and since >= until:
+        raise ValueError("Boshlanish sanasi tugash sanasidan keyin bo‘lmasligi kerak.")
+    return {
+        "since": _utc_bound(since) if since else None,
+        "until": _utc_bound(until) if until else None,
+        "statuses": statuses or None,
+        "format": fmt,
+        # as typed, for the caption
+        "period": " — ".join(dates),
+    }
+
+
+def report_rows(page) -> List[tuple]:
+    rows = []
+    for order, lines in page:
+        order_id, user_id, fullname, address, phone, total, status, created_ts = order
+        head = (order_id, _local_time(created_ts), status, user_id, fullname, phone, address, total)
+        if not lines:
+            rows.append(head + (None,) * 5)
+        for product_id, name, qty, price in lines:
+            rows.append(head + (product_id, name or f"Mahsulot #{product_id}", qty, price, qty * price))
+    return rows
+
+
+async def export_report(
+    fmt: str = DEFAULT_FORMAT,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    statuses: Optional[List[str]] = None,
+) -> Dict[str, Any]:
+    """Writes the report to a temporary file; the caller sends and removes
+    it. Returns {"path", "orders", "rows"}."""
+    loop = asyncio.get_running_loop()
+    report_class = REPORT_FORMATS[fmt]
+    fd, path = tempfile.mkstemp(prefix="hisobot_", suffix="." + report_class.extension)
+    os.close(fd)
+    orders = rows = 0
+    try:
+        report = await loop.run_in_executor(None, report_class, path)
+
+        async def write(page) -> None:
+            nonlocal orders, rows
+            batch = report_rows(page)
+            await loop.run_in_executor(None, report.write, batch)
+            orders += len(page)
+            rows += len(batch)
+
+        async def write_pages(fetch, *args) -> None:
+            cursor = None
+            while True:
+                page, cursor = await fetch(
+                    *args, after_id=cursor, limit=EXPORT_PAGE_SIZE, statuses=statuses, since=since, until=until
+                )
+                if page:
+                    await write(page)
+                if cursor is None:
+                    break
+
+        try:
+            for month in await list_archive_months():
+                if (since and month < since[:7]) or (until and month + "-01" >= until):
+                    continue
+                await write_pages(archived_orders, month)
+            await write_pages(export_orders_page)
+        finally:
+            await loop.run_in_executor(None, report.close)
+    except BaseException:
+        os.remove(path)
+        raise
+    return {"path": path, "orders": orders, "rows": rows}
@@ -0,0 +1,178 @@
+# routing.py
+# Text-message routing for the bot. Instead of asking every registered filter
+# in turn, MessageRouter finds the candidate handlers for a message with hash
+# lookups (exact button texts, command names) and a prefix-trie walk
+# ("/t{pid}", "/remove_{pid}", "/pay_*_{id}"), then runs the few remaining
+# predicate routes (state checks such as "waiting for password"). Routes keep
+# their registration order, so the first matching route wins exactly as with
+# a chain of filters. Independent of aiogram: events are passed through as-is.
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+Check = Callable[[Any], Awaitable[bool]]
+Handler = Callable[[Any], Awaitable[Any]]
+# observe(handler name, seconds, failed)
+Observer = Callable[[str, float, bool], None]
+
+
+class Route:
+    __slots__ = ("order", "handler", "check")
+
+    def __init__(self, order: int, handler: Handler, check: Optional[Check] = None) -> None:
+        self.order = order
+        self.handler = handler
+        self.check = check
+
+
+class PrefixTrie:
+    """Character trie; `matches(text)` returns the values of every inserted
+    prefix of `text`, shortest first, in O(len(longest prefix))."""
+
+    __slots__ = ("children", "values")
+
+    def __init__(self) -> None:
+        self.children: Dict[str, "PrefixTrie"] = {}
+        self.values: List[Any] = []
+
+    def insert(self, prefix: str, value: Any) -> None:
+        node = self
+        for char in prefix:
+            node = node.children.setdefault(char, PrefixTrie())
+        node.values.append(value)
+
+    def matches(self, text: str) -> List[Any]:
+        found: List[Any] = []
+        node = self
+        for char in text:
+            node = node.children.get(char)
+            if node is None:
+                break
+            found.extend(node.values)
+        return found
+
+
+def command_name(text: str) -> Optional[str]:
+    # "/order 12" -> "order", "/start@ShopBot" -> "start"
+    if not text.startswith("/"):
+        return None
+    head = text[1:].split(maxsplit=1)
+    if not head:
+        return None
+    return head[0].partition("@")[0]
+
+
+class MessageRouter:
+    def __init__(self, observe: Optional[Observer] = None) -> None:
+        self.observe = observe
+        self._order = 0
+        self._texts: Dict[str, List[Route]] = {}
+        self._commands: Dict[str, List[Route]] = {}
+        self._prefixes = PrefixTrie()
+        self._predicates: List[Route] = []
+        # group name -> (route, texts currently mapped to it)
+        self._groups: Dict[str, List[Any]] = {}
+
+    def _route(self, handler: Handler, check: Optional[Check] = None) -> Route:
+        self._order += 1
+        return Route(self._order, handler, check)
+
+    def text(self, *texts: str, guard: Optional[Check] = None):
+        """Exact message text (reply keyboard buttons)."""
+
+        def register(handler: Handler) -> Handler:
+            route = self._route(handler, guard)
+            for text in texts:
+                self._texts.setdefault(text, []).append(route)
+            return handler
+
+        return register
+
+    def command(self, *names: str, guard: Optional[Check] = None):
+        """`/name`, optionally followed by arguments or a bot mention."""
+
+        def register(handler: Handler) -> Handler:
+            route = self._route(handler, guard)
+            for name in names:
+                self._commands.setdefault(name, []).append(route)
+            return handler
+
+        return register
+
+    def prefix(self, *prefixes: str, guard: Optional[Check] = None):
+        def register(handler: Handler) -> Handler:
+            route = self._route(handler, guard)
+            for prefix in prefixes:
+                self._prefixes.insert(prefix, route)
+            return handler
+
+        return register
+
+    def predicate(self, check: Check):
+        """Arbitrary condition; checked for every message, so keep these few."""
+
+        def register(handler: Handler) -> Handler:
+            self._predicates.append(self._route(handler, check))
+            return handler
+
+        return register
+
+    def text_group(self, name: str, texts: Iterable[str] = (), guard: Optional[Check] = None):
+        """Exact texts that change at runtime (e.g. category buttons); replace
+        them later with set_group_texts()."""
+
+        def register(handler: Handler) -> Handler:
+            self._groups[name] = [self._route(handler, guard), []]
+            self.set_group_texts(name, texts)
+            return handler
+
+        return register
+
+    def set_group_texts(self, name: str, texts: Iterable[str]) -> None:
+        route, current = self._groups[name]
+        for text in current:
+            routes = self._texts.get(text)
+            if routes and route in routes:
+                routes.remove(route)
+                if not routes:
+                    del self._texts[text]
+        current = list(dict.fromkeys(texts))
+        for text in current:
+            routes = self._texts.setdefault(text, [])
+            routes.append(route)
+            routes.sort(key=lambda r: r.order)
+        self._groups[name][1] = current
+
+    def candidates(self, text: Optional[str]) -> List[Route]:
+        if not text:
+            return self._predicates
+        found = list(self._texts.get(text, ()))
+        name = command_name(text)
+        if name is not None:
+            found.extend(self._commands.get(name, ()))
+        found.extend(self._prefixes.matches(text))
+        if not found:
+            return self._predicates
+        found.extend(self._predicates)
+        found.sort(key=lambda r: r.order)
+        return found
+
+    async def dispatch(self, event: Any, text: Optional[str]) -> bool:
+        """Runs the first route that matches; returns False if none did."""
+        for route in self.candidates(text):
+            if route.check is not None and not await route.check(event):
+                continue
+            await self._run(route, event)
+            return True
+        return False
+
+    async def _run(self, route: Route, event: Any) -> None:
+        if self.observe is None:
+            await route.handler(event)
+            return
+        started = time.perf_counter()
+        failed = True
+        try:
+            await route.handler(event)
+            failed = False
+        finally:
+            self.observe(route.handler.__name__, time.perf_counter() - started, failed)
@@ -0,0 +1,151 @@
+# search.py
+# Catalog search: an inverted index over product names and descriptions.
+#
+# Text is normalized before indexing and querying, so Uzbek written in
+# Cyrillic or Latin and the different apostrophe characters people type
+# (o‘, o', oʻ, o’) all end up as the same terms: "Ўйинчоқ", "o‘yinchoq" and
+# "oyinchoq" match each other.
+#
+# Queries are AND across words; the last characters of a word may be
+# missing (prefix match). Name hits rank above description hits, and exact
+# words above prefixes. database.py keeps a SearchIndex in memory; the
+# SQLite backend puts the same normalized words in an FTS5 table.
+import bisect
+import heapq
+import re
+from typing import Dict, Iterable, List, Optional, Tuple
+
+NAME_WEIGHT = 3
+DESC_WEIGHT = 1
+# A word only expands to longer terms once it has this many characters;
+# it then matches every one of them, as the FTS5 prefix query does, so the
+# total counts every product that matched.
+PREFIX_MIN = 2
+PREFIX_FACTOR = 0.5
+
+_CYRILLIC = {
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ё": "yo",
+    "ж": "j", "з": "z", "и": "i", "й": "y", "к": "k", "л": "l", "м": "m",
+    "н": "n", "о": "o", "п": "p", "р": "r", "с": "s", "т": "t", "у": "u",
+    "ф": "f", "х": "x", "ц": "ts", "ч": "ch", "ш": "sh", "щ": "sh", "ъ": "",
+    "ы": "i", "ь": "", "э": "e", "ю": "yu", "я": "ya",
+    "ў": "o", "қ": "q", "ғ": "g", "ҳ": "h",
+}
+# Apostrophes (o‘, g‘, tutuq belgisi) are dropped altogether.
+_APOSTROPHES = "'`´‘’ʻʼ"
+_TRANSLATE = str.maketrans({**_CYRILLIC, **{ch: "" for ch in _APOSTROPHES}})
+_WORD = re.compile(r"[^\W_]+")
+
+
+def normalize(text: Optional[str]) -> str:
+    return (text or "").lower().translate(_TRANSLATE)
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    return _WORD.findall(normalize(text))
+
+
+def product_terms(name: Optional[str], desc: Optional[str]) -> Dict[str, int]:
+    """term -> weight for one product."""
+    terms: Dict[str, int] = {}
+    for term in tokenize(desc):
+        terms[term] = DESC_WEIGHT
+    for term in set(tokenize(name)):
+        terms[term] = terms.get(term, 0) + NAME_WEIGHT
+    return terms
+
+
+def query_terms(query: Optional[str]) -> List[str]:
+    return list(dict.fromkeys(tokenize(query)))
+
+
+def prefix_bound(term: str) -> str:
+    # Every term starting with `term` sorts in [term, prefix_bound(term)).
+    return term + "\U0010ffff"
+
+
+def rank(
+    matches: List[Dict[int, float]], limit: int, offset: int = 0
+) -> Tuple[List[int], int]:
+    """Intersects per-word matches (id -> score) and returns one page of
+    ids, best first, plus the number of products that matched."""
+    if not matches:
+        return [], 0
+    matches = sorted(matches, key=len)
+    scores = matches[0]
+    for other in matches[1:]:
+        scores = {pid: score + other[pid] for pid, score in scores.items() if pid in other}
+        if not scores:
+            return [], 0
+    best = heapq.nsmallest(offset + limit, scores.items(), key=lambda item: (-item[1], item[0]))
+    return [pid for pid, _ in best[offset:]], len(scores)
+
+
+class SearchIndex:
+    def __init__(self) -> None:
+        # term -> {product id: weight}
+        self.postings: Dict[str, Dict[int, int]] = {}
+        # every term, sorted, for prefix lookups
+        self.terms: List[str] = []
+        # product id -> its terms, so updates and deletes touch only those
+        self.doc_terms: Dict[int, Tuple[str, ...]] = {}
+
+    def add(self, pid: int, name: Optional[str], desc: Optional[str]) -> None:
+        self.remove(pid)
+        terms = product_terms(name, desc)
+        for term, weight in terms.items():
+            posting = self.postings.get(term)
+            if posting is None:
+                posting = self.postings[term] = {}
+                bisect.insort(self.terms, term)
+            posting[pid] = weight
+        self.doc_terms[pid] = tuple(terms)
+
+    def remove(self, pid: int) -> None:
+        for term in self.doc_terms.pop(pid, ()):
+            posting = self.postings[term]
+            posting.pop(pid, None)
+            if not posting:
+                del self.postings[term]
+                pos = bisect.bisect_left(self.terms, term)
+                if pos < len(self.terms) and self.terms[pos] == term:
+                    del self.terms[pos]
+
+    def match(self, word: str) -> Dict[int, float]:
+        exact = self.postings.get(word, {})
+        if len(word) < PREFIX_MIN:
+            return exact
+        start = bisect.bisect_left(self.terms, word)
+        stop = bisect.bisect_left(self.terms, prefix_bound(word), start)
+        if stop - start <= (1 if exact else 0):
+            return exact
+        scores: Dict[int, float] = {}
+        for term in self.terms[start:stop]:
+            if term == word:
+                continue
+            for pid, weight in self.postings[term].items():
+                score = weight * PREFIX_FACTOR
+                if score > scores.get(pid, 0):
+                    scores[pid] = score
+        for pid, weight in exact.items():
+            if weight > scores.get(pid, 0):
+                scores[pid] = weight
+        return scores
+
+    def search(self, query: str, limit: int = 10, offset: int = 0) -> Tuple[List[int], int]:
+        words = query_terms(query)
+        return rank([self.match(word) for word in words], limit, offset)
+
+    @classmethod
+    def build(cls, products: Iterable[Dict]) -> "SearchIndex":
+        # Like add() for every product, but sorts the terms once at the end.
+        index = cls()
+        for product in products:
+            pid = product["id"]
+            index.remove(pid)
+            terms = product_terms(product.get("name"), product.get("desc"))
+            for term, weight in terms.items():
+                index.postings.setdefault(term, {})[pid] = weight
+            index.doc_terms[pid] = tuple(terms)
+        index.terms = sorted(index.postings)
+        return index
@@ -0,0 +1,457 @@
+# sessions.py
+# Per-user conversation state (carts, checkout, admin flows). Entries expire
+# after a sliding TTL, the least recently used ones are evicted above a size
+# cap, and stores can be snapshotted to disk so state survives a restart.
+#
+# Handlers use it through a session backend: MemorySessionBackend keeps the
+# stores in this process, SqliteSessionBackend keeps them in a SQLite file
+# that several bot processes can share (SESSION_BACKEND=sqlite). The memory
+# backend's snapshot file is owned by one process too, so running several
+# processes needs the SQLite backend (and DATABASE_BACKEND=sqlite, see
+# database.py).
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Iterator, List, MutableMapping, Optional
+
+import aiosqlite
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+logger = logging.getLogger(__name__)
+
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory").lower()
+SESSION_DATABASE = os.getenv("SESSION_DATABASE", "./sessions.db")
+SESSION_MAX_ENTRIES = int(os.getenv("SESSION_MAX_ENTRIES", "50000"))
+SESSION_SNAPSHOT_PATH = os.getenv("SESSION_SNAPSHOT_PATH", "./sessions.json")
+SESSION_SNAPSHOT_INTERVAL = float(os.getenv("SESSION_SNAPSHOT_INTERVAL", "60"))
+
+DAY = 24 * 60 * 60
+# Namespace -> TTL in seconds. "carts" is handled by the cart_* methods.
+SESSION_TTLS = {
+    "carts": float(os.getenv("CART_TTL", str(7 * DAY))),
+    "checkout": float(os.getenv("CHECKOUT_TTL", str(DAY))),
+    "admins": float(os.getenv("ADMIN_SESSION_TTL", str(30 * DAY))),
+    "pending_admin_password": 10 * 60,
+    "admin_product_flow": DAY,
+    # last /search query, for its page buttons
+    "search": DAY,
+}
+
+
+def dict_to_pairs(value: Dict[Any, Any]) -> List[List[Any]]:
+    # JSON objects only have string keys; pairs keep int product ids intact.
+    return [[key, item] for key, item in value.items()]
+
+
+def pairs_to_dict(pairs: Iterable[List[Any]]) -> Dict[Any, Any]:
+    return {key: item for key, item in pairs}
+
+
+class SessionStore(MutableMapping):
+    def __init__(
+        self,
+        name: str,
+        ttl: float,
+        max_entries: int = SESSION_MAX_ENTRIES,
+        encode: Optional[Callable[[Any], Any]] = None,
+        decode: Optional[Callable[[Any], Any]] = None,
+    ) -> None:
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.encode = encode or (lambda value: value)
+        self.decode = decode or (lambda value: value)
+        # key -> [value, expires_at], least recently used first. With one TTL
+        # per store this is also expiry order, so purging stops at the first
+        # live entry.
+        self._entries: "OrderedDict[Any, List[Any]]" = OrderedDict()
+        self.evicted = 0
+        self.expired = 0
+
+    def _live(self, key: Any) -> Optional[List[Any]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] <= time.time():
+            del self._entries[key]
+            self.expired += 1
+            return None
+        return entry
+
+    def __getitem__(self, key: Any) -> Any:
+        entry = self._live(key)
+        if entry is None:
+            raise KeyError(key)
+        entry[1] = time.time() + self.ttl
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def __setitem__(self, key: Any, value: Any) -> None:
+        self._entries[key] = [value, time.time() + self.ttl]
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evicted += 1
+
+    def __delitem__(self, key: Any) -> None:
+        del self._entries[key]
+
+    def __contains__(self, key: Any) -> bool:
+        return self._live(key) is not None
+
+    def __iter__(self) -> Iterator[Any]:
+        self.purge_expired()
+        return iter(list(self._entries))
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def purge_expired(self) -> int:
+        now = time.time()
+        removed = 0
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if entry[1] > now:
+                break
+            del self._entries[key]
+            removed += 1
+        self.expired += removed
+        return removed
+
+    def dump(self) -> List[List[Any]]:
+        self.purge_expired()
+        return [[key, self.encode(value), expires] for key, (value, expires) in self._entries.items()]
+
+    def restore(self, rows: Iterable[List[Any]]) -> None:
+        now = time.time()
+        for key, value, expires in rows:
+            if expires > now:
+                self._entries[key] = [self.decode(value), expires]
+        # Rows were dumped in LRU order; keep it, then apply the cap.
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+def _write_snapshot_sync(path: str, payload: str) -> None:
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(payload)
+    os.replace(tmp_path, path)
+
+
+async def save_sessions(stores: Iterable[SessionStore], path: str = SESSION_SNAPSHOT_PATH) -> None:
+    payload = json.dumps({store.name: store.dump() for store in stores}, ensure_ascii=False)
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, _write_snapshot_sync, path, payload)
+
+
+def load_sessions(stores: Iterable[SessionStore], path: str = SESSION_SNAPSHOT_PATH) -> None:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            snapshot = json.load(f)
+    except FileNotFoundError:
+        return
+    except ValueError:
+        logger.warning("Ignoring unreadable session snapshot %s", path)
+        return
+    for store in stores:
+        store.restore(snapshot.get(store.name, []))
+
+
+async def run_session_snapshots(
+    stores: Iterable[SessionStore],
+    path: str = SESSION_SNAPSHOT_PATH,
+    interval: float = SESSION_SNAPSHOT_INTERVAL,
+) -> None:
+    stores = list(stores)
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await save_sessions(stores, path)
+        except Exception:
+            logger.exception("Session snapshot failed")
+
+
+class MemorySessionBackend:
+    # Single-process backend over SessionStores; snapshotted to disk.
+    def __init__(self, ttls: Optional[Dict[str, float]] = None) -> None:
+        self.stores: Dict[str, SessionStore] = {}
+        for namespace, ttl in (ttls or SESSION_TTLS).items():
+            if namespace == "carts":
+                self.stores[namespace] = SessionStore(
+                    namespace, ttl, encode=dict_to_pairs, decode=pairs_to_dict
+                )
+            else:
+                self.stores[namespace] = SessionStore(namespace, ttl)
+
+    async def start(self) -> List["asyncio.Task[None]"]:
+        load_sessions(self.stores.values())
+        return [asyncio.create_task(run_session_snapshots(self.stores.values()))]
+
+    async def close(self) -> None:
+        await save_sessions(self.stores.values())
+
+    def fsm_storage(self) -> BaseStorage:
+        return MemoryStorage()
+
+    async def get(self, namespace: str, key: Any, default: Any = None) -> Any:
+        return self.stores[namespace].get(key, default)
+
+    async def set(self, namespace: str, key: Any, value: Any) -> None:
+        self.stores[namespace][key] = value
+
+    async def delete(self, namespace: str, key: Any) -> None:
+        self.stores[namespace].pop(key, None)
+
+    async def contains(self, namespace: str, key: Any) -> bool:
+        return key in self.stores[namespace]
+
+    async def cart_add(self, user_id: int, product_id: int, qty: int = 1) -> int:
+        carts = self.stores["carts"]
+        cart = carts.get(user_id)
+        if cart is None:
+            cart = carts[user_id] = {}
+        cart[product_id] = cart.get(product_id, 0) + qty
+        return cart[product_id]
+
+    async def cart_get(self, user_id: int) -> Dict[int, int]:
+        return dict(self.stores["carts"].get(user_id) or {})
+
+    async def cart_remove(self, user_id: int, product_id: int) -> bool:
+        cart = self.stores["carts"].get(user_id)
+        if not cart or product_id not in cart:
+            return False
+        del cart[product_id]
+        return True
+
+    async def cart_clear(self, user_id: int) -> None:
+        self.stores["carts"].pop(user_id, None)
+
+
+SQLITE_SESSION_SCHEMA = """
+CREATE TABLE IF NOT EXISTS session_kv (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+);
+CREATE INDEX IF NOT EXISTS idx_session_kv_expires ON session_kv (expires_at);
+
+CREATE TABLE IF NOT EXISTS session_carts (
+    user_id INTEGER NOT NULL,
+    product_id INTEGER NOT NULL,
+    qty INTEGER NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (user_id, product_id)
+);
+CREATE INDEX IF NOT EXISTS idx_session_carts_expires ON session_carts (expires_at);
+
+CREATE TABLE IF NOT EXISTS fsm_state (
+    key TEXT PRIMARY KEY,
+    state TEXT,
+    data TEXT NOT NULL DEFAULT '{}'
+);
+"""
+
+
+class SqliteSessionBackend:
+    # Shared backend: every statement commits on its own (autocommit), and
+    # read-modify-write steps are single UPSERT statements, so concurrent bot
+    # processes never lose each other's updates.
+    def __init__(
+        self,
+        path: str = SESSION_DATABASE,
+        ttls: Optional[Dict[str, float]] = None,
+        purge_interval: float = 300.0,
+    ) -> None:
+        self.path = path
+        self.ttls = dict(ttls or SESSION_TTLS)
+        self.purge_interval = purge_interval
+        self._conn: Optional[aiosqlite.Connection] = None
+        self._connect_lock = asyncio.Lock()
+
+    async def _connection(self) -> aiosqlite.Connection:
+        if self._conn is not None:
+            return self._conn
+        async with self._connect_lock:
+            if self._conn is None:
+                conn = await aiosqlite.connect(self.path, isolation_level=None)
+                await conn.execute("PRAGMA journal_mode=WAL")
+                await conn.execute("PRAGMA synchronous=NORMAL")
+                await conn.execute("PRAGMA busy_timeout=5000")
+                await conn.executescript(SQLITE_SESSION_SCHEMA)
+                self._conn = conn
+        return self._conn
+
+    async def start(self) -> List["asyncio.Task[None]"]:
+        await self._connection()
+        return [asyncio.create_task(self._purge_loop())]
+
+    async def close(self) -> None:
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            await conn.close()
+
+    def fsm_storage(self) -> BaseStorage:
+        return SqliteFSMStorage(self)
+
+    async def _purge_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.purge_interval)
+            try:
+                await self.purge_expired()
+            except Exception:
+                logger.exception("Session purge failed")
+
+    async def purge_expired(self) -> None:
+        conn = await self._connection()
+        now = time.time()
+        await conn.execute("DELETE FROM session_kv WHERE expires_at <= ?", (now,))
+        await conn.execute("DELETE FROM session_carts WHERE expires_at <= ?", (now,))
+
+    def _expires(self, namespace: str) -> float:
+        return time.time() + self.ttls[namespace]
+
+    async def get(self, namespace: str, key: Any, default: Any = None) -> Any:
+        conn = await self._connection()
+        rows = await conn.execute_fetchall(
+            "SELECT value FROM session_kv WHERE namespace = ? AND key = ? AND expires_at > ?",
+            (namespace, str(key), time.time()),
+        )
+        rows = list(rows)
+        return json.loads(rows[0][0]) if rows else default
+
+    async def set(self, namespace: str, key: Any, value: Any) -> None:
+        conn = await self._connection()
+        await conn.execute(
+            "INSERT INTO session_kv (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)"
+            " ON CONFLICT(namespace, key) DO UPDATE"
+            " SET value = excluded.value, expires_at = excluded.expires_at",
+            (namespace, str(key), json.dumps(value, ensure_ascii=False), self._expires(namespace)),
+        )
+
+    async def delete(self, namespace: str, key: Any) -> None:
+        conn = await self._connection()
+        await conn.execute(
+            "DELETE FROM session_kv WHERE namespace = ? AND key = ?", (namespace, str(key))
+        )
+
+    async def contains(self, namespace: str, key: Any) -> bool:
+        conn = await self._connection()
+        rows = await conn.execute_fetchall(
+            "SELECT 1 FROM session_kv WHERE namespace = ? AND key = ? AND expires_at > ?",
+            (namespace, str(key), time.time()),
+        )
+        return bool(list(rows))
+
+    async def cart_add(self, user_id: int, product_id: int, qty: int = 1) -> int:
+        conn = await self._connection()
+        expires = self._expires("carts")
+        rows = await conn.execute_fetchall(
+            "INSERT INTO session_carts (user_id, product_id, qty, expires_at) VALUES (?, ?, ?, ?)"
+            " ON CONFLICT(user_id, product_id) DO UPDATE SET"
+            " qty = CASE WHEN session_carts.expires_at > ? THEN session_carts.qty ELSE 0 END"
+            " + excluded.qty,"
+            " expires_at = excluded.expires_at"
+            " RETURNING qty",
+            (user_id, product_id, qty, expires, time.time()),
+        )
+        # Adding to a cart keeps the whole cart alive, as in the memory backend.
+        await conn.execute(
+            "UPDATE session_carts SET expires_at = ? WHERE user_id = ?", (expires, user_id)
+        )
+        return list(rows)[0][0]
+
+    async def cart_get(self, user_id: int) -> Dict[int, int]:
+        conn = await self._connection()
+        rows = await conn.execute_fetchall(
+            "SELECT product_id, qty FROM session_carts"
+            " WHERE user_id = ? AND expires_at > ? ORDER BY rowid",
+            (user_id, time.time()),
+        )
+        return {product_id: qty for product_id, qty in rows}
+
+    async def cart_remove(self, user_id: int, product_id: int) -> bool:
+        conn = await self._connection()
+        cursor = await conn.execute(
+            "DELETE FROM session_carts WHERE user_id = ? AND product_id = ? AND expires_at > ?",
+            (user_id, product_id, time.time()),
+        )
+        return cursor.rowcount > 0
+
+    async def cart_clear(self, user_id: int) -> None:
+        conn = await self._connection()
+        await conn.execute("DELETE FROM session_carts WHERE user_id = ?", (user_id,))
+
+
+class SqliteFSMStorage(BaseStorage):
+    # aiogram FSM storage on the shared session database, so FSM states set by
+    # one worker process are visible to the others.
+    def __init__(self, backend: SqliteSessionBackend) -> None:
+        self.backend = backend
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return ":".join(
+            str(part)
+            for part in (
+                key.bot_id,
+                key.chat_id,
+                key.user_id,
+                key.thread_id or "",
+                key.business_connection_id or "",
+                key.destiny,
+            )
+        )
+
+    async def set_state(self, key: StorageKey, state: Any = None) -> None:
+        value = state.state if isinstance(state, State) else state
+        conn = await self.backend._connection()
+        await conn.execute(
+            "INSERT INTO fsm_state (key, state) VALUES (?, ?)"
+            " ON CONFLICT(key) DO UPDATE SET state = excluded.state",
+            (self._key(key), value),
+        )
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        conn = await self.backend._connection()
+        rows = list(
+            await conn.execute_fetchall(
+                "SELECT state FROM fsm_state WHERE key = ?", (self._key(key),)
+            )
+        )
+        return rows[0][0] if rows else None
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        conn = await self.backend._connection()
+        await conn.execute(
+            "INSERT INTO fsm_state (key, data) VALUES (?, ?)"
+            " ON CONFLICT(key) DO UPDATE SET data = excluded.data",
+            (self._key(key), json.dumps(data, ensure_ascii=False)),
+        )
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        conn = await self.backend._connection()
+        rows = list(
+            await conn.execute_fetchall(
+                "SELECT data FROM fsm_state WHERE key = ?", (self._key(key),)
+            )
+        )
+        return json.loads(rows[0][0]) if rows else {}
+
+    async def close(self) -> None:
+        await self.backend.close()
+
+
+def create_session_backend(kind: str = SESSION_BACKEND):
+    if kind == "sqlite":
+        return SqliteSessionBackend()
+    if kind == "memory":
+        return MemorySessionBackend()
+    raise ValueError(f"Unknown SESSION_BACKEND: {kind}")
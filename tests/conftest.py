@@ -0,0 +1,67 @@
+# tests/conftest.py
+# database.py reads its configuration when it is imported, so the test store
+# is set up here, before any test module imports it: one temporary directory
+# for the whole session, journal mode on (so replay and compaction are
+# covered), no commit window. The `store` fixture empties it for each test;
+# `sqlite_store` adds the SQLite backend in the same directory.
+#
+# The module keeps asyncio locks and events that bind to the first loop that
+# waits on them, so every test runs on the session loop:
+#   pytestmark = pytest.mark.asyncio(loop_scope="session")
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest_asyncio
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+STORE_DIR = tempfile.mkdtemp(prefix="shop_tests_")
+os.environ["DATABASE"] = os.path.join(STORE_DIR, "shop.json")
+os.environ["DATABASE_JOURNAL"] = "1"
+os.environ["DATABASE_COMMIT_WINDOW_MS"] = "0"
+os.environ.pop("DATABASE_JOURNAL_PATH", None)
+os.environ.pop("DATABASE_ARCHIVE_DIR", None)
+os.environ.pop("DATABASE_BACKEND", None)
+os.environ.pop("DATABASE_FORMAT", None)
+
+import database  # noqa: E402
+
+
+def reset_store() -> None:
+    # Forgets the cached store and removes its files (the lock file stays:
+    # this process holds it).
+    database._invalidate_cache()
+    for name in os.listdir(STORE_DIR):
+        path = os.path.join(STORE_DIR, name)
+        if path == database.LOCK_PATH:
+            continue
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+
+
+@pytest_asyncio.fixture(loop_scope="session")
+async def store():
+    await database.close_db()
+    reset_store()
+    yield database
+    await database.close_db()
+
+
+@pytest_asyncio.fixture(loop_scope="session")
+async def sqlite_store(store, monkeypatch):
+    # The SQLite backend on shop.db next to the (emptied) JSON store, so a
+    # test can run the same calls on both and migrate from one to the other.
+    import database_sqlite
+
+    monkeypatch.setattr(database_sqlite, "SQLITE_PATH", os.path.join(STORE_DIR, "shop.db"))
+    yield database_sqlite
+    await database_sqlite.close_db()
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(STORE_DIR, ignore_errors=True)
@@ -0,0 +1,190 @@
+# tests/test_database.py
+# The JSON store engine (journal mode, see conftest.py): recovery from a crash
+# that tore the journal's last record, migration of a single-file shop.json
+# from before segments, and journal compaction.
+import json
+import os
+
+import pytest
+
+from codec import decode
+
+pytestmark = pytest.mark.asyncio(loop_scope="session")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def restart(db):
+    # What a new process sees: nothing cached, only the files.
+    db._invalidate_cache()
+
+
+def journal_records(db):
+    with open(db.JOURNAL_PATH, "rb") as f:
+        return f.read().splitlines(keepends=True)
+
+
+def segment_files(db):
+    directory = os.path.dirname(db.DB_PATH)
+    return sorted(name for name in os.listdir(directory) if db._SEGMENT_FILE.fullmatch(name))
+
+
+def baseline_store():
+    # The shop.json shipped with the bot, as the original code wrote it (one
+    # file: no segments, journal_seq or stats), with a few orders added.
+    with open(os.path.join(ROOT, "shop.json"), encoding="utf-8") as f:
+        data = json.load(f)
+    data["meta"].update(next_product_id=3, next_order_id=3, next_order_item_id=4)
+    data["products"].append(dict(data["products"][0], id=2, name="Mashina", category="🧸 O‘yinchoqlar"))
+    data["orders"] = [
+        {
+            "id": order_id,
+            "user_id": 7,
+            "fullname": "Ali Valiyev",
+            "address": "Toshkent",
+            "phone": "+998901234567",
+            "total": total,
+            "status": status,
+            "created_ts": "2024-05-01T10:00:00.000001",
+        }
+        for order_id, total, status in ((1, 45000, "paid"), (2, 20000, "pending"))
+    ]
+    data["order_items"] = [
+        {"id": 1, "order_id": 1, "product_id": 1, "qty": 3, "price": 15000},
+        {"id": 2, "order_id": 2, "product_id": 2, "qty": 1, "price": 10000},
+        {"id": 3, "order_id": 2, "product_id": 2, "qty": 1, "price": 10000},
+    ]
+    return data
+
+
+async def test_replay_drops_a_torn_journal_tail(store):
+    await store.init_db()
+    pid = await store.add_product("Ko‘ylak", "👗 Qizlar kiyimlari", 15000, "", None)
+    first = await store.place_order(1, "Ali", "Toshkent", "+998901234567", [(pid, 2, 15000)])
+    second = await store.place_order(2, "Vali", "Samarqand", "+998907654321", [(pid, 1, 15000)])
+    await store.update_order_status(first, "paid")
+    await store.close_db()
+    records = journal_records(store)
+    assert len(records) == 4
+
+    # The process died halfway through appending the status change.
+    with open(store.JOURNAL_PATH, "wb") as f:
+        f.write(b"".join(records[:-1]) + records[-1][: len(records[-1]) // 2])
+    restart(store)
+
+    assert (await store.get_order(first))[6] == "pending"
+    assert (await store.get_order(second))[6] == "pending"
+    assert await store.get_order_items(second) == [(2, second, pid, 1, 15000)]
+    assert (await store.get_stats())["statuses"] == {"pending": (2, 45000)}
+    # The torn bytes are cut off, so the next record starts on its own line.
+    assert journal_records(store) == records[:-1]
+
+    await store.update_order_status(second, "cancelled")
+    await store.close_db()
+    restart(store)
+    assert (await store.get_order(first))[6] == "pending"
+    assert (await store.get_order(second))[6] == "cancelled"
+    assert [json.loads(line)["seq"] for line in journal_records(store)] == [1, 2, 3, 4]
+
+
+async def test_torn_record_without_newline_is_not_replayed(store):
+    await store.init_db()
+    pid = await store.add_product("Ko‘ylak", "👗 Qizlar kiyimlari", 15000, "", None)
+    await store.close_db()
+    records = journal_records(store)
+    # A whole record whose newline never reached the disk is still torn.
+    with open(store.JOURNAL_PATH, "wb") as f:
+        f.write(b"".join(records)[:-1])
+    restart(store)
+    assert await store.get_product(pid) is None
+    assert await store.list_all_products() == []
+
+
+async def test_baseline_single_file_store_is_migrated(store):
+    baseline = baseline_store()
+    with open(store.DB_PATH, "w", encoding="utf-8") as f:
+        json.dump(baseline, f, ensure_ascii=False, indent=2)
+    restart(store)
+
+    await store.init_db()
+    await store.close_db()
+    with open(store.DB_PATH, "rb") as f:
+        manifest = decode(f.read())
+    assert sorted(manifest["segments"]) == sorted(store.SEGMENTS)
+    assert segment_files(store) == sorted(manifest["segments"].values())
+
+    for _ in range(2):  # as migrated in memory, then as read back from the segments
+        assert [row[0] for row in await store.list_all_products()] == [1, 2]
+        assert (await store.get_product(1))[1] == "Kiyim"
+        assert (await store.get_order(1))[5:7] == (45000, "paid")
+        assert len(await store.get_order_items(2)) == 2
+        assert (await store.get_settings())["categories"] == baseline["settings"]["categories"]
+        stats = await store.get_stats()
+        assert stats["statuses"] == {"paid": (1, 45000), "pending": (1, 20000)}
+        assert (1, "Kiyim", "👗 Qizlar kiyimlari", 3, 45000) in stats["top_products"]
+        restart(store)
+
+    # ids continue where the baseline left off
+    assert await store.place_order(7, "Ali", "Toshkent", "+998901234567", [(2, 1, 10000)]) == 3
+    assert await store.add_product("Qo‘g‘irchoq", "🧸 O‘yinchoqlar", 30000, "", None) == 3
+
+
+async def test_compaction_folds_the_journal_into_the_snapshot(store):
+    await store.init_db()
+    pid = await store.add_product("Ko‘ylak", "👗 Qizlar kiyimlari", 15000, "", None)
+    orders = [
+        await store.place_order(user, "Ali", "Toshkent", "+998901234567", [(pid, 1, 15000)])
+        for user in range(5)
+    ]
+    await store.update_orders_status(orders[:2], "paid")
+    await store.update_product(pid, price=17000)
+    await store.close_db()
+    segments_before = segment_files(store)
+    assert journal_records(store)
+
+    assert await store.compact_journal()
+    assert journal_records(store) == []
+    with open(store.DB_PATH, "rb") as f:
+        manifest = decode(f.read())
+    assert manifest["meta"]["journal_seq"] == 8
+    # replaced segment files are gone; only the manifest's remain
+    assert segment_files(store) == sorted(manifest["segments"].values())
+    assert segment_files(store) != segments_before
+
+    restart(store)
+    assert [row[0] for row in await store.list_orders(limit=10)] == orders[::-1]
+    assert (await store.get_product(pid))[3] == 17000
+    assert (await store.get_stats())["statuses"] == {"paid": (2, 30000), "pending": (3, 45000)}
+
+    # Records after the compaction replay on top of it, once.
+    await store.update_order_status(orders[2], "cancelled")
+    await store.close_db()
+    assert [json.loads(line)["seq"] for line in journal_records(store)] == [9]
+    restart(store)
+    statuses = [(await store.get_order(oid))[6] for oid in orders]
+    assert statuses == ["paid", "paid", "cancelled", "pending", "pending"]
+    assert (await store.get_stats())["statuses"] == {
+        "paid": (2, 30000),
+        "pending": (2, 30000),
+        "cancelled": (1, 15000),
+    }
+
+
+async def test_archived_orders_are_read_but_not_updated(store):
+    await store.init_db()
+    pid = await store.add_product("Ko‘ylak", "👗 Qizlar kiyimlari", 15000, "", None)
+    old = await store.place_order(1, "Ali", "Toshkent", "+998901234567", [(pid, 2, 15000)])
+    hot = await store.place_order(2, "Vali", "Samarqand", "+998907654321", [(pid, 1, 15000)])
+    await store.update_order_status(old, "delivered")
+    assert await store.archive_orders(older_than_days=0) == 1
+    assert [row[0] for row in await store.list_orders(limit=10)] == [hot]
+
+    assert (await store.get_order(old))[5:7] == (30000, "delivered")
+    assert await store.get_order_items(old) == [(1, old, pid, 2, 15000)]
+    assert await store.update_order_status(old, "cancelled") is False
+    assert await store.is_order_archived(old)
+    assert await store.update_orders_status([old, hot], "paid") == [hot]
+    assert (await store.get_order(old))[6] == "delivered"
+    assert not await store.is_order_archived(hot)
+    assert await store.update_order_status(999, "paid") is False
+    assert not await store.is_order_archived(999)
@@ -0,0 +1,83 @@
+# tests/test_database_sqlite.py
+# The SQLite backend against the JSON store: migrating a shop.json into
+# shop.db carries every table over, the statistics triggers count what the
+# JSON store counts, and a database that already has data is not imported
+# into again.
+import json
+
+import pytest
+
+from test_database import baseline_store
+
+pytestmark = pytest.mark.asyncio(loop_scope="session")
+
+
+async def snapshot(db, order_ids):
+    # What the bot can read back from a backend.
+    return {
+        "products": await db.list_all_products(),
+        "orders": [await db.get_order(oid) for oid in order_ids],
+        "order_items": [await db.get_order_items(oid) for oid in order_ids],
+        "settings": await db.get_settings(),
+        "stats": await db.get_stats(),
+    }
+
+
+async def test_baseline_store_is_migrated(store, sqlite_store):
+    baseline = baseline_store()
+    with open(store.DB_PATH, "w", encoding="utf-8") as f:
+        json.dump(baseline, f, ensure_ascii=False, indent=2)
+
+    counts = sqlite_store.migrate_json_to_sqlite(store.DB_PATH, sqlite_store.SQLITE_PATH)
+    assert counts == {"products": 2, "orders": 2, "order_items": 3}
+
+    await sqlite_store.init_db()
+    migrated = await snapshot(sqlite_store, [1, 2])
+    assert migrated == await snapshot(store, [1, 2])
+    assert [row[0] for row in migrated["products"]] == [1, 2]
+    assert migrated["orders"][0][5:7] == (45000, "paid")
+    assert len(migrated["order_items"][1]) == 2
+    assert migrated["settings"]["categories"] == baseline["settings"]["categories"]
+    assert migrated["stats"]["statuses"] == {"paid": (1, 45000), "pending": (1, 20000)}
+
+    # ids continue where the JSON store left off
+    assert await sqlite_store.place_order(7, "Ali", "Toshkent", "+998901234567", [(2, 1, 10000)]) == 3
+    assert await sqlite_store.add_product("Qo‘g‘irchoq", "🧸 O‘yinchoqlar", 30000, "", None) == 3
+
+
+async def test_stats_triggers_match_the_json_store(store, sqlite_store):
+    results = []
+    for db in (store, sqlite_store):
+        await db.init_db()
+        dress = await db.add_product("Ko‘ylak", "👗 Qizlar kiyimlari", 15000, "", None)
+        car = await db.add_product("Mashina", "🧸 O‘yinchoqlar", 40000, "", None)
+        orders = [
+            await db.place_order(1, "Ali", "Toshkent", "+998901234567", [(dress, 2, 15000)]),
+            await db.place_order(2, "Vali", "Samarqand", "+998907654321", [(dress, 1, 15000), (car, 1, 40000)]),
+            await db.place_order(3, "Olim", "Buxoro", "+998901112233", [(car, 3, 40000)]),
+        ]
+        await db.update_order_status(orders[0], "paid")
+        await db.update_order_status(orders[1], "cancelled")
+        await db.update_orders_status(orders, "processing", from_statuses=["pending"])
+        # A cancelled order counted again once it is reopened.
+        await db.update_order_status(orders[1], "pending")
+        await db.update_product(car, category="🚗 Mashinalar")
+        results.append(await db.get_stats(days=7, top=5))
+
+    json_stats, sqlite_stats = results
+    assert sqlite_stats == json_stats
+    assert json_stats["statuses"] == {"paid": (1, 30000), "pending": (1, 55000), "processing": (1, 120000)}
+
+
+async def test_second_migration_is_refused(store, sqlite_store):
+    with open(store.DB_PATH, "w", encoding="utf-8") as f:
+        json.dump(baseline_store(), f, ensure_ascii=False, indent=2)
+    sqlite_store.migrate_json_to_sqlite(store.DB_PATH, sqlite_store.SQLITE_PATH)
+    await sqlite_store.update_order_status(2, "shipped")
+    await sqlite_store.close_db()
+
+    with pytest.raises(RuntimeError, match="already has"):
+        sqlite_store.migrate_json_to_sqlite(store.DB_PATH, sqlite_store.SQLITE_PATH)
+    # Nothing was overwritten with the JSON copy.
+    assert (await sqlite_store.get_order(2))[6] == "shipped"
+    assert [row[0] for row in await sqlite_store.list_all_products()] == [1, 2]
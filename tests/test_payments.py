@@ -0,0 +1,209 @@
+# tests/test_payments.py
+# PaymentInbox end to end: signed callbacks go through the aiohttp handler,
+# the worker marks orders paid in the test store the way main.py does, and
+# every status change and notification is recorded.
+import asyncio
+import json
+from collections import Counter
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from payments import PAYMENT_SIGNATURE_HEADER, PaymentInbox, sign
+
+pytestmark = pytest.mark.asyncio(loop_scope="session")
+
+SECRET = "test-secret"
+PAYABLE = ["pending", "processing"]
+
+
+class Shop:
+    # The apply/notify pair main.py gives the inbox, keeping what they did.
+    def __init__(self, db):
+        self.db = db
+        self.changed = Counter()
+        self.notified = Counter()
+
+    async def mark_paid(self, order_ids):
+        changed = await self.db.update_orders_status(order_ids, "paid", from_statuses=PAYABLE)
+        self.changed.update(changed)
+        return changed
+
+    async def notify(self, order_ids):
+        self.notified.update(order_ids)
+
+
+async def place_orders(db, statuses):
+    pid = await db.add_product("Ko‘ylak", "👗 Qizlar kiyimlari", 15000, "", None)
+    ids = []
+    for status in statuses:
+        order_id = await db.place_order(1, "Ali Valiyev", "Toshkent", "+998901234567", [(pid, 1, 15000)])
+        if status != "pending":
+            await db.update_order_status(order_id, status)
+        ids.append(order_id)
+    return ids
+
+
+def callback(order_id, transaction=None, secret=SECRET):
+    payload = {"order": order_id, "paid": True, "provider": "click"}
+    if transaction:
+        payload["transaction"] = transaction
+    body = json.dumps(payload).encode()
+    return body, {PAYMENT_SIGNATURE_HEADER: sign(secret, body), "Content-Type": "application/json"}
+
+
+async def post_all(client, callbacks):
+    responses = await asyncio.gather(
+        *(client.post("/pay", data=body, headers=headers) for body, headers in callbacks)
+    )
+    statuses = [response.status for response in responses]
+    for response in responses:
+        response.release()
+    return statuses
+
+
+async def drained(inbox, timeout=5.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while inbox.queue_depth() or inbox._pending:
+        assert asyncio.get_running_loop().time() < deadline, "payment events were not applied"
+        await asyncio.sleep(0.01)
+
+
+async def serve(inbox):
+    app = web.Application()
+    app.router.add_post("/pay", inbox.handle)
+    client = TestClient(TestServer(app))
+    await client.start_server()
+    return client
+
+
+async def stop(client, tasks):
+    await client.close()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def test_duplicate_and_concurrent_callbacks_change_each_order_once(store, tmp_path):
+    pending, processing, cancelled, shipped = await place_orders(
+        store, ["pending", "processing", "cancelled", "shipped"]
+    )
+    shop = Shop(store)
+    path = str(tmp_path / "payments.log")
+    inbox = PaymentInbox(shop.mark_paid, shop.notify, path=path, batch_wait=0.05, secret=SECRET)
+    tasks = await inbox.start()
+    client = await serve(inbox)
+    try:
+        storm = []
+        for _ in range(5):
+            # provider retries of one transaction, a second transaction for
+            # the same order, a callback without a transaction id, and late
+            # callbacks for orders that must not become paid
+            storm += [
+                callback(pending, "txn-1"),
+                callback(pending, "txn-2"),
+                callback(processing),
+                callback(cancelled, "txn-3"),
+                callback(shipped, "txn-4"),
+            ]
+        assert await post_all(client, storm) == [200] * len(storm)
+        await drained(inbox)
+        assert inbox.metrics["received"] == 5
+        assert inbox.metrics["duplicates"] == len(storm) - 5
+
+        # retries after the batch was applied are acknowledged and ignored
+        assert await post_all(client, storm[:5]) == [200] * 5
+        await drained(inbox)
+    finally:
+        await stop(client, tasks)
+
+    assert shop.changed == Counter({pending: 1, processing: 1})
+    assert shop.notified == Counter({pending: 1, processing: 1})
+    assert [(await store.get_order(oid))[6] for oid in (pending, processing, cancelled, shipped)] == [
+        "paid",
+        "paid",
+        "cancelled",
+        "shipped",
+    ]
+
+    # a restarted process replays nothing already applied and still
+    # recognizes the retries
+    restarted = PaymentInbox(shop.mark_paid, shop.notify, path=path, batch_wait=0.05, secret=SECRET)
+    tasks = await restarted.start()
+    client = await serve(restarted)
+    try:
+        assert restarted.queue_depth() == 0
+        assert await post_all(client, storm) == [200] * len(storm)
+        await drained(restarted)
+        assert restarted.metrics["received"] == 0
+    finally:
+        await stop(client, tasks)
+    assert shop.changed == Counter({pending: 1, processing: 1})
+    assert shop.notified == Counter({pending: 1, processing: 1})
+
+
+async def test_unapplied_events_are_applied_after_restart(store, tmp_path):
+    (order_id,) = await place_orders(store, ["pending"])
+    path = str(tmp_path / "payments.log")
+    body, headers = callback(order_id, "txn-1")
+
+    async def failing(order_ids):
+        raise RuntimeError("database is down")
+
+    # recorded and acknowledged, but the process stops before applying it
+    crashed = PaymentInbox(failing, failing, path=path, secret=SECRET)
+    await crashed.record("click:txn-1", order_id, "click")
+
+    shop = Shop(store)
+    inbox = PaymentInbox(shop.mark_paid, shop.notify, path=path, batch_wait=0.05, secret=SECRET)
+    tasks = await inbox.start()
+    client = await serve(inbox)
+    try:
+        assert await post_all(client, [(body, headers)] * 3) == [200] * 3
+        await drained(inbox)
+    finally:
+        await stop(client, tasks)
+    assert shop.changed == Counter({order_id: 1})
+    assert shop.notified == Counter({order_id: 1})
+
+
+async def test_bad_signatures_are_rejected(store, tmp_path):
+    (order_id,) = await place_orders(store, ["pending"])
+    shop = Shop(store)
+    path = tmp_path / "payments.log"
+    inbox = PaymentInbox(shop.mark_paid, shop.notify, path=str(path), batch_wait=0.05, secret=SECRET)
+    tasks = await inbox.start()
+    client = await serve(inbox)
+    body, headers = callback(order_id, "txn-1")
+    forged = [
+        callback(order_id, "txn-1", secret="wrong-secret"),
+        (body, {"Content-Type": "application/json"}),
+        (body, {PAYMENT_SIGNATURE_HEADER: "00" * 32}),
+        # a valid signature for a different body
+        (json.dumps({"order": order_id + 1, "paid": True}).encode(), headers),
+    ]
+    try:
+        assert await post_all(client, forged) == [403] * len(forged)
+        await asyncio.sleep(0.1)
+    finally:
+        await stop(client, tasks)
+    assert inbox.metrics["rejected"] == len(forged)
+    assert inbox.metrics["received"] == 0
+    assert not path.exists() or path.read_text() == ""
+    assert not shop.changed and not shop.notified
+    assert (await store.get_order(order_id))[6] == "pending"
+
+
+async def test_callbacks_are_refused_without_a_secret(store, tmp_path):
+    (order_id,) = await place_orders(store, ["pending"])
+    shop = Shop(store)
+    inbox = PaymentInbox(shop.mark_paid, shop.notify, path=str(tmp_path / "payments.log"), secret="")
+    tasks = await inbox.start()
+    client = await serve(inbox)
+    try:
+        assert await post_all(client, [callback(order_id, "txn-1", secret="")]) == [403]
+    finally:
+        await stop(client, tasks)
+    assert inbox.metrics["rejected"] == 1
+    assert not shop.changed
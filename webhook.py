@@ -0,0 +1,126 @@
+# webhook.py
+# Telegram webhook ingestion (BOT_MODE=webhook). The aiohttp handler checks
+# the secret token header, queues the raw update and answers 200 right away;
+# a pool of workers feeds queued updates to the dispatcher. Updates from one
+# chat always go to the same worker, so they are handled in arrival order.
+# When a worker's queue is full the handler answers 503 and Telegram
+# redelivers the update later.
+import asyncio
+import hashlib
+import hmac
+import logging
+import os
+from typing import Any, Dict, List, Optional
+
+from aiogram import Bot, Dispatcher, types
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+WEBHOOK_QUEUE_SIZE = int(os.getenv("TELEGRAM_WEBHOOK_QUEUE_SIZE", "1000"))
+WEBHOOK_WORKERS = int(os.getenv("TELEGRAM_WEBHOOK_WORKERS", "8"))
+
+
+def default_secret(bot_token: str) -> str:
+    # Same value on every instance behind the proxy without extra config;
+    # Telegram accepts 1-256 characters of [A-Za-z0-9_-].
+    return hashlib.sha256(("webhook:" + bot_token).encode()).hexdigest()
+
+
+def update_chat_key(data: Dict[str, Any]) -> Any:
+    for key, value in data.items():
+        if key == "update_id" or not isinstance(value, dict):
+            continue
+        chat = value.get("chat") or (value.get("message") or {}).get("chat")
+        if chat and "id" in chat:
+            return chat["id"]
+        sender = value.get("from") or value.get("user")
+        if sender and "id" in sender:
+            return sender["id"]
+    return data.get("update_id", 0)
+
+
+class WebhookIngress:
+    def __init__(
+        self,
+        dp: Dispatcher,
+        bot: Bot,
+        secret: str,
+        queue_size: int = WEBHOOK_QUEUE_SIZE,
+        workers: int = WEBHOOK_WORKERS,
+    ) -> None:
+        self.dp = dp
+        self.bot = bot
+        self.secret = secret
+        workers = max(1, workers)
+        per_worker = max(1, -(-queue_size // workers))
+        self._queues: List["asyncio.Queue[Dict[str, Any]]"] = [
+            asyncio.Queue(per_worker) for _ in range(workers)
+        ]
+        self._workers: List["asyncio.Task[None]"] = []
+        self._accepting = False
+        self.metrics: Dict[str, int] = {
+            "received": 0,
+            "rejected": 0,  # wrong or missing secret token
+            "overflow": 0,  # answered 503, Telegram retries
+            "processed": 0,
+            "failed": 0,
+        }
+
+    def queue_depth(self) -> int:
+        return sum(queue.qsize() for queue in self._queues)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        token = request.headers.get(SECRET_HEADER, "")
+        if not hmac.compare_digest(token.encode(), self.secret.encode()):
+            self.metrics["rejected"] += 1
+            return web.Response(status=401)
+        if not self._accepting:
+            return web.Response(status=503)
+        try:
+            data = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        if not isinstance(data, dict):
+            return web.Response(status=400)
+        self.metrics["received"] += 1
+        queue = self._queues[hash(update_chat_key(data)) % len(self._queues)]
+        try:
+            queue.put_nowait(data)
+        except asyncio.QueueFull:
+            self.metrics["overflow"] += 1
+            return web.Response(status=503, headers={"Retry-After": "1"})
+        return web.Response()
+
+    async def _work(self, queue: "asyncio.Queue[Dict[str, Any]]") -> None:
+        while True:
+            data = await queue.get()
+            try:
+                update = types.Update.model_validate(data, context={"bot": self.bot})
+                await self.dp.feed_update(self.bot, update)
+                self.metrics["processed"] += 1
+            except Exception:
+                self.metrics["failed"] += 1
+                logger.exception("Failed to process update %s", data.get("update_id"))
+            finally:
+                queue.task_done()
+
+    def start(self) -> List["asyncio.Task[None]"]:
+        self._accepting = True
+        self._workers = [asyncio.create_task(self._work(queue)) for queue in self._queues]
+        return list(self._workers)
+
+    async def close(self, timeout: Optional[float] = 10.0) -> None:
+        # Stop taking updates, let workers finish what was acknowledged.
+        self._accepting = False
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(queue.join() for queue in self._queues)), timeout
+            )
+        except asyncio.TimeoutError:
+            logger.warning("Dropping %d queued updates on shutdown", self.queue_depth())
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []